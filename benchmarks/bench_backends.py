@@ -0,0 +1,62 @@
+"""
+Compares the JSON and SQLite database backends.
+
+    python -m benchmarks.bench_backends --rows 100000
+
+Times a full write, a full read, a sort on Size, and a refresh that changes
+1% of the rows and removes another 1%.
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from pygeonhole.database import DatabaseHandler
+
+def make_rows(count: int) -> list:
+    return [
+        {
+            "Name": f"file_{i}.txt",
+            "Mode": "-rw-r--r--",
+            "Last Modified": "2024-01-05 18:19:26",
+            "Size": str(i * 7919 % 100003),
+            "Ext.": ".txt",
+            "_stat": [i, i * 7919 % 100003, i, i],
+        }
+        for i in range(count)
+    ]
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    step = 100
+    changed = [dict(item, Size="0") for item in rows[::step]]
+    removed = [item["Name"] for item in rows[1::step]]
+    removed_set = set(removed)
+    refreshed = [dict(item, Size="0") if i % step == 0 else item
+                 for i, item in enumerate(rows) if item["Name"] not in removed_set]
+
+    print(f"{'backend':>8} | {'write s':>8} | {'read s':>8} | {'sort s':>8} | {'refresh s':>9} | {'size MB':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for suffix in (".json", ".sqlite"):
+            db_path = Path(tmp) / ("bench" + suffix)
+            handler = DatabaseHandler(db_path)
+            write_time = timed(lambda: handler.write_db_data(rows))
+            read_time = timed(handler.read_db_data)
+            sort_time = timed(lambda: handler.reorder_db_data(
+                handler.sort_db_data(rows, "Size", True, False).data, "Size", True, False
+            ))
+            refresh_time = timed(lambda: handler.update_db_data(refreshed, changed, removed))
+            size = db_path.stat().st_size / 2**20
+            print(f"{suffix[1:]:>8} | {write_time:>8.3f} | {read_time:>8.3f} | {sort_time:>8.3f} | {refresh_time:>9.3f} | {size:>8.1f}")
+
+if __name__ == "__main__":
+    main()
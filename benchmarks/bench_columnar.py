@@ -0,0 +1,44 @@
+"""
+Compares the columnar database file with the JSON one.
+
+    python -m benchmarks.bench_columnar --rows 100000
+
+Reports the file size, a full load that touches every row, loading the
+first page of rows as `show -n 50` does, and a sort on Size followed by
+reading that first page.
+"""
+import argparse
+import tempfile
+from pathlib import Path
+
+from benchmarks.bench_backends import make_rows, timed
+from pygeonhole.database import DatabaseHandler
+
+PAGE = 50
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    for item in rows:
+        item["_Size"] = int(item["Size"])
+
+    print(f"{'backend':>8} | {'size MB':>8} | {'full load s':>11} | {'page load s':>11} | {'sort+page s':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for suffix in (".json", ".phc"):
+            db_path = Path(tmp) / ("bench" + suffix)
+            handler = DatabaseHandler(db_path)
+            handler.write_db_data(rows)
+            size = db_path.stat().st_size / 2**20
+
+            full_time = timed(lambda: [item["Name"] for item in handler.read_db_data().data])
+            page_time = timed(lambda: handler.read_db_data().data[:PAGE])
+            sort_time = timed(lambda: handler.sort_db_data(
+                handler.read_db_data().data, "Size", True, False
+            ).data[:PAGE])
+            print(f"{suffix[1:]:>8} | {size:>8.1f} | {full_time:>11.3f} | {page_time:>11.3f} | {sort_time:>11.3f}")
+
+if __name__ == "__main__":
+    main()
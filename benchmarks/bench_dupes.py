@@ -0,0 +1,57 @@
+"""
+dupes on files of the same size, against hashing every file.
+
+    python -m benchmarks.bench_dupes --files 2000 --size 262144 --duplicates 200
+
+Writes files of one size, duplicates of them sharing their contents with an
+earlier file, then finds the duplicates with an empty digest cache, again
+with the cache it filled, and by hashing every file in full.
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from pygeonhole import hashing
+
+def make_files(root: Path, files: int, size: int, duplicates: int) -> list:
+    items = []
+    for i in range(files):
+        path = root / f"file_{i}.bin"
+        # Duplicates copy an earlier file, the rest differ in their first bytes
+        source = i % (files - duplicates) if i >= files - duplicates else i
+        path.write_bytes(source.to_bytes(8, "big") + b"\0" * (size - 8))
+        items.append((path.name, str(path), path.stat()))
+    return items
+
+def hash_all(items: list) -> int:
+    cache = hashing.HashCache()
+    by_digest = {}
+    for name, path, stats in items:
+        by_digest.setdefault(hashing.file_digest(path, stats, cache), []).append(name)
+    return sum(len(names) > 1 for names in by_digest.values())
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--size", type=int, default=256 * 2**10)
+    parser.add_argument("--duplicates", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=hashing.HASH_WORKERS)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        items = make_files(Path(tmp), args.files, args.size, args.duplicates)
+        cache = hashing.HashCache()
+        runs = [
+            ("dupes (cold)", lambda: len(hashing.find_duplicates(items, args.workers, cache).groups)),
+            ("dupes (warm)", lambda: len(hashing.find_duplicates(items, args.workers, cache).groups)),
+            ("hash every file", lambda: hash_all(items)),
+        ]
+        print(f"{'run':>15} | {'groups':>6} | {'seconds':>8}")
+        for label, run in runs:
+            start = time.perf_counter()
+            groups = run()
+            print(f"{label:>15} | {groups:>6} | {time.perf_counter() - start:>8.3f}")
+
+if __name__ == "__main__":
+    main()
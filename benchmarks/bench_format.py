@@ -0,0 +1,80 @@
+"""
+Regression benchmark for formatting a directory into database rows.
+
+    python -m benchmarks.bench_format --sizes 1000 2000 4000 8000 --add Hash
+
+The controller reads the database once per command either way, so what
+format_items still saves over calling format_item for every item is the
+column lookup and cache prefetch done once for the listing: files missing
+from the hash cache are hashed in parallel instead of one by one. Each way
+is timed on its own copy of the tree, so neither finds the digests of the
+other in the cache. With --check the script exits non-zero if the per-row
+cost of format_items at the largest size is more than --tolerance times the
+cost at the smallest size.
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from pygeonhole import database, pygeonhole
+from pygeonhole.flags import FLAGS
+
+def make_controller(root: Path, size: int, columns: list, file_size: int) -> tuple:
+    items = root / "items"
+    items.mkdir(parents=True)
+    for i in range(size):
+        (items / f"file_{i}.txt").write_bytes(i.to_bytes(8, "big") + b"\0" * max(file_size - 8, 0))
+
+    db_path = root / ".ph.json"
+    flags_path = root / ".ph_flags.json"
+    rows = [{**dict.fromkeys(columns, ""), "Name": f"file_{i}.txt"} for i in range(size)]
+    db_path.write_text(json.dumps(rows, indent=4))
+    flags_path.write_text(json.dumps(dict(FLAGS, show_dirs=True, columns=columns)))
+    return pygeonhole.PH_Controller(db_path, flags_path), str(items)
+
+def per_item(phc: pygeonhole.PH_Controller, entries: list, items: str) -> None:
+    for entry in entries:
+        phc.format_item(entry.name, entry.stats, dir_path=items)
+
+def batch(phc: pygeonhole.PH_Controller, entries: list, items: str) -> None:
+    phc.format_items(entries, dir_path=items)
+
+# Seconds per row of one way of formatting, on a tree of its own
+def time_rows(root: Path, size: int, columns: list, file_size: int, format_rows) -> float:
+    phc, items = make_controller(root, size, columns, file_size)
+    entries = phc.get_dir_entries(items).dir_data
+    start = time.perf_counter()
+    format_rows(phc, entries, items)
+    return (time.perf_counter() - start) / size
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 2000, 4000, 8000])
+    parser.add_argument("--add", action="append", default=[], help="Column to format besides the defaults")
+    parser.add_argument("--file-size", type=int, default=4096)
+    parser.add_argument("--skip-per-item", action="store_true", help="Only time format_items")
+    parser.add_argument("--check", action="store_true", help="Fail if format_items scales worse than linearly")
+    parser.add_argument("--tolerance", type=float, default=2.0)
+    args = parser.parse_args()
+    columns = database.DEFAULT_COLUMNS + args.add
+
+    print(f"{'rows':>8} | {'format_item us/row':>18} | {'format_items us/row':>19}")
+    batch_costs = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            per_item_cost = float("nan")
+            if not args.skip_per_item:
+                per_item_cost = time_rows(Path(tmp) / "per_item", size, columns, args.file_size, per_item) * 1e6
+            batch_cost = time_rows(Path(tmp) / "batch", size, columns, args.file_size, batch) * 1e6
+            batch_costs.append(batch_cost)
+            print(f"{size:>8} | {per_item_cost:>18.1f} | {batch_cost:>19.1f}")
+
+    if args.check and batch_costs[-1] > batch_costs[0] * args.tolerance:
+        print(f"format_items per-row cost grew {batch_costs[-1] / batch_costs[0]:.1f}x", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
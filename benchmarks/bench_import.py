@@ -0,0 +1,49 @@
+"""
+Import time of pygeonhole.cli against a measured baseline.
+
+    python -m benchmarks.bench_import --runs 9 --budget 1.1
+
+Imports pygeonhole.cli in fresh interpreters with -X importtime and takes
+the time spent in pygeonhole, the cumulative time of pygeonhole.cli less
+that of typer, as a ratio of typer's, so the figure holds on faster and
+slower machines. Before the catalogue, hash, size and query modules were
+added the median ratio was 0.88; the default budget leaves 25% above that.
+Exits non-zero when the median of the runs is over the budget.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BASELINE_RATIO = 0.88
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+def import_ratio() -> float:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import pygeonhole.cli"],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+    )
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:"):
+            _, cumulative_us, module = line.split("|")
+            if cumulative_us.strip().isdigit():
+                cumulative[module.strip()] = int(cumulative_us)
+    return (cumulative["pygeonhole.cli"] - cumulative["typer"]) / cumulative["typer"]
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=9)
+    parser.add_argument("--budget", type=float, default=BASELINE_RATIO * 1.25)
+    args = parser.parse_args()
+
+    ratios = [import_ratio() for _ in range(args.runs)]
+    median = statistics.median(ratios)
+    print(f"pygeonhole / typer import time: median {median:.2f}, min {min(ratios):.2f}, max {max(ratios):.2f}")
+    print(f"baseline {BASELINE_RATIO:.2f}, budget {args.budget:.2f}")
+    if median > args.budget:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
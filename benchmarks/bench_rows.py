@@ -0,0 +1,45 @@
+"""
+Memory held by a loaded database, dict per item against compact Rows.
+
+    python -m benchmarks.bench_rows --rows 1000000
+
+Loads the same JSON database once as plain dicts (json.load, as the JSON
+backend used to) and once through the JSON backend, which builds Rows, and
+reports what each keeps allocated according to tracemalloc.
+"""
+import argparse
+import json
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+from benchmarks.bench_backends import make_rows
+from pygeonhole.backends import JsonBackend
+
+def held(load) -> tuple:
+    tracemalloc.start()
+    data = load()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(data), current, peak
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = JsonBackend(Path(tmp) / "bench.json")
+        backend.write(make_rows(args.rows))
+
+        def load_dicts() -> list:
+            with (Path(tmp) / "bench.json").open() as db:
+                return json.load(db)
+
+        print(f"{'rows as':>8} | {'held MB':>8} | {'peak MB':>8} | {'bytes/row':>9}")
+        for label, load in (("dict", load_dicts), ("Row", backend.read)):
+            count, current, peak = held(load)
+            print(f"{label:>8} | {current / 2**20:>8.1f} | {peak / 2**20:>8.1f} | {current / count:>9.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Compares the old os.walk + per-item os.stat directory read against the
+single-pass os.scandir scanner on synthetic directories.
+
+    python -m benchmarks.bench_scan --sizes 10000 100000 1000000
+
+Syscalls are counted by wrapping os.scandir, os.stat and DirEntry.stat, so
+the numbers are the calls each approach makes, not kernel-level traces.
+"""
+import argparse
+import os
+import stat
+import tempfile
+import time
+from pathlib import Path
+
+from pygeonhole import scanner
+
+COUNTS = {"scandir": 0, "stat": 0}
+
+class _CountingEntry:
+    def __init__(self, entry):
+        self._entry = entry
+        self.name = entry.name
+        self.path = entry.path
+
+    def is_dir(self, *args, **kwargs):
+        return self._entry.is_dir(*args, **kwargs)
+
+    def is_symlink(self):
+        return self._entry.is_symlink()
+
+    def stat(self, *args, **kwargs):
+        COUNTS["stat"] += 1
+        return self._entry.stat(*args, **kwargs)
+
+class _CountingScandir:
+    def __init__(self, it):
+        self._it = it
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._it.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return _CountingEntry(next(self._it))
+
+    def close(self):
+        self._it.close()
+
+_real_scandir = os.scandir
+_real_stat = os.stat
+
+def _counting_scandir(path="."):
+    COUNTS["scandir"] += 1
+    return _CountingScandir(_real_scandir(path))
+
+def _counting_stat(path, *args, **kwargs):
+    COUNTS["stat"] += 1
+    return _real_stat(path, *args, **kwargs)
+
+def make_dir(root: Path, size: int) -> None:
+    for i in range(size):
+        name = f".hidden_{i}" if i % 10 == 0 else f"file_{i}.txt"
+        (root / name).touch()
+    for i in range(max(size // 100, 1)):
+        (root / f"dir_{i}").mkdir()
+
+def walk_and_stat(dir_path: str) -> list:
+    item_names = []
+    for (dirpath, dirname, filename) in os.walk(dir_path):
+        item_names.extend(dirname)
+        item_names.extend(filename)
+        break
+    item_names = [item for item in item_names if not item[0] == "."]
+    return [os.stat(os.path.join(dir_path, item)).st_mode for item in item_names]
+
+def scan(dir_path: str) -> list:
+    entries = scanner.scan_dir(dir_path, show_hidden=False, show_dirs=True)
+    return [stat.S_IFMT(entry.stats.st_mode) for entry in entries]
+
+def measure(func, dir_path: str) -> tuple:
+    COUNTS.update(scandir=0, stat=0)
+    os.scandir, os.stat = _counting_scandir, _counting_stat
+    try:
+        func(dir_path)
+    finally:
+        os.scandir, os.stat = _real_scandir, _real_stat
+    calls = COUNTS["scandir"] + COUNTS["stat"]
+
+    start = time.perf_counter()
+    func(dir_path)
+    return calls, time.perf_counter() - start
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'entries':>9} | {'walk+stat calls':>15} | {'walk+stat s':>11} | {'scandir calls':>13} | {'scandir s':>9}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            make_dir(Path(tmp), size)
+            walk_calls, walk_time = measure(walk_and_stat, tmp)
+            scan_calls, scan_time = measure(scan, tmp)
+            print(f"{size:>9} | {walk_calls:>15} | {walk_time:>11.3f} | {scan_calls:>13} | {scan_time:>9.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Throughput of the recursive scanner at different worker counts.
+
+    python -m benchmarks.bench_tree --fanout 10 --depth 3 --files 100 --workers 1 2 4 8 16
+
+Builds a tree with fanout subdirectories per directory, depth levels deep
+and files regular files in every directory, then scans it with stats.
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from pygeonhole import scanner
+
+def make_tree(root: Path, fanout: int, depth: int, files: int) -> None:
+    for i in range(files):
+        (root / f"file_{i}.txt").touch()
+    if depth:
+        for i in range(fanout):
+            sub = root / f"dir_{i}"
+            sub.mkdir()
+            make_tree(sub, fanout, depth - 1, files)
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        make_tree(Path(tmp), args.fanout, args.depth, args.files)
+        print(f"{'workers':>7} | {'entries':>9} | {'seconds':>8} | {'entries/s':>10}")
+        for workers in args.workers:
+            start = time.perf_counter()
+            entries = scanner.scan_tree(tmp, -1, show_dirs=True, workers=workers)
+            seconds = time.perf_counter() - start
+            print(f"{workers:>7} | {len(entries):>9} | {seconds:>8.3f} | {len(entries) / seconds:>10.0f}")
+
+if __name__ == "__main__":
+    main()
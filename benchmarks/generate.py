@@ -0,0 +1,88 @@
+"""
+Builds synthetic directories for the benchmarks.
+
+    python -m benchmarks.generate /tmp/tree --files 10000 --depth 2 --hidden 0.1 --sizes mixed
+
+The same arguments and seed always give the same tree: a number of files
+spread over a tree depth levels deep with fanout subdirectories per
+directory, a ratio of them hidden, sizes drawn from one of
+SIZE_DISTRIBUTIONS and a ratio of them copies of an earlier file.
+"""
+import argparse
+import os
+import random
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple
+
+EXTENSIONS = [".txt", ".py", ".md", ".json", ".csv", ".bin", ".jpg", ""]
+
+SIZE_DISTRIBUTIONS: Dict[str, Callable[[random.Random], int]] = {
+    "empty": lambda rng: 0,
+    "small": lambda rng: rng.randint(0, 4 * 2**10),
+    # Mostly small files with a long tail, as in a source or document tree
+    "mixed": lambda rng: min(int(rng.lognormvariate(8, 2)), 16 * 2**20),
+    "large": lambda rng: rng.randint(2**20, 8 * 2**20),
+}
+
+class TreeSpec(NamedTuple):
+    files: int = 10_000
+    depth: int = 0
+    fanout: int = 10
+    hidden_ratio: float = 0.1
+    sizes: str = "small"
+    duplicate_ratio: float = 0.0
+    seed: int = 0
+
+def _directories(root: Path, depth: int, fanout: int) -> List[Path]:
+    dirs = [root]
+    level = [root]
+    for _ in range(depth):
+        level = [parent / f"dir_{i}" for parent in level for i in range(fanout)]
+        dirs.extend(level)
+    return dirs
+
+"""
+Writes the tree described by spec under root and returns the paths of the
+files, relative to root. Contents are random bytes, so only the files made
+duplicates share contents.
+"""
+def make_tree(root: Path, spec: TreeSpec) -> List[str]:
+    rng = random.Random(spec.seed)
+    dirs = _directories(root, spec.depth, spec.fanout)
+    for directory in dirs:
+        directory.mkdir(parents=True, exist_ok=True)
+
+    size_of = SIZE_DISTRIBUTIONS[spec.sizes]
+    written: List[Path] = []
+    for i in range(spec.files):
+        name = f"file_{i}{rng.choice(EXTENSIONS)}"
+        if rng.random() < spec.hidden_ratio:
+            name = "." + name
+        path = rng.choice(dirs) / name
+        if written and rng.random() < spec.duplicate_ratio:
+            path.write_bytes(rng.choice(written).read_bytes())
+        else:
+            size = size_of(rng)
+            path.write_bytes(rng.getrandbits(size * 8).to_bytes(size, "little") if size else b"")
+        written.append(path)
+    return [os.path.relpath(path, root) for path in written]
+
+def main() -> None:
+    defaults = TreeSpec()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root", type=Path)
+    parser.add_argument("--files", type=int, default=defaults.files)
+    parser.add_argument("--depth", type=int, default=defaults.depth)
+    parser.add_argument("--fanout", type=int, default=defaults.fanout)
+    parser.add_argument("--hidden", type=float, default=defaults.hidden_ratio)
+    parser.add_argument("--sizes", choices=list(SIZE_DISTRIBUTIONS), default=defaults.sizes)
+    parser.add_argument("--duplicates", type=float, default=defaults.duplicate_ratio)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    args = parser.parse_args()
+
+    spec = TreeSpec(args.files, args.depth, args.fanout, args.hidden, args.sizes, args.duplicates, args.seed)
+    files = make_tree(args.root, spec)
+    print(f"Wrote {len(files)} files to {args.root}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+End-to-end benchmark of every command on a synthetic directory.
+
+    python -m benchmarks.suite --files 10000 --depth 2 --repeat 5 --output results.json
+    python -m benchmarks.suite --files 10000 --depth 2 --baseline results.json --threshold 0.2
+
+Builds a tree with benchmarks.generate in a temporary directory, then runs
+init, show, a show that refreshes after 1% of the files changed, format,
+sort on every column, the same sorts as one batch, filter, dupes, export
+and export into a tar.gz archive as separate processes, with their config
+in the temporary directory and --profile-json on. Each command is timed
+repeat times; the median wall-clock time and the phase timings and
+counters of the last run are written to --output. Given a --baseline from
+an earlier run, every command whose median grew by more than --threshold
+(and by more than --min-delta seconds) is reported and the script exits
+non-zero.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from benchmarks.generate import SIZE_DISTRIBUTIONS, TreeSpec, make_tree
+from pygeonhole.database import DEFAULT_COLUMNS
+
+EXTRA_COLUMNS = ["Modified", "Owner", "Inode"]
+# The commands run in the tree, importing the package from this checkout
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+class _Runner:
+    def __init__(self, tree: Path, config: Path) -> None:
+        self._tree = tree
+        self._env = dict(os.environ, XDG_CONFIG_HOME=str(config), PYTHONPATH=str(REPO_ROOT))
+        self.results: Dict[str, Dict[str, Any]] = {}
+
+    def run(self, name: Optional[str], *args: str) -> None:
+        command = [sys.executable, "-m", "pygeonhole", "--profile-json", *args]
+        start = time.perf_counter()
+        result = subprocess.run(command, cwd=self._tree, env=self._env, capture_output=True, text=True)
+        seconds = time.perf_counter() - start
+        if result.returncode:
+            raise SystemExit(f"{' '.join(args)} failed:\n{result.stdout}{result.stderr}")
+        if name is None:
+            return
+        entry = self.results.setdefault(name, {"runs": []})
+        entry["runs"].append(seconds)
+        try:
+            profile = json.loads(result.stderr[result.stderr.index("{"):])
+        except ValueError:
+            return
+        entry["phases"] = profile["phases"]
+        entry["counts"] = profile["counts"]
+
+def _touch_some(tree: Path, files: List[str], iteration: int) -> None:
+    for name in files[iteration % 100::100]:
+        with (tree / name).open("ab") as file:
+            file.write(b"\0")
+
+def run_suite(spec: TreeSpec, backend: str, repeat: int) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp:
+        tree = Path(tmp) / "tree"
+        files = make_tree(tree, spec)
+        (Path(tmp) / "config").mkdir()
+        runner = _Runner(tree, Path(tmp) / "config")
+        depth = str(-1 if spec.depth else 0)
+
+        for iteration in range(repeat):
+            runner.run("init", "init", "--backend", backend)
+            runner.run("show", "show", "--depth", depth)
+            runner.run("show (unchanged)", "show")
+            _touch_some(tree, files, iteration)
+            runner.run("show (1% changed)", "show")
+            runner.run("format", "format", *[arg for col in EXTRA_COLUMNS for arg in ("--add", col)])
+            for col in DEFAULT_COLUMNS + EXTRA_COLUMNS:
+                runner.run(f"sort {col}", "sort", col)
+            script = Path(tmp) / "sorts.txt"
+            script.write_text("".join(f'sort "{col}"\n' for col in DEFAULT_COLUMNS + EXTRA_COLUMNS))
+            runner.run("batch (every sort)", "batch", "--quiet", str(script))
+            runner.run("filter", "filter", "ext:.py,.txt", "size>1k")
+            runner.run(None, "filter")
+            runner.run("dupes", "dupes")
+            runner.run("export", "export", "--pathname", str(Path(tmp) / f"export_{iteration}"))
+            runner.run(
+                "export (tar.gz)", "export", "--archive", "tar.gz",
+                "--pathname", str(Path(tmp) / f"export_{iteration}.tar.gz"),
+            )
+
+    for entry in runner.results.values():
+        entry["median"] = statistics.median(entry["runs"])
+        entry["min"] = min(entry["runs"])
+    return runner.results
+
+def _commit() -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float, min_delta: float) -> List[str]:
+    print(f"{'command':<20} | {'median s':>9} | {'baseline s':>10} | {'change':>8}")
+    regressions = []
+    for name, entry in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:<20} | {entry['median']:>9.3f} | {'--':>10} | {'--':>8}")
+            continue
+        change = entry["median"] / before["median"] - 1 if before["median"] else 0.0
+        flag = ""
+        if change > threshold and entry["median"] - before["median"] > min_delta:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<20} | {entry['median']:>9.3f} | {before['median']:>10.3f} | {change:>+8.1%}{flag}")
+    return regressions
+
+def main() -> None:
+    defaults = TreeSpec()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=defaults.files)
+    parser.add_argument("--depth", type=int, default=defaults.depth)
+    parser.add_argument("--fanout", type=int, default=defaults.fanout)
+    parser.add_argument("--hidden", type=float, default=defaults.hidden_ratio)
+    parser.add_argument("--sizes", choices=list(SIZE_DISTRIBUTIONS), default=defaults.sizes)
+    parser.add_argument("--duplicates", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--backend", choices=["json", "sqlite", "columnar"], default="json")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=Path, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", type=Path, help="Results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Slowdown flagged as a regression")
+    parser.add_argument("--min-delta", type=float, default=0.01, help="Ignore slowdowns below this many seconds")
+    args = parser.parse_args()
+
+    spec = TreeSpec(args.files, args.depth, args.fanout, args.hidden, args.sizes, args.duplicates, args.seed)
+    results = run_suite(spec, args.backend, args.repeat)
+    report = {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "spec": spec._asdict(),
+        "backend": args.backend,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=4))
+
+    if args.baseline is None:
+        print(f"{'command':<20} | {'median s':>9} | {'min s':>9}")
+        for name, entry in results.items():
+            print(f"{name:<20} | {entry['median']:>9.3f} | {entry['min']:>9.3f}")
+        return
+    baseline = json.loads(args.baseline.read_text())
+    if baseline.get("spec") != report["spec"] or baseline.get("backend") != args.backend:
+        print("The baseline was run on a different tree or backend", file=sys.stderr)
+    regressions = compare(results, baseline, args.threshold, args.min_delta)
+    if regressions:
+        print(f"Regressions above {args.threshold:.0%}: {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -13,7 +13,12 @@ __version__ = "0.1.0"
     DIR_READ_ERROR,
     EXPORT_ERROR,
     PATH_ERROR,
-) = range(11)
+    CONFLICT_ERROR,
+    QUERY_ERROR,
+    HASH_ERROR,
+    CATALOGUE_ERROR,
+    SIZE_ERROR,
+) = range(16)
 
 ERRORS = {
     DIR_ERROR: "config directory error",
@@ -25,5 +30,10 @@ ERRORS = {
     DIR_READ_ERROR: "directory read error",
     EXPORT_ERROR: "export items error",
     PATH_ERROR: "unidentified path error",
-    JSON_ERROR: "json format error"
+    JSON_ERROR: "json format error",
+    CONFLICT_ERROR: "concurrent write conflict",
+    QUERY_ERROR: "invalid filter",
+    HASH_ERROR: "hash cache write error",
+    CATALOGUE_ERROR: "catalogue write error",
+    SIZE_ERROR: "size cache write error",
 }
@@ -1,6 +1,20 @@
-from pygeonhole import cli, __app_name__
+import sys
+
+from pygeonhole import __app_name__, __version__
 
 def main():
+    # Answer --version before typer and the command modules are imported
+    if sys.argv[1:] in (["--version"], ["-v"]):
+        print(f"{__app_name__} v{__version__}")
+        return
+    # Hand show, filter, sort, export and dupes to a running server of this directory
+    if sys.argv[1:2] and not sys.argv[1].startswith("-"):
+        from pygeonhole import daemon
+        if sys.argv[1] in daemon.CLIENT_COMMANDS:
+            code = daemon.request(sys.argv[1:])
+            if code is not None:
+                sys.exit(code)
+    from pygeonhole import cli
     cli.app(prog_name=__app_name__)
 
 if __name__ == "__main__":
@@ -0,0 +1,339 @@
+import gzip
+import os
+import stat
+import struct
+import tarfile
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import IO, Callable, Deque, Iterator, List, Optional, Tuple, Union
+
+from pygeonhole import EXPORT_ERROR, SUCCESS, profiling
+from pygeonhole.export import ExportData
+from pygeonhole.locking import atomic_write
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+"""
+Exports items straight into one archive, without copying them anywhere
+first. Everything is read in CHUNK_SIZE chunks that a pool of workers
+compresses while the calling thread reads ahead and writes the compressed
+chunks out in order, with at most two chunks per worker in flight, so
+memory does not grow with the size of the files.
+
+A tar stream is cut into chunks compressed independently, as gzip members
+or zstd frames, which decompressors read back as one stream. A zip file is
+written here rather than through zipfile, which cannot take data that was
+compressed elsewhere: every chunk of a file is compressed to raw deflate,
+primed with the end of the previous chunk, and the chunks of a file join
+into one deflate stream.
+"""
+
+ARCHIVE_FORMATS = {"tar.gz": 6, "tar.zst": 3, "zip": 6}
+# Compression levels each format takes
+ARCHIVE_LEVELS = {"tar.gz": range(0, 10), "tar.zst": range(1, 23), "zip": range(0, 10)}
+CHUNK_SIZE = 2**20
+# Window a deflate chunk may refer back into
+WINDOW_SIZE = 32 * 2**10
+
+Pending = Union[bytes, Future, Callable[[], bytes]]
+
+class _Pipeline:
+    def __init__(self, out: IO[bytes], pool: ThreadPoolExecutor, workers: int) -> None:
+        self._out = out
+        self._pool = pool
+        self._limit = workers * 2
+        self._queue: Deque[Tuple[Pending, Optional[Callable[[int, int], None]]]] = deque()
+        self._in_flight = 0
+        self.written = 0
+
+    """
+    Queues bytes, or a callable giving them once everything before it was
+    written. done is called with the offset and length they were written at.
+    """
+    def put(self, data: Pending, done: Optional[Callable[[int, int], None]] = None) -> None:
+        self._queue.append((data, done))
+
+    def submit(self, compress: Callable[..., bytes], *args, done: Optional[Callable[[int, int], None]] = None) -> None:
+        self._queue.append((self._pool.submit(compress, *args), done))
+        self._in_flight += 1
+        while self._in_flight > self._limit:
+            self._write_next()
+
+    def _write_next(self) -> None:
+        data, done = self._queue.popleft()
+        if isinstance(data, Future):
+            self._in_flight -= 1
+            data = data.result()
+        elif callable(data):
+            data = data()
+        self._out.write(data)
+        if done is not None:
+            done(self.written, len(data))
+        self.written += len(data)
+        profiling.count("archive_bytes_written", len(data))
+
+    def drain(self) -> None:
+        while self._queue:
+            self._write_next()
+
+# The file object tarfile streams into, cut into chunks for the pipeline
+class _ChunkedStream:
+    def __init__(self, pipeline: _Pipeline, compress: Callable[[bytes], bytes]) -> None:
+        self._pipeline = pipeline
+        self._compress = compress
+        self._buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        while len(self._buffer) >= CHUNK_SIZE:
+            self._pipeline.submit(self._compress, bytes(self._buffer[:CHUNK_SIZE]))
+            del self._buffer[:CHUNK_SIZE]
+        return len(data)
+
+    def close(self) -> None:
+        if self._buffer:
+            self._pipeline.submit(self._compress, bytes(self._buffer))
+            self._buffer = bytearray()
+
+class _CountingReader:
+    def __init__(self, file: IO[bytes], counter: Callable[[int], None]) -> None:
+        self._file = file
+        self._counter = counter
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._file.read(size)
+        self._counter(len(data))
+        return data
+
+"""
+Every path to archive with its name in the archive: the items, and the
+contents of directories when copy_dirs is set, each directory ahead of its
+contents. Symlinks are archived as links and never followed.
+"""
+def _members(names: List[str], copy_dirs: bool) -> Iterator[Tuple[str, str]]:
+    for name in names:
+        arcname = os.path.normpath(name)
+        yield name, arcname
+        if not copy_dirs or os.path.islink(name) or not os.path.isdir(name):
+            continue
+        for dirpath, dirnames, filenames in os.walk(name):
+            rel_dir = os.path.normpath(os.path.join(arcname, os.path.relpath(dirpath, name)))
+            for entry in sorted(dirnames) + sorted(filenames):
+                yield os.path.join(dirpath, entry), os.path.join(rel_dir, entry)
+            # Walk into the directories in the order they were listed
+            dirnames.sort()
+
+def _tar_compressor(archive_format: str, level: int) -> Callable[[bytes], bytes]:
+    if archive_format == "tar.zst":
+        return lambda chunk: zstandard.ZstdCompressor(level=level).compress(chunk)
+    return lambda chunk: gzip.compress(chunk, level, mtime=0)
+
+def _write_tar(
+    pipeline: _Pipeline,
+    members: Iterator[Tuple[str, str]],
+    compress: Callable[[bytes], bytes],
+    read: Callable[[int], None],
+) -> int:
+    stream = _ChunkedStream(pipeline, compress)
+    files = 0
+    with tarfile.open(fileobj=stream, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+        for path, arcname in members:
+            info = tar.gettarinfo(path, arcname)
+            # Sockets give None; they, devices and fifos are skipped as in zip
+            if info is None or info.isdev():
+                continue
+            if info.isreg():
+                with open(path, "rb") as file:
+                    tar.addfile(info, _CountingReader(file, read))
+                files += 1
+            else:
+                tar.addfile(info)
+    stream.close()
+    return files
+
+# Zip records, with zip64 fields where sizes or offsets need them
+ZIP64_LIMIT = (1 << 31) - 1
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+DESCRIPTOR = struct.Struct("<4sL2L")
+DESCRIPTOR64 = struct.Struct("<4sL2Q")
+CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+END_RECORD = struct.Struct("<4s4H2LH")
+END_RECORD64 = struct.Struct("<4sQ2H2L4Q")
+END_LOCATOR64 = struct.Struct("<4sLQL")
+FLAG_DESCRIPTOR, FLAG_UTF8 = 0x08, 0x800
+ZIP_STORED, ZIP_DEFLATED = 0, 8
+
+def _dos_time(mtime: float) -> Tuple[int, int]:
+    date = time.localtime(max(mtime, 315532800))
+    return (
+        (date.tm_hour << 11) | (date.tm_min << 5) | (date.tm_sec // 2),
+        ((date.tm_year - 1980) << 9) | (date.tm_mon << 5) | date.tm_mday,
+    )
+
+class _ZipMember:
+    def __init__(self, arcname: str, stats: os.stat_result, method: int, zip64: bool) -> None:
+        self.name = arcname.encode("utf-8")
+        self.mode = stats.st_mode
+        self.method = method
+        self.zip64 = zip64
+        self.dos_time, self.dos_date = _dos_time(stats.st_mtime)
+        self.offset = 0
+        self.crc = 0
+        self.size = 0
+        self.compressed = 0
+
+    def set_offset(self, offset: int, length: int) -> None:
+        self.offset = offset
+
+    def add_compressed(self, offset: int, length: int) -> None:
+        self.compressed += length
+
+    def local_header(self) -> bytes:
+        extra = struct.pack("<2H2Q", 1, 16, 0, 0) if self.zip64 else b""
+        sizes = 0xFFFFFFFF if self.zip64 else 0
+        return LOCAL_HEADER.pack(
+            b"PK\x03\x04", 45 if self.zip64 else 20, FLAG_DESCRIPTOR | FLAG_UTF8, self.method,
+            self.dos_time, self.dos_date, 0, sizes, sizes, len(self.name), len(extra),
+        ) + self.name + extra
+
+    def descriptor(self) -> bytes:
+        if self.zip64:
+            return DESCRIPTOR64.pack(b"PK\x07\x08", self.crc, self.compressed, self.size)
+        return DESCRIPTOR.pack(b"PK\x07\x08", self.crc, self.compressed, self.size)
+
+    def central_header(self) -> bytes:
+        zip64 = max(self.size, self.compressed, self.offset) > ZIP64_LIMIT
+        extra = struct.pack("<2H3Q", 1, 24, self.size, self.compressed, self.offset) if zip64 else b""
+        sizes = (0xFFFFFFFF,) * 3 if zip64 else (self.compressed, self.size, self.offset)
+        external = (self.mode & 0xFFFF) << 16 | (0x10 if stat.S_ISDIR(self.mode) else 0)
+        return CENTRAL_HEADER.pack(
+            b"PK\x01\x02", 3 << 8 | 45, 45 if zip64 or self.zip64 else 20, FLAG_DESCRIPTOR | FLAG_UTF8,
+            self.method, self.dos_time, self.dos_date, self.crc, sizes[0], sizes[1],
+            len(self.name), len(extra), 0, 0, 0, external, sizes[2],
+        ) + self.name + extra
+
+# One chunk of a file as raw deflate, ending the stream after the last chunk
+def _deflate(chunk: bytes, level: int, window: bytes, last: bool) -> bytes:
+    if window:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=window)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(chunk) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+def _write_zip_member(
+    pipeline: _Pipeline, path: str, arcname: str, level: int, read: Callable[[int], None]
+) -> Optional[_ZipMember]:
+    stats = os.lstat(path)
+    if stat.S_ISDIR(stats.st_mode):
+        member = _ZipMember(arcname + "/", stats, ZIP_STORED, False)
+        pipeline.put(member.local_header(), member.set_offset)
+        pipeline.put(member.descriptor)
+        return member
+    if stat.S_ISLNK(stats.st_mode):
+        target = os.readlink(path).encode("utf-8")
+        member = _ZipMember(arcname, stats, ZIP_STORED, False)
+        member.crc, member.size, member.compressed = zlib.crc32(target), len(target), len(target)
+        pipeline.put(member.local_header(), member.set_offset)
+        pipeline.put(target + member.descriptor())
+        return member
+    # Sockets, devices and fifos
+    if not stat.S_ISREG(stats.st_mode):
+        return None
+
+    member = _ZipMember(arcname, stats, ZIP_DEFLATED, stats.st_size > ZIP64_LIMIT)
+    pipeline.put(member.local_header(), member.set_offset)
+    with open(path, "rb") as file:
+        window = b""
+        chunk = file.read(CHUNK_SIZE)
+        while True:
+            following = file.read(CHUNK_SIZE) if chunk else b""
+            member.crc = zlib.crc32(chunk, member.crc)
+            member.size += len(chunk)
+            read(len(chunk))
+            pipeline.submit(_deflate, chunk, level, window, not following, done=member.add_compressed)
+            if not following:
+                break
+            window = (window + chunk)[-WINDOW_SIZE:]
+            chunk = following
+    pipeline.put(member.descriptor)
+    return member
+
+def _write_zip(
+    pipeline: _Pipeline,
+    out: IO[bytes],
+    members: Iterator[Tuple[str, str]],
+    level: int,
+    read: Callable[[int], None],
+) -> int:
+    written = []
+    for path, arcname in members:
+        member = _write_zip_member(pipeline, path, arcname, level, read)
+        if member is not None:
+            written.append(member)
+    pipeline.drain()
+
+    start = pipeline.written
+    directory = b"".join(member.central_header() for member in written)
+    out.write(directory)
+    count = len(written)
+    if count >= 0xFFFF or start + len(directory) > ZIP64_LIMIT:
+        end64 = start + len(directory)
+        out.write(END_RECORD64.pack(
+            b"PK\x06\x06", END_RECORD64.size - 12, 3 << 8 | 45, 45, 0, 0, count, count, len(directory), start
+        ))
+        out.write(END_LOCATOR64.pack(b"PK\x06\x07", 0, end64, 1))
+        out.write(END_RECORD.pack(b"PK\x05\x06", 0, 0, 0xFFFF, 0xFFFF, 0xFFFFFFFF, 0xFFFFFFFF, 0))
+    else:
+        out.write(END_RECORD.pack(b"PK\x05\x06", 0, 0, count, count, len(directory), start, 0))
+    # Files, as tar counts them
+    return sum(1 for member in written if member.method == ZIP_DEFLATED)
+
+"""
+Writes the items, and the contents of directories when copy_dirs is set,
+into the archive at dest as tar.gz, tar.zst or zip, at level (the format's
+default when None). The archive is written to a temporary file renamed
+into place once complete. progress is called on the calling thread with
+the number of bytes read so far.
+"""
+def export_archive(
+    names: List[str],
+    dest: Path,
+    archive_format: str,
+    level: Optional[int] = None,
+    workers: int = 4,
+    progress: Optional[Callable[[int], None]] = None,
+    copy_dirs: bool = True,
+) -> ExportData:
+    start = time.perf_counter()
+    if archive_format == "tar.zst" and zstandard is None:
+        return ExportData(0, 0, 0.0, EXPORT_ERROR)
+    level = ARCHIVE_FORMATS[archive_format] if level is None else level
+    size = [0]
+    files = [0]
+
+    def read(length: int) -> None:
+        size[0] += length
+        if progress is not None:
+            progress(size[0])
+
+    def write(out: IO[bytes]) -> None:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pipeline = _Pipeline(out, pool, workers)
+            members = _members(names, copy_dirs)
+            if archive_format == "zip":
+                files[0] = _write_zip(pipeline, out, members, level, read)
+            else:
+                files[0] = _write_tar(pipeline, members, _tar_compressor(archive_format, level), read)
+                pipeline.drain()
+
+    try:
+        atomic_write(dest, write, binary=True)
+    except (OSError, tarfile.TarError, zlib.error):
+        return ExportData(files[0], size[0], time.perf_counter() - start, EXPORT_ERROR)
+    return ExportData(files[0], size[0], time.perf_counter() - start, SUCCESS)
@@ -0,0 +1,204 @@
+import heapq
+import json
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Tuple, TypeVar
+
+from pygeonhole.locking import atomic_write
+from pygeonhole.rows import Row, json_default
+
+"""
+Storage engines behind DatabaseHandler. A backend raises OSError,
+ValueError (bad JSON) or BackendError and leaves translating those into
+error codes to the handler. Which backend serves a database is decided by
+the suffix of its path, see get_backend(); the SQLite and columnar engines
+live in their own modules and are only imported for their databases.
+"""
+
+class BackendError(Exception):
+    pass
+
+T = TypeVar("T")
+# Columns to sort on, each with whether it is sorted in descending order
+SortKeys = List[Tuple[str, bool]]
+
+# Entry type of a row, from the file type character that leads its Mode
+def is_dir(item: Mapping[str, Any]) -> bool:
+    return item["Mode"][:1] == "d"
+
+# Directories and everything else, in one pass that keeps their order
+def partition_dirs(items: Iterable[T], item_is_dir: Callable[[T], bool] = is_dir) -> Tuple[List[T], List[T]]:
+    dirs, files = [], []
+    for item in items:
+        (dirs if item_is_dir(item) else files).append(item)
+    return dirs, files
+
+def _sort_key(data: List[Dict[str, Any]], sorting_key: str):
+    typed_key = "_" + sorting_key
+    if data and all(typed_key in item for item in data):
+        return lambda x: x[typed_key]
+    return lambda x: x[sorting_key]
+
+"""
+Ascending order of data for a column, with directories ahead of files when
+dirs_first is set. Returns the order and how many directories lead it.
+"""
+def sorted_order(
+    data: List[Dict[str, Any]], sorting_key: str, dirs_first: bool
+) -> Tuple[List[Dict[str, Any]], int]:
+    key = _sort_key(data, sorting_key)
+    if dirs_first:
+        dirs, files = partition_dirs(data)
+        dirs.sort(key=key)
+        files.sort(key=key)
+        return dirs + files, len(dirs)
+    return sorted(data, key=key), 0
+
+def apply_order(order: List[Dict[str, Any]], dirs: int, reverse_order: bool) -> List[Dict[str, Any]]:
+    if not reverse_order:
+        return list(order)
+    return order[:dirs][::-1] + order[dirs:][::-1]
+
+def sort_items(
+    data: List[Dict[str, Any]], sorting_key: str, reverse_order: bool, dirs_first: bool
+) -> List[Dict[str, Any]]:
+    order, dirs = sorted_order(data, sorting_key, dirs_first)
+    return apply_order(order, dirs, reverse_order)
+
+"""
+Order of data by several columns, each ascending or descending, with
+directories ahead of files when dirs_first is set. Items equal on every
+column keep their stored order, reversed when the last column is
+descending, so a single column sorts exactly as sort_items does.
+"""
+def sort_items_by(data: List[Dict[str, Any]], keys: SortKeys, dirs_first: bool) -> List[Dict[str, Any]]:
+    items = list(data)
+    if keys and keys[-1][1]:
+        items.reverse()
+    # Stable sorts from the last column to the first
+    for sorting_key, descending in reversed(keys):
+        items.sort(key=_sort_key(items, sorting_key), reverse=descending)
+    if dirs_first:
+        dirs, files = partition_dirs(items)
+        return dirs + files
+    return items
+
+class _Descending:
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any) -> None:
+        self.value = value
+
+    def __lt__(self, other: "_Descending") -> bool:
+        return other.value < self.value
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, _Descending) and self.value == other.value
+
+"""
+The first count items of sort_items_by(data, keys, dirs_first), selected
+with a heap of count items instead of sorting all of them.
+"""
+def top_items(
+    data: List[Dict[str, Any]], keys: SortKeys, dirs_first: bool, count: int
+) -> List[Dict[str, Any]]:
+    extractors = [(_sort_key(data, sorting_key), descending) for sorting_key, descending in keys]
+    tie = -1 if keys and keys[-1][1] else 1
+
+    def composite(position: int) -> Tuple:
+        item = data[position]
+        values: List[Any] = [not is_dir(item)] if dirs_first else []
+        for key, descending in extractors:
+            values.append(_Descending(key(item)) if descending else key(item))
+        values.append(tie * position)
+        return tuple(values)
+
+    return [data[position] for position in heapq.nsmallest(max(count, 0), range(len(data)), key=composite)]
+
+"""
+The JSON backend rewrites the whole file on every write, through
+atomic_write so it is never left truncated. It keeps the ascending order of
+every column it has sorted on in a "<database>.idx" file, as lists of names.
+The file is stamped with the inode, size and mtime of the database it
+belongs to and removed whenever items are written, so a repeated sort only
+has to look the stored names up again.
+"""
+class JsonBackend:
+    def __init__(self, db_path: Path) -> None:
+        self._db_path = db_path
+        self._index_path = db_path.with_name(db_path.name + ".idx")
+        self._indexes: Dict[str, Any] = {}
+
+    def read(self) -> List[Dict[str, Any]]:
+        with self._db_path.open("r") as db:
+            return json.load(db, object_hook=Row.from_dict)
+
+    def _dump(self, data: List[Dict[str, Any]]) -> None:
+        atomic_write(self._db_path, lambda db: json.dump(data, db, indent=4, default=json_default))
+
+    # Every write renames a new file into place, so the inode is part of it
+    def _stamp(self) -> List[int]:
+        stats = self._db_path.stat()
+        return [stats.st_ino, stats.st_size, stats.st_mtime_ns]
+
+    def _read_indexes(self) -> Dict[str, Any]:
+        try:
+            with self._index_path.open("r") as index_file:
+                indexes = json.load(index_file)
+        except (OSError, ValueError):
+            return {}
+        return indexes["columns"] if indexes.get("stamp") == self._stamp() else {}
+
+    def write(self, data: List[Dict[str, Any]]) -> None:
+        self._dump(data)
+        self._indexes = {}
+        try:
+            self._index_path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def update(
+        self, data: List[Dict[str, Any]], changed: List[Dict[str, Any]], removed: List[str]
+    ) -> None:
+        self.write(data)
+
+    def sort(
+        self,
+        data: List[Dict[str, Any]],
+        sorting_key: str,
+        reverse_order: bool,
+        dirs_first: bool,
+        use_index: bool = True,
+    ) -> List[Dict[str, Any]]:
+        self._indexes = self._read_indexes() if use_index else {}
+
+        order = None
+        index = self._indexes.get(sorting_key)
+        if index and index["dirs_first"] == dirs_first and len(index["order"]) == len(data):
+            by_name = {item["Name"]: item for item in data}
+            try:
+                order = [by_name[name] for name in index["order"]]
+                dirs = index["dirs"]
+            except KeyError:
+                order = None
+        if order is None:
+            order, dirs = sorted_order(data, sorting_key, dirs_first)
+            self._indexes[sorting_key] = {
+                "dirs_first": dirs_first, "dirs": dirs, "order": [item["Name"] for item in order]
+            }
+        return apply_order(order, dirs, reverse_order)
+
+    def reorder(
+        self, data: List[Dict[str, Any]], sorting_key: str, reverse_order: bool, dirs_first: bool
+    ) -> None:
+        self._dump(data)
+        indexes = {"stamp": self._stamp(), "columns": self._indexes}
+        atomic_write(self._index_path, lambda index_file: json.dump(indexes, index_file))
+
+def get_backend(db_path: Path):
+    if db_path.suffix in (".sqlite", ".db"):
+        from pygeonhole.sqlite_backend import SQLiteBackend
+        return SQLiteBackend(db_path)
+    if db_path.suffix == ".phc":
+        from pygeonhole.columnar_backend import ColumnarBackend
+        return ColumnarBackend(db_path)
+    return JsonBackend(db_path)
@@ -0,0 +1,171 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from pygeonhole.config import CATALOGUE_DIR_PATH, DEFAULT_MAX_DIRECTORIES, read_config
+from pygeonhole.locking import FileLock, atomic_write
+
+"""
+Central catalogue of indexed directories. Every directory is keyed by its
+absolute path and its database and flags files are kept together in the
+catalogue directory, named after a digest of that path, instead of next to
+the directory's contents. The index, catalogue.json, records each
+directory's files and when it was last used; registering a directory past
+max_directories evicts the least recently used ones and deletes their files.
+Each directory keeps files of its own rather than rows in one shared store,
+since its database can be in any backend and is locked and versioned on
+its own, so commands in different directories never wait on each other.
+"""
+
+INDEX_NAME = "catalogue.json"
+# last_used is only rewritten once it is older than this many seconds, so
+# most commands only read the index
+TOUCH_INTERVAL = 60.0
+
+class CatalogueEntry(NamedTuple):
+    dir_path: str
+    db_path: Path
+    flags_path: Path
+    last_used: float
+
+def store_prefix(dir_path: str) -> str:
+    import hashlib
+
+    return "ph_" + hashlib.sha256(os.path.abspath(dir_path).encode()).hexdigest()[:16]
+
+class Catalogue:
+    def __init__(self, root: Path, max_directories: int = DEFAULT_MAX_DIRECTORIES) -> None:
+        self.root = root
+        self.max_directories = max_directories
+        self._index_path = root / INDEX_NAME
+        self._looked_up: Dict[str, CatalogueEntry] = {}
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with self._index_path.open("r") as index:
+                return json.load(index)["directories"]
+        except FileNotFoundError:
+            return {}
+
+    def _entry(self, dir_path: str, record: Dict[str, Any]) -> CatalogueEntry:
+        return CatalogueEntry(
+            dir_path, self.root / record["database"], self.root / record["flags"], record["last_used"]
+        )
+
+    def _modify(self, change: Callable[[Dict[str, Dict[str, Any]]], Any]) -> Any:
+        self.root.mkdir(parents=True, exist_ok=True)
+        with FileLock(self._index_path, exclusive=True) as lock:
+            directories = self._load()
+            result = change(directories)
+            atomic_write(
+                self._index_path, lambda index: json.dump({"directories": directories}, index, indent=4)
+            )
+            lock.bump()
+        return result
+
+    def _remove_files(self, dir_path: str) -> None:
+        for path in self.root.glob(store_prefix(dir_path) + "_ph*"):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    # Deletes a database of the catalogue, with its lock and sort index
+    def discard(self, db_path: Path) -> None:
+        if db_path.parent != self.root:
+            return
+        for path in (db_path, db_path.with_name(db_path.name + ".lock"), db_path.with_name(db_path.name + ".idx")):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def paths(self, dir_path: str, suffix: str) -> Tuple[Path, Path]:
+        prefix = store_prefix(dir_path)
+        return self.root / (prefix + "_ph" + suffix), self.root / (prefix + "_ph_flags.json")
+
+    # Most recently used first
+    def entries(self) -> List[CatalogueEntry]:
+        if not self._index_path.exists():
+            return []
+        with FileLock(self._index_path):
+            directories = self._load()
+        entries = [self._entry(dir_path, record) for dir_path, record in directories.items()]
+        return sorted(entries, key=lambda entry: entry.last_used, reverse=True)
+
+    """
+    The entry of dir_path, or None when it is not catalogued or the index
+    cannot be read. Marks the directory as used.
+    """
+    def lookup(self, dir_path: str) -> Optional[CatalogueEntry]:
+        dir_path = os.path.abspath(dir_path)
+        if dir_path in self._looked_up:
+            return self._looked_up[dir_path]
+        try:
+            if not self._index_path.exists():
+                return None
+            with FileLock(self._index_path):
+                record = self._load().get(dir_path)
+            if record is None:
+                return None
+            now = time.time()
+            if now - record["last_used"] > TOUCH_INTERVAL:
+                def touch(directories: Dict[str, Dict[str, Any]]) -> None:
+                    if dir_path in directories:
+                        directories[dir_path]["last_used"] = now
+                self._modify(touch)
+                record["last_used"] = now
+        except (OSError, ValueError, KeyError):
+            return None
+        self._looked_up[dir_path] = self._entry(dir_path, record)
+        return self._looked_up[dir_path]
+
+    """
+    Adds dir_path, or points it at a database with another suffix, and
+    evicts the least recently used directories beyond max_directories.
+    Raises OSError when the index cannot be written.
+    """
+    def register(self, dir_path: str, suffix: str) -> CatalogueEntry:
+        dir_path = os.path.abspath(dir_path)
+        db_path, flags_path = self.paths(dir_path, suffix)
+
+        def add(directories: Dict[str, Dict[str, Any]]) -> List[str]:
+            directories[dir_path] = {
+                "database": db_path.name, "flags": flags_path.name, "last_used": time.time()
+            }
+            by_age = sorted(directories, key=lambda path: directories[path]["last_used"])
+            excess = max(len(directories) - self.max_directories, 0)
+            evicted = [path for path in by_age[:excess] if path != dir_path]
+            for path in evicted:
+                del directories[path]
+            return evicted
+
+        for path in self._modify(add):
+            self._remove_files(path)
+        self._looked_up[dir_path] = CatalogueEntry(dir_path, db_path, flags_path, time.time())
+        return self._looked_up[dir_path]
+
+    # Drops dir_path and deletes its files, returns whether it was catalogued
+    def forget(self, dir_path: str) -> bool:
+        dir_path = os.path.abspath(dir_path)
+        record = self._modify(lambda directories: directories.pop(dir_path, None))
+        self._looked_up.pop(dir_path, None)
+        if record is None:
+            return False
+        self._remove_files(dir_path)
+        return True
+
+# Catalogues of config files, shared by every lookup in a process
+_catalogues: Dict[Path, Catalogue] = {}
+
+def open_catalogue(config_file: Path) -> Catalogue:
+    if config_file not in _catalogues:
+        config_parser = read_config(config_file)
+        root = config_parser.get("General", "catalogue", fallback=str(CATALOGUE_DIR_PATH))
+        max_directories = config_parser.getint(
+            "General", "max_directories", fallback=DEFAULT_MAX_DIRECTORIES
+        )
+        _catalogues[config_file] = Catalogue(Path(root), max_directories)
+    return _catalogues[config_file]
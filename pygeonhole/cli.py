@@ -1,17 +1,45 @@
-from pathlib import Path
-from typing import Optional
-from shutil import copy2
 import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 
 import typer
 
 from pygeonhole import (
-    ERRORS, __app_name__, __version__, config, database, flags, pygeonhole
+    CATALOGUE_ERROR, ERRORS, __app_name__, __version__, backends, config, database, flags, profiling,
+    pygeonhole
 )
-from pygeonhole import EXPORT_ERROR, PATH_ERROR
+from pygeonhole.scanner import SCAN_WORKERS
+
+# The catalogue is only imported by the commands that open it
+if TYPE_CHECKING:
+    from pygeonhole.catalogue import CatalogueEntry
 
 app = typer.Typer()
 
+# Controllers handed out by get_PHC, keyed by their database and flags paths
+_controllers: Dict[Tuple[Path, Path], pygeonhole.PH_Controller] = {}
+# daemon.LiveIndex of the running server, controllers are kept between its requests
+_live = None
+# Set while batch runs its steps, which then share controllers and are flushed together
+_batching = False
+
+"""
+Controllers defer their writes, so everything a command changed is written
+here, once per file, when the command finishes. The steps of a batch are
+written once, when the batch finishes.
+"""
+def _flush_controllers() -> None:
+    if _batching:
+        return
+    controllers = list(_controllers.values())
+    if _live is None:
+        _controllers.clear()
+    for phc in controllers:
+        flush_error = phc.flush()
+        if flush_error:
+            typer.secho(f'Saving changes failed with "{ERRORS[flush_error]}"', fg=typer.colors.RED)
+            raise typer.Exit(1)
+
 def get_PHC() -> pygeonhole.PH_Controller:
     if config.CONFIG_FILE_PATH.exists():
         db_path = database.get_database_path(config.CONFIG_FILE_PATH)
@@ -19,46 +47,54 @@ def get_PHC() -> pygeonhole.PH_Controller:
     else:
         typer.secho('Config file not found. Please run "pygeonhole-cli init"', fg=typer.colors.RED)
         raise typer.Exit(1)
+    if (db_path, flags_path) in _controllers:
+        return _controllers[(db_path, flags_path)]
     if db_path.exists() and flags_path.exists():
-        return pygeonhole.PH_Controller(db_path, flags_path)
+        phc = pygeonhole.PH_Controller(db_path, flags_path, deferred=True)
+        _controllers[(db_path, flags_path)] = phc
+        return phc
     else:
         typer.secho('Database not found. Please run "pygeonhole-cli init"', fg=typer.colors.RED)
         raise typer.Exit(1)
 
 """
-This function essentially resets the program (though it does not reset
-the flags) so it is necessary to warn the user of adding and removing
-files while in the middle of execution. Probably better to just tell
-user to re-init.
+Brings the database in line with the directory. Only added, removed or
+changed items are re-formatted, the rest keep their stored (sorted) order,
+and the database is not rewritten when nothing changed. Under a server
+whose watcher saw no change since the last refresh, nothing is scanned.
 """
-def update_db() -> None:
+def update_db(workers: int = SCAN_WORKERS) -> None:
     phc = get_PHC()
 
-    db_result = phc.get_db_data()
-    if db_result.error:
-        typer.secho(f'Displaying items failed with "{ERRORS[db_result.error]}"', fg=typer.colors.RED,)
+    if _live is None:
+        refresh_result = phc.refresh_db(workers=workers)
+    else:
+        flags_result = phc.get_flags_data()
+        if not flags_result.error and not _live.needs_refresh(flags_result.flags):
+            return
+        refresh_result = _live.refresh(phc, workers)
+    if refresh_result.error:
+        typer.secho(f'Update failed with "{ERRORS[refresh_result.error]}"', fg=typer.colors.RED)
         raise typer.Exit(1)
 
-    dir_result = phc.get_dir_data()
-    if dir_result.error:
-        typer.secho(f'Displaying items failed with "{ERRORS[dir_result.error]}"', fg=typer.colors.RED,)
-        raise typer.Exit(1)
-    
-    formatted_files = []
-    for item in dir_result.dir_data:
-        format_result = phc.format_item(item)
-        if format_result.error:
-            typer.secho(f'Update failed with "{ERRORS[format_result.error]}"', fg=typer.colors.RED)
-            raise typer.Exit(1)
-        formatted_files.append(format_result.item_data)
 
-    write_result = phc.set_db_data(formatted_files)
-    if write_result.error:
-        typer.secho(f'Update failed with "{ERRORS[write_result.error]}"', fg=typer.colors.RED)
-        raise typer.Exit(1)
+# Rows per buffered write and rows sampled for widths the flags do not cover
+DISPLAY_CHUNK = 1000
+WIDTH_SAMPLE = 1000
 
+def _echo_chunk(text: str, color: bool, bold: bool = False) -> None:
+    profiling.count("bytes_rendered", len(text) + 1)
+    if color:
+        text = typer.style(text, fg=typer.colors.BLUE, bold=bold)
+    typer.echo(text, color=None if color else False)
 
-def display_db() -> None:
+"""
+Rows are formatted into chunks of DISPLAY_CHUNK lines and written with one
+echo per chunk. Column widths come from the "maxlen" flag kept up to date
+by refresh_db, or from a bounded sample of the displayed rows when it does
+not cover every column.
+"""
+def display_db(limit: Optional[int] = None, offset: int = 0, color: bool = True) -> None:
     phc = get_PHC()
 
     db_result = phc.get_db_data()
@@ -69,52 +105,138 @@ def display_db() -> None:
         typer.secho("There are no items in the directory", fg=typer.colors.RED)
         raise typer.Exit()
 
-    data_lists = {}
-    for key in db_result.data[0].keys():
-        data_lists[key] = [item[key] for item in db_result.data]
-    
-    # Format table
-    maxlen_id = len(str(len(db_result.data)))
-    maxlen_keys = {}
-    for key, value in data_lists.items():
-        maxlen_keys[key] = max(len(max(value, key=len)), len(key))
-
-        if key == "Name":
-            maxlen_keys[key] += 1
-
-    columns = ["#"]
-    columns.extend(data_lists.keys())
-    header = f"{columns[0]:<{maxlen_id}} |"
-    for col in columns[1:]:
-        header += f" {col:<{maxlen_keys[col]}} |"
-    
-    typer.secho(f'\n{database.CWD_PATH}:\n', fg=typer.colors.BLUE, bold=True)
-    typer.secho(header, fg=typer.colors.BLUE, bold=True)
-    typer.secho("-" * len(header), fg=typer.colors.BLUE)
+    flags_result = phc.get_flags_data()
+    if flags_result.error:
+        typer.secho(f'Displaying items failed with "{ERRORS[flags_result.error]}"', fg=typer.colors.RED,)
+        raise typer.Exit(1)
+
+    _print_table(
+        str(database.CWD_PATH), db_result.data, flags_result.flags.get("maxlen"), limit, offset, color
+    )
+
+OUTPUT_FORMATS = ("table", "ndjson", "csv", "tsv")
+
+def _write_chunk(buffer) -> None:
+    text = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    profiling.count("bytes_rendered", len(text))
+    typer.echo(text, nl=False)
+
+"""
+Writes rows for other programs as NDJSON, CSV or TSV: one line per row,
+after a header line for CSV and TSV, with no title, padding or colors. Rows
+are written as they are read from the database, in chunks of
+DISPLAY_CHUNK, so no pass over the data comes before the first line.
+"""
+def stream_db(output_format: str, limit: Optional[int] = None, offset: int = 0) -> None:
+    import io
+
+    phc = get_PHC()
+
+    db_result = phc.get_db_data()
+    if db_result.error:
+        typer.secho(f'Displaying items failed with "{ERRORS[db_result.error]}"', fg=typer.colors.RED,)
+        raise typer.Exit(1)
 
-    for id in range(1, len(db_result.data)+1):
-        line = f"{id:<{maxlen_id}} |"
-        for col in columns[1:]:
-            str_literal = data_lists[col][id-1]
-            spaces = maxlen_keys[col]
+    data = db_result.data
+    end = len(data) if limit is None else min(offset + limit, len(data))
+    columns = database.get_columns_of(data)
+    buffer = io.StringIO()
 
-            if col == "Name" and data_lists["Mode"][id-1] == "drwxr-xr-x":
-                str_literal += "/"
+    with profiling.phase("render"):
+        if output_format == "ndjson":
+            import json
 
-            line += f" {str_literal:<{spaces}} |"
-        typer.secho(line, fg=typer.colors.BLUE)
+            encode = json.JSONEncoder(ensure_ascii=False).encode
+            def write_row(item) -> None:
+                buffer.write(encode({col: item[col] for col in columns}))
+                buffer.write("\n")
+        else:
+            import csv
+
+            writer = csv.writer(buffer, delimiter="," if output_format == "csv" else "\t", lineterminator="\n")
+            writer.writerow(columns)
+            def write_row(item) -> None:
+                writer.writerow([item[col] for col in columns])
+
+        for id in range(offset, end):
+            write_row(data[id])
+            if (id - offset + 1) % DISPLAY_CHUNK == 0:
+                _write_chunk(buffer)
+        _write_chunk(buffer)
+    profiling.count("rows_rendered", max(end - offset, 0))
+
+def _print_table(
+    title: str,
+    data: List,
+    maxlen_keys: Optional[Dict[str, int]],
+    limit: Optional[int],
+    offset: int,
+    color: bool,
+) -> None:
+    end = len(data) if limit is None else min(offset + limit, len(data))
+    columns = database.get_columns_of(data)
 
-    typer.secho("-" * len(header) + "\n", fg=typer.colors.BLUE)
+    # Format table
+    maxlen_id = len(str(end))
+    maxlen_keys = maxlen_keys or {}
+    if any(col not in maxlen_keys for col in columns):
+        sample = data[offset:min(end, offset + WIDTH_SAMPLE)]
+        maxlen_keys = database.get_column_widths(sample, columns)
+
+    with profiling.phase("render"):
+        header = f"{'#':<{maxlen_id}} |"
+        for col in columns:
+            header += f" {col:<{maxlen_keys[col]}} |"
+
+        typer.secho(f'\n{title}:\n', fg=typer.colors.BLUE, bold=True)
+        _echo_chunk(header, color, bold=True)
+        _echo_chunk("-" * len(header), color)
+
+        lines = []
+        for id in range(offset + 1, end + 1):
+            item = data[id-1]
+            line = f"{id:<{maxlen_id}} |"
+            for col in columns:
+                str_literal = item[col]
+                if col == "Name" and item.get("Mode", "").startswith("d"):
+                    str_literal += "/"
+                line += f" {str_literal:<{maxlen_keys[col]}} |"
+            lines.append(line)
+
+            if len(lines) == DISPLAY_CHUNK:
+                _echo_chunk("\n".join(lines), color)
+                lines = []
+        if lines:
+            _echo_chunk("\n".join(lines), color)
+
+        _echo_chunk("-" * len(header) + "\n", color)
+    profiling.count("rows_rendered", max(end - offset, 0))
     
 @app.command()
-def init() -> None:
-    db_path = database.DEFAULT_DB_PATH
-    flags_path = flags.DEFAULT_FLAGS_PATH
-
-    app_init_error = config.init_app(db_path, flags_path)
+def init(
+    backend: str = typer.Option("json", "--backend", "-b", help="Storage backend: json, sqlite or columnar"),
+) -> None:
+    if backend not in database.BACKENDS:
+        typer.secho(f'Unknown backend "{backend}"', fg=typer.colors.RED)
+        raise typer.Exit(1)
+    app_init_error = config.init_app()
     if app_init_error:
         typer.secho(f'Creating config file failed with "{ERRORS[app_init_error]}"', fg=typer.colors.RED,)
         raise typer.Exit(1)
+
+    from pygeonhole.catalogue import open_catalogue
+
+    try:
+        entry = open_catalogue(config.CONFIG_FILE_PATH).register(
+            database.CWD_PATH, database.BACKENDS[backend]
+        )
+    except OSError:
+        typer.secho(f'Creating catalogue entry failed with "{ERRORS[CATALOGUE_ERROR]}"', fg=typer.colors.RED,)
+        raise typer.Exit(1)
+    db_path = entry.db_path
+    flags_path = entry.flags_path
     
     db_init_error = database.init_database(Path(db_path))
     if db_init_error:
@@ -131,33 +253,38 @@ def init() -> None:
     # Input files into database
     phc = get_PHC()
 
-    dir_result = phc.get_dir_data()
-    if dir_result.error:
-        typer.secho(f'Initialization failed with "{ERRORS[dir_result.error]}"', fg=typer.colors.RED)
+    refresh_result = phc.refresh_db()
+    if refresh_result.error:
+        typer.secho(f'Initialization failed with "{ERRORS[refresh_result.error]}"', fg=typer.colors.RED)
         raise typer.Exit(1)
 
-    formatted_files = []
-    for item in dir_result.dir_data:
-        format_result = phc.format_item(item)
-        if format_result.error:
-            typer.secho(f'Initialization failed with "{ERRORS[format_result.error]}"', fg=typer.colors.RED)
-            raise typer.Exit(1)
-        formatted_files.append(format_result.item_data)
+    display_db()
 
-    write_result = phc.set_db_data(formatted_files)
-    if write_result.error:
-        typer.secho(f'Initialization failed with "{ERRORS[write_result.error]}"', fg=typer.colors.RED)
-        raise typer.Exit(1)
+def _check_filter(where: str, no_show: Optional[List[str]]) -> None:
+    from pygeonhole.query import parse_query
 
-    display_db()
+    if parse_query(where, no_show).error:
+        typer.secho(f'Invalid filter "{where}"', fg=typer.colors.RED)
+        raise typer.Exit(1)
 
 @app.command()
 def show(
     show_hidden: bool = typer.Option(False, "--hidden", "-a", help="Show hidden files and directories"),
     show_dirs: bool = typer.Option(False, "-d", help="Show directories"),
     repeat_show: bool = typer.Option(False, "--repeat", "-r", help="Display list after every command"),
+    limit: Optional[int] = typer.Option(None, "--limit", "-n", help="Display at most this many items"),
+    offset: int = typer.Option(0, "--offset", help="Skip this many items before displaying"),
+    no_color: bool = typer.Option(False, "--no-color", help="Write the table without colors"),
+    recursive: bool = typer.Option(False, "--recursive", "-R", help="Index all subdirectories (same as --depth -1)"),
+    depth: Optional[int] = typer.Option(None, "--depth", help="Index subdirectories this many levels deep, -1 for all"),
+    workers: int = typer.Option(SCAN_WORKERS, "--workers", help="Number of directories scanned in parallel"),
+    where: Optional[str] = typer.Option(None, "--where", help='Only list items matching this filter, "" for all'),
+    output_format: str = typer.Option("table", "--format", "-f", help="table, or ndjson, csv or tsv for other programs"),
 ) -> None:
-    command_flags = locals().copy()
+    if output_format not in OUTPUT_FORMATS:
+        typer.secho(f'Unknown output format "{output_format}"', fg=typer.colors.RED)
+        raise typer.Exit(1)
+    command_flags = {"show_hidden": show_hidden, "show_dirs": show_dirs, "repeat_show": repeat_show}
     phc = get_PHC()
 
     read_result = phc.get_flags_data()
@@ -169,34 +296,155 @@ def show(
     # Stored flags are inverted if they are called
     for flag in command_flags.keys():
         curr_flags[flag] = not curr_flags[flag] if command_flags[flag] else curr_flags[flag]
+    if recursive:
+        curr_flags["depth"] = -1
+    elif depth is not None:
+        curr_flags["depth"] = depth
+    if where is not None:
+        _check_filter(where, curr_flags.get("no_show"))
+        curr_flags["where"] = where
 
     write_result = phc.set_flags_data(curr_flags)
     if write_result.error:
         typer.secho(f'Writing flags failed with "{ERRORS[write_result.error]}"', fg=typer.colors.RED,)
         raise typer.Exit(1)
     
-    update_db()
-    display_db()
+    update_db(workers)
+    if output_format == "table":
+        display_db(limit, offset, not no_color)
+    else:
+        stream_db(output_format, limit, offset)
+
+"""
+Sets the filter kept in the flags file and applied by every scan:
+space-separated terms such as ext:.py,.md  name:test_*  re:^a  type:f
+size>10k  mtime>=2024-01-01  age<7d, each negated by a leading "!".
+Without terms the filter is cleared.
+"""
+@app.command(name="filter")
+def filter_items(
+    terms: Optional[List[str]] = typer.Argument(None, help="Filter terms, all of which must match"),
+    hide: Optional[List[str]] = typer.Option(None, "--hide", help="Never list names matching this glob"),
+    unhide: bool = typer.Option(False, "--unhide", help="Forget all --hide globs"),
+) -> None:
+    import shlex
+
+    phc = get_PHC()
+
+    read_result = phc.get_flags_data()
+    if read_result.error:
+        typer.secho(f'Reading flags failed with "{ERRORS[read_result.error]}"', fg=typer.colors.RED,)
+        raise typer.Exit(1)
+
+    curr_flags = read_result.flags
+    where = " ".join(shlex.quote(term) for term in terms or [])
+    no_show = [] if unhide else list(curr_flags.get("no_show", []))
+    no_show.extend(pattern for pattern in hide or [] if pattern not in no_show)
+    _check_filter(where, no_show)
+    curr_flags["where"] = where
+    curr_flags["no_show"] = no_show
+
+    write_result = phc.set_flags_data(curr_flags)
+    if write_result.error:
+        typer.secho(f'Writing flags failed with "{ERRORS[write_result.error]}"', fg=typer.colors.RED,)
+        raise typer.Exit(1)
+
+    if curr_flags["repeat_show"]:
+        update_db()
+        display_db()
 
+"""
+Adds or removes columns of the table. Added columns are filled in by
+re-formatting every item, which also drops the current sort order.
+"""
 @app.command()
 def format(
-    
+    add: Optional[List[str]] = typer.Option(None, "--add", help='Column to add, e.g. Owner, Inode, Hash or "Total Size"'),
+    remove: Optional[List[str]] = typer.Option(None, "--remove", help="Column to remove"),
+    size_seconds: Optional[float] = typer.Option(None, "--size-seconds", help="Time budget of Total Size walks, 0 for none"),
+    size_entries: Optional[int] = typer.Option(None, "--size-entries", help="Entry budget of Total Size walks, 0 for none"),
 ) -> None:
+    for col in remove or []:
+        if col in database.REQUIRED_COLUMNS:
+            typer.secho(f'Column "{col}" cannot be removed', fg=typer.colors.RED,)
+            raise typer.Exit(1)
     phc = get_PHC()
 
     flag_result = phc.get_flags_data()
     if flag_result.error:
         typer.secho(f'Reading flags failed with "{ERRORS[flag_result.error]}"', fg=typer.colors.RED,)
         raise typer.Exit(1)
-    
+
+    columns_result = phc.get_columns()
+    if columns_result.error:
+        typer.secho(f'Formatting items failed with "{ERRORS[columns_result.error]}"', fg=typer.colors.RED,)
+        raise typer.Exit(1)
+
+    columns = list(columns_result.columns)
+    for col in add or []:
+        if col not in database.ITEM_DATA:
+            typer.secho(f'Column "{col}" not found', fg=typer.colors.RED,)
+            raise typer.Exit(1)
+        if col not in columns:
+            columns.append(col)
+    columns = [col for col in columns if col not in (remove or [])]
+
+    curr_flags = flag_result.flags
+    if size_seconds is not None or size_entries is not None or curr_flags.get("columns") != columns:
+        if size_seconds is not None:
+            curr_flags["size_seconds"] = size_seconds
+        if size_entries is not None:
+            curr_flags["size_entries"] = size_entries
+        # The schema is kept in the flags, so it outlives a database with no rows
+        curr_flags["columns"] = columns
+        write_result = phc.set_flags_data(curr_flags)
+        if write_result.error:
+            typer.secho(f'Writing flags failed with "{ERRORS[write_result.error]}"', fg=typer.colors.RED,)
+            raise typer.Exit(1)
+
+    if columns != columns_result.columns:
+        # A row without "_stat" is replaced by the next refresh
+        write_result = phc.set_db_data([dict.fromkeys(columns, "")])
+        if write_result.error:
+            typer.secho(f'Formatting items failed with "{ERRORS[write_result.error]}"', fg=typer.colors.RED,)
+            raise typer.Exit(1)
+        refresh_result = phc.refresh_db()
+        if refresh_result.error:
+            typer.secho(f'Formatting items failed with "{ERRORS[refresh_result.error]}"', fg=typer.colors.RED,)
+            raise typer.Exit(1)
 
     if flag_result.flags["repeat_show"]:
         display_db()
 
+@app.command()
+def dupes(
+    workers: Optional[int] = typer.Option(None, "--workers", help="Number of files hashed in parallel"),
+) -> None:
+    phc = get_PHC()
+
+    dupes_result = phc.find_duplicates(workers=workers)
+    if dupes_result.error:
+        typer.secho(f'Finding duplicates failed with "{ERRORS[dupes_result.error]}"', fg=typer.colors.RED,)
+        raise typer.Exit(1)
+    if not dupes_result.groups:
+        typer.secho("There are no duplicate files in the directory", fg=typer.colors.GREEN)
+        return
+
+    wasted = 0
+    for group in dupes_result.groups:
+        wasted += group.size * (len(group.names) - 1)
+        typer.secho(f"\n{group.digest} ({group.size} bytes):", fg=typer.colors.BLUE, bold=True)
+        typer.echo("\n".join(f"  {name}" for name in group.names))
+    typer.secho(
+        f"\n{len(dupes_result.groups)} groups of duplicates, {wasted} bytes in redundant copies",
+        fg=typer.colors.GREEN,
+    )
+
 @app.command()
 def sort(
-    sorting_key: str = typer.Argument(..., help="Name of column to sort"),
-    reverse_order: bool = typer.Option(False, "--reverse", "-r", help="Reverse order of sort")
+    sorting_keys: List[str] = typer.Argument(..., help='Columns to sort on, each may end in ":desc" or ":asc"'),
+    reverse_order: bool = typer.Option(False, "--reverse", "-r", help="Reverse order of sort"),
+    top: Optional[int] = typer.Option(None, "--top", "-t", help="Only display the first TOP items, without storing the order"),
 ) -> None:
     phc = get_PHC()
 
@@ -205,30 +453,36 @@ def sort(
         typer.secho(f'Reading flags failed with "{ERRORS[flag_result.error]}"', fg=typer.colors.RED,)
         raise typer.Exit(1)
     
-    db_result = phc.get_db_data()
-    if db_result.error:
-        typer.secho(f'Sorting items failed with "{ERRORS[db_result.error]}"', fg=typer.colors.RED,)
+    columns_result = phc.get_columns()
+    if columns_result.error:
+        typer.secho(f'Sorting items failed with "{ERRORS[columns_result.error]}"', fg=typer.colors.RED,)
         raise typer.Exit(1)
 
-    curr_db = db_result.data
-    dirs = [item for item in curr_db if item["Mode"] == "drwxr-xr-x"]
-    files = [item for item in curr_db if item["Mode"] == "-rw-r--r--"]
-    dirs = sorted(dirs, key=lambda x: x[sorting_key])
-    files = sorted(files, key=lambda x: x[sorting_key])
-    curr_db = sorted(curr_db, key=lambda x: x[sorting_key])
+    keys = []
+    for sorting_key in sorting_keys:
+        descending = False
+        for suffix in (":asc", ":desc"):
+            if sorting_key.endswith(suffix) and sorting_key not in columns_result.columns:
+                sorting_key, descending = sorting_key[:-len(suffix)], suffix == ":desc"
+        if sorting_key not in columns_result.columns:
+            typer.secho(f'Column "{sorting_key}" not found', fg=typer.colors.RED,)
+            raise typer.Exit(1)
+        keys.append((sorting_key, descending != reverse_order))
+    dirs_first = keys[0][0] in ["Name", "Ext."]
 
-    if reverse_order:
-        dirs = dirs[::-1]
-        files = files[::-1]
-        curr_db = curr_db[::-1]
-    
-    dirs.extend(files)
-    if sorting_key in ["Name", "Ext."]:
-        write_db = phc.set_db_data(dirs)
-    else:
-        write_db = phc.set_db_data(curr_db)
-    if write_db.error:
-        typer.secho(f'Sorting items failed with "{ERRORS[write_db.error]}"', fg=typer.colors.RED,)
+    if top is not None:
+        top_result = phc.top_db_data(keys, dirs_first, top)
+        if top_result.error:
+            typer.secho(f'Sorting items failed with "{ERRORS[top_result.error]}"', fg=typer.colors.RED,)
+            raise typer.Exit(1)
+        _print_table(
+            str(database.CWD_PATH), top_result.data, flag_result.flags.get("maxlen"), None, 0, True
+        )
+        return
+
+    sort_result = phc.sort_db_data_by(keys, dirs_first)
+    if sort_result.error:
+        typer.secho(f'Sorting items failed with "{ERRORS[sort_result.error]}"', fg=typer.colors.RED,)
         raise typer.Exit(1)
 
     if flag_result.flags["repeat_show"]:
@@ -236,42 +490,405 @@ def sort(
 
 @app.command()
 def export(
-    user_path: str = typer.Option(None, "--pathname", "-p", help="Specify a path to export files to")
+    user_path: str = typer.Option(None, "--pathname", "-p", help="Specify a path to export files to"),
+    workers: int = typer.Option(4, "--workers", "-w", help="Number of files copied, or chunks compressed, in parallel"),
+    mode: str = typer.Option("copy", "--mode", "-m", help="copy, hardlink or reflink (falls back to copy)"),
+    resume: bool = typer.Option(False, "--resume", help="Continue an interrupted export"),
+    archive: str = typer.Option(None, "--archive", "-a", help="Export into one tar.gz, tar.zst or zip archive"),
+    level: int = typer.Option(None, "--level", "-l", help="Compression level of the archive"),
 ) -> None:
+    from pygeonhole import archive as archive_engine
+    from pygeonhole import export as export_engine
+
+    if mode not in export_engine.EXPORT_MODES:
+        typer.secho(f'Unknown export mode "{mode}"', fg=typer.colors.RED,)
+        raise typer.Exit(1)
+    if archive is not None:
+        if archive not in archive_engine.ARCHIVE_FORMATS:
+            typer.secho(f'Unknown archive format "{archive}"', fg=typer.colors.RED,)
+            raise typer.Exit(1)
+        if archive == "tar.zst" and archive_engine.zstandard is None:
+            typer.secho("tar.zst archives need the zstandard package.", fg=typer.colors.RED,)
+            raise typer.Exit(1)
+        if resume:
+            typer.secho("Archives cannot be resumed.", fg=typer.colors.RED,)
+            raise typer.Exit(1)
+        levels = archive_engine.ARCHIVE_LEVELS[archive]
+        if level is not None and level not in levels:
+            raise typer.BadParameter(
+                f"{archive} takes levels {levels.start} to {levels.stop - 1}", param_hint="'--level' / '-l'"
+            )
     phc = get_PHC()
 
+    flag_result = phc.get_flags_data()
+    if flag_result.error:
+        typer.secho(f'Reading flags failed with "{ERRORS[flag_result.error]}"', fg=typer.colors.RED,)
+        raise typer.Exit(1)
+
     db_result = phc.get_db_data()
     if db_result.error:
         typer.secho(f'Reading flags failed with "{ERRORS[db_result.error]}"', fg=typer.colors.RED,)
         raise typer.Exit(1)
     
-    db_items = [item["Name"] for item in db_result.data]
-    new_dir = user_path if user_path else "ph_export"
+    db_items = [item["Name"] for item in db_result.data if item["Name"]]
+    # A recursive index already lists the contents of its directories
+    copy_dirs = flag_result.flags.get("depth", 0) == 0
+    default_path = f"ph_export.{archive}" if archive else "ph_export"
+    new_dir = Path(user_path if user_path else default_path)
+    if new_dir.exists() and not resume:
+        typer.secho(f"Export {'archive' if archive else 'folder'} already exists.", fg=typer.colors.RED,)
+        raise typer.Exit(1)
+
+    total_size = sum(max(item.get("_Size", 0), 0) for item in db_result.data)
+    with typer.progressbar(length=total_size, label="Exporting") as progress:
+        last_size = [0]
+        def update(size: int) -> None:
+            progress.update(size - last_size[0])
+            last_size[0] = size
+
+        with profiling.phase("export"):
+            if archive:
+                export_result = archive_engine.export_archive(
+                    db_items, new_dir, archive, level, workers, update, copy_dirs
+                )
+            else:
+                export_result = export_engine.export_items(
+                    db_items, new_dir, workers, mode, resume, update, copy_dirs
+                )
+        profiling.count("files_exported", export_result.files)
+        profiling.count("bytes_exported", export_result.size)
+    if export_result.error:
+        typer.secho(f'Exporting items failed with "{ERRORS[export_result.error]}"', fg=typer.colors.RED,)
+        raise typer.Exit(1)
+
+    size_mb = export_result.size / 2**20
+    speed = size_mb / export_result.seconds if export_result.seconds else 0.0
+    written = f"{size_mb:.1f} MB"
+    if archive:
+        archive_mb = new_dir.stat().st_size / 2**20
+        ratio = archive_mb / size_mb if size_mb else 0.0
+        written += f", {archive_mb:.1f} MB compressed, ratio {ratio:.2f}"
+    typer.secho(
+        f"Exported {export_result.files} files ({written}) to {new_dir} "
+        f"in {export_result.seconds:.2f}s, {speed:.1f} MB/s",
+        fg=typer.colors.GREEN,
+    )
+
+
+@app.command()
+def migrate(
+    backend: str = typer.Argument(..., help="Storage backend to move the database to: json, sqlite or columnar"),
+) -> None:
+    if backend not in database.BACKENDS:
+        typer.secho(f'Unknown backend "{backend}"', fg=typer.colors.RED)
+        raise typer.Exit(1)
+    phc = get_PHC()
+
+    db_result = phc.get_db_data()
+    if db_result.error:
+        typer.secho(f'Migrating database failed with "{ERRORS[db_result.error]}"', fg=typer.colors.RED,)
+        raise typer.Exit(1)
+
+    flags_result = phc.get_flags_data()
+    if flags_result.error:
+        typer.secho(f'Migrating database failed with "{ERRORS[flags_result.error]}"', fg=typer.colors.RED,)
+        raise typer.Exit(1)
+
+    app_init_error = config.init_app()
+    if app_init_error:
+        typer.secho(f'Updating config file failed with "{ERRORS[app_init_error]}"', fg=typer.colors.RED,)
+        raise typer.Exit(1)
+
+    from pygeonhole.catalogue import open_catalogue
+
+    # Databases from before the catalogue move into it here
+    dir_catalogue = open_catalogue(config.CONFIG_FILE_PATH)
+    old_db_path = database.get_database_path(config.CONFIG_FILE_PATH)
+    old_flags_path = flags.get_flags_path(config.CONFIG_FILE_PATH)
+    db_path, flags_path = dir_catalogue.paths(database.CWD_PATH, database.BACKENDS[backend])
+    write_result = database.DatabaseHandler(db_path).write_db_data(list(db_result.data))
+    if write_result.error:
+        typer.secho(f'Migrating database failed with "{ERRORS[write_result.error]}"', fg=typer.colors.RED,)
+        raise typer.Exit(1)
+    if flags_path != flags.get_flags_path(config.CONFIG_FILE_PATH):
+        write_result = flags.FlagsHandler(flags_path).write_flags_data(flags_result.flags)
+        if write_result.error:
+            typer.secho(f'Migrating flags failed with "{ERRORS[write_result.error]}"', fg=typer.colors.RED,)
+            raise typer.Exit(1)
+
     try:
-        if not os.path.exists(new_dir):
-            os.mkdir(new_dir)
-        else:
-            typer.secho("Export folder already exists.", fg=typer.colors.RED,)
+        dir_catalogue.register(database.CWD_PATH, database.BACKENDS[backend])
+    except OSError:
+        typer.secho(f'Updating catalogue failed with "{ERRORS[CATALOGUE_ERROR]}"', fg=typer.colors.RED,)
+        raise typer.Exit(1)
+
+    if old_db_path != db_path:
+        # Changes earlier steps of a batch left pending go out before the old database is dropped
+        flush_error = phc.flush()
+        if flush_error:
+            typer.secho(f'Saving changes failed with "{ERRORS[flush_error]}"', fg=typer.colors.RED)
             raise typer.Exit(1)
-    except IOError:
-        typer.secho(f'Creating directory failed with "{ERRORS[PATH_ERROR]}"', fg=typer.colors.RED,)
+        _controllers.pop((old_db_path, old_flags_path), None)
+        dir_catalogue.discard(old_db_path)
+
+    typer.secho(f"The pigeonhole database is {db_path}", fg=typer.colors.GREEN)
+
+def _refresh_live() -> None:
+    try:
+        phc = get_PHC()
+    except typer.Exit:
+        return
+    _live.refresh(phc)
+    phc.flush()
+
+@app.command()
+def serve(
+    poll: bool = typer.Option(False, "--poll", help="Poll the directory instead of using inotify"),
+    interval: float = typer.Option(1.0, "--interval", help="Seconds between polls"),
+) -> None:
+    global _live
+    from pygeonhole import daemon
+    from pygeonhole.dirsize import size_cache_path
+    from pygeonhole.hashing import hash_cache_path
+
+    get_PHC()
+    own_files = (
+        database.get_database_path(config.CONFIG_FILE_PATH).name,
+        flags.get_flags_path(config.CONFIG_FILE_PATH).name,
+        hash_cache_path(database.get_database_path(config.CONFIG_FILE_PATH)).name,
+        size_cache_path(database.get_database_path(config.CONFIG_FILE_PATH)).name,
+        os.path.basename(daemon.socket_path()),
+    )
+
+    def ready(path: str) -> None:
+        typer.secho(f"Serving {database.CWD_PATH} on {path} ({_live.watcher})", fg=typer.colors.GREEN)
+
+    _live = daemon.LiveIndex()
+    try:
+        daemon.serve(
+            _live,
+            app,
+            lambda: list(_controllers.values()),
+            _refresh_live,
+            lambda name: name.startswith(own_files),
+            poll,
+            interval,
+            ready,
+        )
+    except FileExistsError:
+        typer.secho("A pygeonhole server is already running here", fg=typer.colors.RED)
         raise typer.Exit(1)
-    
+    finally:
+        _live = None
+
+# Commands a batch cannot run: itself, and the server that never returns
+BATCH_EXCLUDED = ("batch", "serve")
+
+def _read_script(script: Optional[Path]) -> List[List[str]]:
+    try:
+        if script is None or str(script) == "-":
+            import sys
+
+            text = sys.stdin.read()
+        else:
+            text = script.read_text()
+    except OSError:
+        typer.secho(f"Reading {script} failed", fg=typer.colors.RED)
+        raise typer.Exit(1)
+
+    import shlex
+
+    steps = []
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            argv = shlex.split(line)
+        except ValueError:
+            typer.secho(f'Line {number}: cannot parse "{line}"', fg=typer.colors.RED)
+            raise typer.Exit(1)
+        command = next((arg for arg in argv if not arg.startswith("-")), None)
+        if command in BATCH_EXCLUDED:
+            typer.secho(f'Line {number}: "{command}" cannot run in a batch', fg=typer.colors.RED)
+            raise typer.Exit(1)
+        steps.append(argv)
+    return steps
+
+"""
+Runs a script of commands, one per line as they would follow
+pygeonhole-cli, in this process. Every step works on the same controllers,
+so the config is parsed and the database and flags are read once, changes
+stay in memory between steps and are written once at the end. Blank lines
+and lines starting with # are skipped. Stops at the first failing step
+unless --keep-going, and prints the time of each step on stderr.
+"""
+@app.command()
+def batch(
+    script: Optional[Path] = typer.Argument(None, help='File of commands, stdin when omitted or "-"'),
+    keep_going: bool = typer.Option(False, "--keep-going", "-k", help="Run the remaining steps after a failure"),
+    quiet: bool = typer.Option(False, "--quiet", "-q", help="Do not print the step timings"),
+) -> None:
+    global _batching
+    import shlex
+    import time
+
+    steps = _read_script(script)
+    command = typer.main.get_command(app)
+    timings = []
+    failed = 0
+
+    _batching = True
     try:
-        for name in db_items:
-            copy2(Path(name), new_dir)
-    except IOError:
-        typer.secho(f'Exporting items failed with "{ERRORS[EXPORT_ERROR]}"', fg=typer.colors.RED,)
+        for argv in steps:
+            start = time.perf_counter()
+            try:
+                command.main(args=argv, prog_name=__app_name__)
+                code = 0
+            except SystemExit as exit:
+                code = exit.code if isinstance(exit.code, int) else int(exit.code is not None)
+            timings.append((shlex.join(argv), time.perf_counter() - start, code))
+            if code:
+                failed = code
+                if not keep_going:
+                    break
+    finally:
+        _batching = False
+
+    if not quiet:
+        width = len(str(len(timings)))
+        lines = [f"{'#':<{width}} | {'seconds':>9} | {'code':>4} | command"]
+        for id, (line, seconds, code) in enumerate(timings, 1):
+            lines.append(f"{id:<{width}} | {seconds:>9.4f} | {code:>4} | {line}")
+        lines.append(f"{'':<{width}} | {sum(timing[1] for timing in timings):>9.4f} |      | total")
+        typer.echo("\n".join(lines), err=True)
+    if failed:
+        raise typer.Exit(failed)
+
+catalogue_app = typer.Typer(help="List, search and forget the indexed directories")
+app.add_typer(catalogue_app, name="catalogue")
+
+# The databases of the entries, read in parallel; None where one cannot be read
+def _read_catalogue(entries: List["CatalogueEntry"]) -> List[Optional[List]]:
+    from concurrent.futures import ThreadPoolExecutor
+
+    def read(entry: "CatalogueEntry") -> Optional[List]:
+        db_result = database.DatabaseHandler(entry.db_path).read_db_data()
+        return None if db_result.error else db_result.data
+
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as pool:
+        return list(pool.map(read, entries))
+
+@catalogue_app.command("list")
+def catalogue_list() -> None:
+    from pygeonhole.catalogue import open_catalogue
+
+    entries = open_catalogue(config.CONFIG_FILE_PATH).entries()
+    if not entries:
+        typer.secho("No directories are indexed", fg=typer.colors.RED)
+        raise typer.Exit()
+
+    rows = []
+    for entry, data in zip(entries, _read_catalogue(entries)):
+        items = str(sum("_stat" in item for item in data)) if data is not None else "--"
+        rows.append({
+            "Directory": entry.dir_path,
+            "Items": items,
+            "Database": entry.db_path.suffix[1:],
+            "Last Used": database.format_time(entry.last_used),
+        })
+    _print_table("Catalogue", rows, None, None, 0, True)
+
+"""
+Lists the items of every catalogued directory, as they were last indexed,
+in one table. Items can be filtered with the query language of "filter"
+and sorted on any column, across directories.
+"""
+@catalogue_app.command("search")
+def catalogue_search(
+    terms: Optional[List[str]] = typer.Argument(None, help="Filter terms, all of which must match"),
+    sorting_key: Optional[str] = typer.Option(None, "--sort", "-s", help="Name of column to sort on"),
+    reverse_order: bool = typer.Option(False, "--reverse", "-r", help="Reverse order of sort"),
+    limit: Optional[int] = typer.Option(None, "--limit", "-n", help="Display at most this many items"),
+    no_color: bool = typer.Option(False, "--no-color", help="Write the table without colors"),
+) -> None:
+    import shlex
+
+    from pygeonhole.catalogue import open_catalogue
+    from pygeonhole.query import parse_query
+
+    query_result = parse_query(" ".join(shlex.quote(term) for term in terms or []))
+    if query_result.error:
+        typer.secho(f'Invalid filter "{" ".join(terms)}"', fg=typer.colors.RED)
         raise typer.Exit(1)
 
+    rows = []
+    columns: Dict[str, None] = {"Directory": None}
+    entries = open_catalogue(config.CONFIG_FILE_PATH).entries()
+    for entry, data in zip(entries, _read_catalogue(entries)):
+        if data is None:
+            continue
+        for item in data:
+            if "_stat" in item and (query_result.query is None or query_result.query.match_row(item)):
+                columns.update(dict.fromkeys(item))
+                rows.append((entry.dir_path, item))
+    if not rows:
+        typer.secho("No items match", fg=typer.colors.RED)
+        raise typer.Exit()
+
+    data = [dict(dict.fromkeys(columns, ""), Directory=dir_path, **item) for dir_path, item in rows]
+    if sorting_key is not None:
+        if sorting_key not in columns or sorting_key.startswith("_"):
+            typer.secho(f'Column "{sorting_key}" not found', fg=typer.colors.RED,)
+            raise typer.Exit(1)
+        data = backends.sort_items(data, sorting_key, reverse_order, sorting_key in ["Name", "Ext."])
+    _print_table("Catalogue", data, None, limit, 0, not no_color)
+
+@catalogue_app.command("forget")
+def catalogue_forget(
+    dir_path: Optional[Path] = typer.Argument(None, help="Directory to drop, the current one by default"),
+) -> None:
+    from pygeonhole.catalogue import open_catalogue
+
+    dir_path = dir_path or Path(database.CWD_PATH)
+    try:
+        forgotten = open_catalogue(config.CONFIG_FILE_PATH).forget(str(dir_path))
+    except OSError:
+        typer.secho(f'Updating catalogue failed with "{ERRORS[CATALOGUE_ERROR]}"', fg=typer.colors.RED,)
+        raise typer.Exit(1)
+    if not forgotten:
+        typer.secho(f"{dir_path} is not indexed", fg=typer.colors.RED)
+        raise typer.Exit(1)
+    typer.secho(f"Forgot {dir_path}", fg=typer.colors.GREEN)
 
 def _version_callback(value: bool) -> None:
     if value:
         typer.echo(f"{__app_name__} v{__version__}")
         raise typer.Exit()
 
+"""
+Reports the profile of the command once its changes were flushed: a table
+on stderr, or the same figures as JSON.
+"""
+def _report_profile(as_json: bool) -> None:
+    profile = profiling.stop()
+    if profile is None:
+        return
+    if as_json:
+        import json
+
+        typer.echo(json.dumps(profile.summary(), indent=4), err=True)
+    else:
+        typer.echo(profile.format_table(), err=True)
+
+def _dump_cprofile(profiler, path: Path) -> None:
+    profiler.disable()
+    profiler.dump_stats(str(path))
+    typer.secho(f"cProfile stats written to {path}", fg=typer.colors.GREEN, err=True)
+
 @app.callback()
 def main(
+    ctx: typer.Context,
     version: Optional[bool] = typer.Option(
         None,
         "--version",
@@ -279,6 +896,26 @@ def main(
         help="Show the application's version and exit.",
         callback=_version_callback,
         is_eager=True,
-    )
+    ),
+    profile: bool = typer.Option(False, "--profile", help="Print the time and I/O of each phase of the command"),
+    profile_json: bool = typer.Option(False, "--profile-json", help="Print the profile as JSON"),
+    cprofile: Optional[Path] = typer.Option(None, "--cprofile", help="Write cProfile stats of the command here"),
 ) -> None:
-    return
\ No newline at end of file
+    profiler = None
+    if cprofile is not None:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if profile or profile_json:
+        profiling.start()
+
+    # One callback, since click versions differ in the order they run several
+    def close() -> None:
+        _flush_controllers()
+        if profile or profile_json:
+            _report_profile(profile_json)
+        if profiler is not None:
+            _dump_cprofile(profiler, cprofile)
+
+    ctx.call_on_close(close)
\ No newline at end of file
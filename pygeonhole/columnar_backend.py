@@ -0,0 +1,268 @@
+import json
+import mmap
+import struct
+from array import array
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from pygeonhole.backends import BackendError, apply_order, partition_dirs, sort_items
+from pygeonhole.locking import atomic_write
+from pygeonhole.rows import MISSING as _MISSING, Row, schema_of
+
+"""
+Binary, column-major database file, read through mmap.
+
+    header   magic, offset and length of the footer
+    strings  u32 end offsets and the UTF-8 bytes of every distinct string
+    columns  one section per column, 8-byte aligned
+    footer   JSON: row count, string table position and the column layout
+
+Each column has a kind chosen from its values: "str" (u32 codes into the
+string table), "int" (int64), "float" (double), "ints" (fixed length lists
+of int64, such as "_stat") or "json" (codes of JSON text). Missing values
+are a 0xFFFFFFFF code, or a byte-per-row presence section for numbers.
+Column names, repeated values such as Mode or Ext., and row dicts are thus
+stored once instead of per row, and a reader decodes only the cells it
+looks at.
+"""
+
+MAGIC = b"PHCOLS01"
+HEADER = struct.Struct("<8sQQ")
+MISSING_CODE = 0xFFFFFFFF
+INT64_MIN, INT64_MAX = -2**63, 2**63 - 1
+
+def _is_int(value: Any) -> bool:
+    return type(value) is int and INT64_MIN <= value <= INT64_MAX
+
+def _column_kind(values: List[Any]) -> Tuple[str, int]:
+    present = [value for value in values if value is not _MISSING]
+    if all(type(value) is str for value in present):
+        return "str", 1
+    if all(_is_int(value) for value in present):
+        return "int", 1
+    if all(type(value) is float for value in present):
+        return "float", 1
+    if present and all(type(value) is list for value in present):
+        width = len(present[0])
+        if all(len(value) == width and all(_is_int(x) for x in value) for value in present):
+            return "ints", width
+    return "json", 1
+
+def _pad(out: bytearray) -> None:
+    out.extend(b"\0" * (-len(out) % 8))
+
+"""
+Serializes columns of equal length, given as (name, values) with _MISSING
+for absent cells, into the file format above.
+"""
+def _encode(columns: List[Tuple[str, List[Any]]], nrows: int) -> bytes:
+    strings: Dict[str, int] = {}
+
+    def code(text: str) -> int:
+        return strings.setdefault(text, len(strings))
+
+    sections = []
+    layout = []
+    for name, values in columns:
+        kind, width = _column_kind(values)
+        nullable = any(value is _MISSING for value in values)
+        if kind in ("str", "json"):
+            dump = (lambda v: v) if kind == "str" else json.dumps
+            codes = array("I", (
+                MISSING_CODE if value is _MISSING else code(dump(value)) for value in values
+            ))
+            sections.append((codes.tobytes(), None))
+            nullable = False
+        else:
+            typecode, empty = ("d", 0.0) if kind == "float" else ("q", 0)
+            cells = array(typecode)
+            for value in values:
+                if value is _MISSING:
+                    cells.extend([empty] * width)
+                elif kind == "ints":
+                    cells.extend(value)
+                else:
+                    cells.append(value)
+            presence = bytes(value is not _MISSING for value in values) if nullable else None
+            sections.append((cells.tobytes(), presence))
+        layout.append([name, kind, width, nullable])
+
+    out = bytearray(HEADER.size)
+    text = [key.encode("utf-8") for key in strings]
+    ends = array("I")
+    end = 0
+    for encoded in text:
+        end += len(encoded)
+        ends.append(end)
+    if end > MISSING_CODE:
+        raise BackendError("string table too large")
+    strings_offset = len(out)
+    out += ends.tobytes()
+    out += b"".join(text)
+    for column, (cells, presence) in zip(layout, sections):
+        _pad(out)
+        column.append(len(out))
+        out += cells
+        column.append(len(out) if presence is not None else None)
+        if presence is not None:
+            out += presence
+    _pad(out)
+
+    footer = json.dumps({
+        "rows": nrows, "strings": [strings_offset, len(strings)], "columns": layout
+    }).encode("utf-8")
+    footer_offset = len(out)
+    out += footer
+    out[:HEADER.size] = HEADER.pack(MAGIC, footer_offset, len(footer))
+    return bytes(out)
+
+class ColumnarTable:
+    def __init__(self, db_path: Path) -> None:
+        with db_path.open("rb") as db:
+            try:
+                self._map = mmap.mmap(db.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as error:
+                raise BackendError(f"{db_path} is empty") from error
+        view = memoryview(self._map)
+        magic, footer_offset, footer_len = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise BackendError(f"{db_path} is not a columnar database")
+        footer = json.loads(bytes(view[footer_offset:footer_offset + footer_len]))
+
+        self.nrows = footer["rows"]
+        strings_offset, nstrings = footer["strings"]
+        self._ends = view[strings_offset:strings_offset + 4 * nstrings].cast("I")
+        self._blob = strings_offset + 4 * nstrings
+        self._decoded: Dict[int, str] = {}
+        self.columns: Dict[str, Tuple[str, int, Any, Optional[memoryview]]] = {}
+        for name, kind, width, nullable, offset, presence_offset in footer["columns"]:
+            typecode, size = ("d", 8) if kind == "float" else ("q", 8) if kind in ("int", "ints") else ("I", 4)
+            cells = view[offset:offset + size * width * self.nrows].cast(typecode)
+            presence = view[presence_offset:presence_offset + self.nrows] if nullable else None
+            self.columns[name] = (kind, width, cells, presence)
+        self._schema = schema_of(tuple(self.columns))
+
+    def _string(self, code: int) -> str:
+        text = self._decoded.get(code)
+        if text is None:
+            start = self._blob + (self._ends[code - 1] if code else 0)
+            end = self._blob + self._ends[code]
+            text = self._map[start:end].decode("utf-8")
+            self._decoded[code] = text
+        return text
+
+    def value(self, name: str, row: int) -> Any:
+        kind, width, cells, presence = self.columns[name]
+        if kind in ("str", "json"):
+            code = cells[row]
+            if code == MISSING_CODE:
+                return _MISSING
+            return self._string(code) if kind == "str" else json.loads(self._string(code))
+        if presence is not None and not presence[row]:
+            return _MISSING
+        if kind == "ints":
+            return cells[row * width:(row + 1) * width].tolist()
+        return cells[row]
+
+    def has_all(self, name: str) -> bool:
+        if name not in self.columns:
+            return False
+        kind, _, cells, presence = self.columns[name]
+        if kind in ("str", "json"):
+            return MISSING_CODE not in cells
+        return presence is None
+
+    def row(self, row: int) -> Row:
+        return Row(self._schema, tuple(self.value(name, row) for name in self.columns))
+
+"""
+Read-only list of the rows of a ColumnarTable, in the order given by rows.
+Row dicts are only built for the items that are looked at, sorting reads
+just the sort and Mode columns, and storing a reordered view copies column
+values without building dicts.
+"""
+class ColumnarRows(Sequence):
+    def __init__(self, table: ColumnarTable, rows: Optional[List[int]] = None) -> None:
+        self._table = table
+        self._rows = list(range(table.nrows)) if rows is None else rows
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._table.row(row) for row in self._rows[index]]
+        return self._table.row(self._rows[index])
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Sequence):
+            return NotImplemented
+        return len(self) == len(other) and list(self) == list(other)
+
+    __hash__ = None
+
+    def __add__(self, other: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return list(self) + list(other)
+
+    def column(self, name: str) -> List[Any]:
+        return [self._table.value(name, row) for row in self._rows]
+
+    def column_names(self) -> List[str]:
+        return list(self._table.columns)
+
+    def sorted(self, sorting_key: str, reverse_order: bool, dirs_first: bool) -> "ColumnarRows":
+        if self._table.has_all("_" + sorting_key):
+            sorting_key = "_" + sorting_key
+        keys = self.column(sorting_key)
+        positions = range(len(self._rows))
+        if dirs_first:
+            modes = self.column("Mode")
+            dirs, files = partition_dirs(positions, lambda i: modes[i][:1] == "d")
+            dirs.sort(key=keys.__getitem__)
+            files.sort(key=keys.__getitem__)
+            order, ndirs = dirs + files, len(dirs)
+        else:
+            order, ndirs = sorted(positions, key=keys.__getitem__), 0
+        order = apply_order(order, ndirs, reverse_order)
+        return ColumnarRows(self._table, [self._rows[i] for i in order])
+
+class ColumnarBackend:
+    def __init__(self, db_path: Path) -> None:
+        self._db_path = db_path
+
+    def read(self) -> ColumnarRows:
+        return ColumnarRows(ColumnarTable(self._db_path))
+
+    def write(self, data: List[Dict[str, Any]]) -> None:
+        if isinstance(data, ColumnarRows):
+            columns = [(name, data.column(name)) for name in data.column_names()]
+        else:
+            names: Dict[str, None] = {}
+            for item in data:
+                names.update(dict.fromkeys(item))
+            columns = [(name, [item.get(name, _MISSING) for item in data]) for name in names]
+        encoded = _encode(columns, len(data))
+        atomic_write(self._db_path, lambda db: db.write(encoded), binary=True)
+
+    def update(
+        self, data: List[Dict[str, Any]], changed: List[Dict[str, Any]], removed: List[str]
+    ) -> None:
+        self.write(data)
+
+    def sort(
+        self,
+        data: List[Dict[str, Any]],
+        sorting_key: str,
+        reverse_order: bool,
+        dirs_first: bool,
+        use_index: bool = True,
+    ) -> List[Dict[str, Any]]:
+        if isinstance(data, ColumnarRows):
+            return data.sorted(sorting_key, reverse_order, dirs_first)
+        return sort_items(data, sorting_key, reverse_order, dirs_first)
+
+    def reorder(
+        self, data: List[Dict[str, Any]], sorting_key: str, reverse_order: bool, dirs_first: bool
+    ) -> None:
+        self.write(data)
@@ -1,5 +1,6 @@
 import configparser
 from pathlib import Path
+from typing import Dict
 
 import typer
 
@@ -9,12 +10,24 @@ from pygeonhole import (
 
 CONFIG_DIR_PATH = Path(typer.get_app_dir(__app_name__))
 CONFIG_FILE_PATH = CONFIG_DIR_PATH / "config.ini"
+CATALOGUE_DIR_PATH = CONFIG_DIR_PATH / "catalogue"
+DEFAULT_MAX_DIRECTORIES = 200
 
-def init_app(db_path: str, flags_path: str) -> int:
+# Parsed config files, so every lookup in a process shares one parse
+_parsed_configs: Dict[Path, configparser.ConfigParser] = {}
+
+def read_config(config_file: Path) -> configparser.ConfigParser:
+    if config_file not in _parsed_configs:
+        config_parser = configparser.ConfigParser()
+        config_parser.read(config_file)
+        _parsed_configs[config_file] = config_parser
+    return _parsed_configs[config_file]
+
+def init_app() -> int:
     config_code = _init_config_file()
     if config_code != SUCCESS:
         return config_code
-    database_code = _create_database(db_path, flags_path)
+    database_code = _create_database()
     if database_code != SUCCESS:
         return database_code
     return SUCCESS
@@ -30,12 +43,22 @@ def _init_config_file() -> int:
         return FILE_ERROR
     return SUCCESS
 
-def _create_database(db_path: str, flags_path: str) -> int:
+"""
+Databases are registered in the catalogue, so the config only has to say
+where the catalogue is; settings already in the file are kept.
+"""
+def _create_database() -> int:
     config_parser = configparser.ConfigParser()
-    config_parser["General"] = {"database": db_path, "flags": flags_path}
+    config_parser.read(CONFIG_FILE_PATH)
+    if not config_parser.has_section("General"):
+        config_parser["General"] = {}
+    general = config_parser["General"]
+    general.setdefault("catalogue", str(CATALOGUE_DIR_PATH))
+    general.setdefault("max_directories", str(DEFAULT_MAX_DIRECTORIES))
     try:
         with CONFIG_FILE_PATH.open("w") as file:
             config_parser.write(file)
     except OSError:
         return DB_WRITE_ERROR
+    _parsed_configs[CONFIG_FILE_PATH] = config_parser
     return SUCCESS
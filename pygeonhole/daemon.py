@@ -0,0 +1,286 @@
+import json
+import os
+import socket
+import sys
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+"""
+Optional long-running server for a directory. `pygeonhole-cli serve` keeps
+the controller of the directory, and so its database and flags, in memory
+and keeps the index current from a watcher thread (inotify, or polling
+where inotify is not available). Thin clients send the arguments of show,
+filter, sort, export and dupes over a Unix socket in the directory, the server
+runs the command against its warm state and returns the output. Without a
+server the CLI runs the command itself.
+
+Only the client half is imported on every call, so it must stay free of
+typer and the command modules.
+"""
+
+CLIENT_COMMANDS = ("show", "filter", "sort", "export", "dupes")
+
+# inotify_add_watch mask: entries created, removed, renamed or changed
+IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE = 0x2, 0x4, 0x8
+IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x40, 0x80, 0x100, 0x200
+IN_DELETE_SELF, IN_MOVE_SELF = 0x400, 0x800
+IN_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+)
+# Events arriving this close together are handled with one refresh
+DEBOUNCE = 0.05
+
+def socket_path(dir_path: Optional[str] = None) -> str:
+    dir_path = dir_path or os.getcwd()
+    return os.path.join(dir_path, "." + os.path.basename(os.path.abspath(dir_path)) + "_ph.sock")
+
+def _recv_all(conn: socket.socket) -> bytes:
+    chunks = []
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+"""
+Runs argv on the server of the current directory and writes its output.
+Returns the exit code, or None when no server is listening, in which case
+the caller runs the command itself.
+"""
+def request(argv: List[str]) -> Optional[int]:
+    path = socket_path()
+    if not os.path.exists(path):
+        return None
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            conn.connect(path)
+        except OSError:
+            return None
+        message = {"argv": argv, "color": sys.stdout.isatty()}
+        try:
+            conn.sendall(json.dumps(message).encode("utf-8"))
+            conn.shutdown(socket.SHUT_WR)
+            reply = json.loads(_recv_all(conn))
+        except (OSError, ValueError) as error:
+            sys.stderr.write(f"Lost the connection to the pygeonhole server: {error}\n")
+            return 1
+    finally:
+        conn.close()
+    sys.stdout.write(reply["stdout"])
+    sys.stderr.write(reply["stderr"])
+    return reply["code"]
+
+"""
+Tracks whether the index can have fallen behind the directory. Watchers
+count changes; a refresh remembers the count it started from, so changes
+arriving while it runs are not lost.
+"""
+class LiveIndex:
+    def __init__(self) -> None:
+        self.lock = threading.RLock()
+        self.watcher = "polling"
+        self._changes = 0
+        self._current = -1
+
+    def changed(self) -> None:
+        self._changes += 1
+
+    def refresh(self, phc, workers: Optional[int] = None):
+        generation = self._changes
+        if workers is None:
+            refresh_result = phc.refresh_db()
+        else:
+            refresh_result = phc.refresh_db(workers=workers)
+        if not refresh_result.error:
+            self._current = generation
+        return refresh_result
+
+    def needs_refresh(self, flags: Dict[str, Any]) -> bool:
+        from pygeonhole.flags import scan_settings
+
+        scan_state = flags.get("scan_state")
+        if self._current != self._changes or not scan_state:
+            return True
+        if scan_state[1:] != scan_settings(flags):
+            return True
+        # Watchers only see the top directory
+        return flags.get("depth", 0) != 0
+
+def _inotify(dir_path: str) -> Optional[int]:
+    import ctypes
+    import ctypes.util
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        inotify_init1 = libc.inotify_init1
+        inotify_add_watch = libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    fd = inotify_init1(os.O_CLOEXEC)
+    if fd < 0:
+        return None
+    if inotify_add_watch(fd, os.fsencode(dir_path), IN_MASK) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+def _event_names(buffer: bytes) -> List[str]:
+    import struct
+
+    names = []
+    offset = 0
+    while offset + 16 <= len(buffer):
+        _, _, _, length = struct.unpack_from("iIII", buffer, offset)
+        names.append(os.fsdecode(buffer[offset + 16:offset + 16 + length].rstrip(b"\0")))
+        offset += 16 + length
+    return names
+
+def _snapshot(dir_path: str, ignored: Callable[[str], bool]) -> Dict[str, List[int]]:
+    snapshot = {}
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            if not ignored(entry.name):
+                stats = entry.stat(follow_symlinks=False)
+                snapshot[entry.name] = [stats.st_ino, stats.st_size, stats.st_mtime_ns, stats.st_ctime_ns]
+    return snapshot
+
+"""
+Calls on_change whenever an entry of dir_path other than the ignored ones
+(the server's own database, flags and socket files) changes. Reads the
+inotify descriptor fd when there is one, else compares a snapshot of the
+directory every interval.
+"""
+def _watch(
+    live: LiveIndex,
+    dir_path: str,
+    ignored: Callable[[str], bool],
+    on_change: Callable[[], None],
+    fd: Optional[int],
+    interval: float,
+) -> None:
+    import select
+    import time
+
+    if fd is not None:
+        while True:
+            buffer = os.read(fd, 65536)
+            # Collect the burst of events a single change usually causes
+            while select.select([fd], [], [], DEBOUNCE)[0]:
+                buffer += os.read(fd, 65536)
+            names = _event_names(buffer)
+            if any(not name or not ignored(name) for name in names):
+                live.changed()
+                on_change()
+
+    snapshot = _snapshot(dir_path, ignored)
+    while True:
+        time.sleep(interval)
+        try:
+            current = _snapshot(dir_path, ignored)
+        except OSError:
+            continue
+        if current != snapshot:
+            snapshot = current
+            live.changed()
+            on_change()
+
+def _run_command(app, argv: List[str], color: bool) -> Dict[str, Any]:
+    import io
+    import traceback
+    from contextlib import redirect_stderr, redirect_stdout
+
+    from pygeonhole import __app_name__
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        if not argv or argv[0] not in CLIENT_COMMANDS:
+            stderr.write(f"The server only runs {', '.join(CLIENT_COMMANDS)}\n")
+            code = 2
+        else:
+            try:
+                app(args=argv, prog_name=__app_name__, color=color)
+                code = 0
+            except SystemExit as exit:
+                code = exit.code if isinstance(exit.code, int) else int(exit.code is not None)
+            except Exception:
+                traceback.print_exc()
+                code = 1
+    return {"stdout": stdout.getvalue(), "stderr": stderr.getvalue(), "code": code}
+
+"""
+Serves client requests on the socket of the current directory until
+interrupted. Requests and background refreshes take turns on live.lock;
+before each request, cached data that another process wrote since is
+dropped so direct-mode commands are never overwritten.
+"""
+def serve(
+    live: LiveIndex,
+    app,
+    controllers: Callable[[], List[Any]],
+    refresh: Callable[[], None],
+    ignored: Callable[[str], bool],
+    poll: bool = False,
+    interval: float = 1.0,
+    ready: Optional[Callable[[str], None]] = None,
+) -> None:
+    import signal
+
+    path = socket_path()
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except OSError:
+            os.unlink(path)
+        else:
+            raise FileExistsError(path)
+        finally:
+            probe.close()
+
+    def on_change() -> None:
+        with live.lock:
+            refresh()
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(os.path.basename(path))
+        server.listen()
+        with live.lock:
+            refresh()
+        fd = None if poll else _inotify(os.getcwd())
+        if fd is not None:
+            live.watcher = "inotify"
+        threading.Thread(
+            target=_watch,
+            args=(live, os.getcwd(), ignored, on_change, fd, interval),
+            daemon=True,
+        ).start()
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        if ready is not None:
+            ready(path)
+
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                try:
+                    message = json.loads(_recv_all(conn))
+                except (OSError, ValueError):
+                    continue
+                with live.lock:
+                    for phc in controllers():
+                        phc.drop_stale()
+                    reply = _run_command(app, message.get("argv", []), message.get("color", False))
+                try:
+                    conn.sendall(json.dumps(reply).encode("utf-8"))
+                except OSError:
+                    pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
@@ -1,59 +1,220 @@
-import configparser
 import json
+import os
+import stat
+from datetime import datetime
 from pathlib import Path
 from os import getcwd
-from typing import Any, Dict, List, NamedTuple
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
 
-from pygeonhole import DB_READ_ERROR, DB_WRITE_ERROR, JSON_ERROR, SUCCESS
+from pygeonhole import CONFLICT_ERROR, DB_READ_ERROR, DB_WRITE_ERROR, JSON_ERROR, SUCCESS, profiling
+from pygeonhole.config import read_config
+from pygeonhole.backends import BackendError, get_backend
+from pygeonhole.locking import FileLock, locked_read, versioned_write
+from pygeonhole.rows import Row
 
-ITEM_DATA = {
-    "Name": "item_name",
-    "Mode": "stat.filemode(stats.st_mode)",
-    "Last Modified": "str(datetime.fromtimestamp(stats.st_ctime))[:-7]",
-    "Size": "str(stats.st_size)",
-    "Ext.": "os.path.splitext(item_name)[1]"
+try:
+    import pwd
+except ImportError:
+    pwd = None
+
+ColumnExtractor = Callable[[str, os.stat_result], str]
+SortKeyExtractor = Callable[[str, os.stat_result], Any]
+
+def format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+def _owner(stats: os.stat_result) -> str:
+    if pwd is None:
+        return str(stats.st_uid)
+    try:
+        return pwd.getpwuid(stats.st_uid).pw_name
+    except KeyError:
+        return str(stats.st_uid)
+
+# The Hash and Total Size columns import their modules once they are used
+def _file_digest(item_name: str, stats: os.stat_result) -> str:
+    from pygeonhole.hashing import file_digest
+
+    return file_digest(item_name, stats)
+
+def _format_total_size(item_name: str, stats: os.stat_result) -> str:
+    from pygeonhole.dirsize import format_total_size
+
+    return format_total_size(item_name, stats)
+
+def _total_size(item_name: str, stats: os.stat_result) -> int:
+    from pygeonhole.dirsize import total_size
+
+    return total_size(item_name, stats).size
+
+# Every column the formatter knows about, keyed by column name. The columns
+# in NAME_COLUMNS are given the item's name, every other one its path
+ITEM_DATA: Dict[str, ColumnExtractor] = {
+    "Name": lambda item_name, stats: item_name,
+    "Mode": lambda item_name, stats: stat.filemode(stats.st_mode),
+    "Last Modified": lambda item_name, stats: format_time(stats.st_ctime),
+    "Size": lambda item_name, stats: str(stats.st_size),
+    "Ext.": lambda item_name, stats: os.path.splitext(item_name)[1],
+    "Modified": lambda item_name, stats: format_time(stats.st_mtime),
+    "Changed": lambda item_name, stats: format_time(stats.st_ctime),
+    "Owner": lambda item_name, stats: _owner(stats),
+    "Inode": lambda item_name, stats: str(stats.st_ino),
+    "Hash": _file_digest,
+    "Total Size": _format_total_size,
+}
+
+NAME_COLUMNS = ["Name", "Ext."]
+
+# Raw typed values stored next to a column (as "_" + name) and sorted on
+# instead of its display string
+SORT_KEYS: Dict[str, SortKeyExtractor] = {
+    "Last Modified": lambda item_name, stats: stats.st_ctime,
+    "Size": lambda item_name, stats: -1 if stat.S_ISDIR(stats.st_mode) else stats.st_size,
+    "Modified": lambda item_name, stats: stats.st_mtime,
+    "Changed": lambda item_name, stats: stats.st_ctime,
+    "Inode": lambda item_name, stats: stats.st_ino,
+    "Total Size": _total_size,
 }
 
+# Columns a new database starts with
+DEFAULT_COLUMNS = ["Name", "Mode", "Last Modified", "Size", "Ext."]
+# Columns refresh, sort and display rely on, which cannot be removed
+REQUIRED_COLUMNS = ["Name", "Mode"]
+
+def register_column(
+    name: str, extractor: ColumnExtractor, sort_key: Optional[SortKeyExtractor] = None
+) -> None:
+    ITEM_DATA[name] = extractor
+    if sort_key is not None:
+        SORT_KEYS[name] = sort_key
+
+# Keys starting with "_" hold bookkeeping data and are never displayed
+def get_columns_of(data: List[Row]) -> List[str]:
+    if not data:
+        return list(DEFAULT_COLUMNS)
+    return [key for key in data[0].keys() if not key.startswith("_")]
+
+def get_column_widths(data: List[Row], columns: List[str]) -> Dict[str, int]:
+    widths = {col: len(col) for col in columns}
+    for item in data:
+        for col in columns:
+            widths[col] = max(widths[col], len(item[col]))
+    # Room for the "/" appended to directory names
+    if "Name" in widths:
+        widths["Name"] += 1
+    return widths
+
 CWD_PATH = getcwd()
 CWD_NAME = CWD_PATH.split("/")[-1]
+# Where the database was kept before the catalogue
 DEFAULT_DB_PATH = "." + CWD_NAME + "_ph.json"
 
+BACKENDS = {"json": ".json", "sqlite": ".sqlite", "columnar": ".phc"}
+
+"""
+The database of the current directory in the catalogue. Configs written
+before the catalogue named a single database relative to the directory,
+which is still used where the directory has not been catalogued.
+"""
 def get_database_path(config_file: Path) -> Path:
-    config_parser = configparser.ConfigParser()
-    config_parser.read(config_file)
-    return Path(config_parser["General"]["database"])
+    from pygeonhole.catalogue import open_catalogue
+
+    entry = open_catalogue(config_file).lookup(CWD_PATH)
+    if entry is not None:
+        return entry.db_path
+    return Path(read_config(config_file).get("General", "database", fallback=DEFAULT_DB_PATH))
 
 def init_database(db_path: Path) -> int:
     try:
-        with db_path.open("w") as db:
-            json.dump([ITEM_DATA], db, indent=4)
-        return SUCCESS
+        backend = get_backend(db_path)
+        versioned_write(db_path, None, lambda: backend.write([dict.fromkeys(DEFAULT_COLUMNS, "")]))
         return SUCCESS
-    except OSError:
+    except (OSError, BackendError):
         return DB_WRITE_ERROR
     
 class DatabaseData(NamedTuple):
-    data: List[Dict[str, any]]
+    data: List[Row]
     error: int
 
+"""
+Reads take the shared lock of the database and writes the exclusive one, so
+concurrent commands serialize. The handler remembers the version it last
+read or wrote and a write fails with CONFLICT_ERROR when another process
+wrote the database in between, leaving it to the caller to merge and retry.
+"""
 class DatabaseHandler:
     def __init__(self, db_path: Path) -> None:
         self._db_path = db_path
+        self._backend = get_backend(db_path)
+        self._version: Optional[int] = None
     
     def read_db_data(self) -> DatabaseData:
         try: 
-            with self._db_path.open("r") as db:
-                try:
-                    return DatabaseData(json.load(db), SUCCESS)
-                except json.JSONDecodeError:
-                    return DatabaseData([], JSON_ERROR)
-        except OSError:
+            with profiling.phase("db_read"):
+                data, self._version = locked_read(self._db_path, self._backend.read)
+            profiling.count_size("db_bytes_read", self._db_path)
+            return DatabaseData(data, SUCCESS)
+        except json.JSONDecodeError:
+            return DatabaseData([], JSON_ERROR)
+        except (OSError, BackendError):
             return DatabaseData([], DB_READ_ERROR)
-        
-    def write_db_data(self, data: List[Dict[str, Any]]) -> DatabaseData:
+
+    # Whether the database is still as this handler last read or wrote it
+    def is_current(self) -> bool:
         try:
-            with self._db_path.open("w") as db:
-                json.dump(data, db, indent=4)
-            return DatabaseData(data, SUCCESS)
+            with FileLock(self._db_path) as lock:
+                return lock.version == self._version
         except OSError:
-            return DatabaseData(data, DB_WRITE_ERROR)
\ No newline at end of file
+            return False
+
+    def _write(self, data: List[Row], write: Callable[[], None]) -> DatabaseData:
+        try:
+            with profiling.phase("db_write"):
+                version = versioned_write(self._db_path, self._version, write)
+        except (OSError, BackendError):
+            return DatabaseData(data, DB_WRITE_ERROR)
+        profiling.count_size("db_bytes_written", self._db_path)
+        if version is None:
+            return DatabaseData(data, CONFLICT_ERROR)
+        self._version = version
+        return DatabaseData(data, SUCCESS)
+        
+    def write_db_data(self, data: List[Row]) -> DatabaseData:
+        return self._write(data, lambda: self._backend.write(data))
+
+    """
+    Stores data after a refresh, where only the changed items were
+    re-formatted and the removed names dropped. The SQLite backend upserts
+    just those rows, the JSON backend rewrites the file.
+    """
+    def update_db_data(
+        self, data: List[Row], changed: List[Row], removed: List[str]
+    ) -> DatabaseData:
+        return self._write(data, lambda: self._backend.update(data, changed, removed))
+
+    def sort_db_data(
+        self,
+        data: List[Row],
+        sorting_key: str,
+        reverse_order: bool,
+        dirs_first: bool,
+        use_index: bool = True,
+    ) -> DatabaseData:
+        try:
+            with profiling.phase("sort"):
+                return DatabaseData(
+                    self._backend.sort(data, sorting_key, reverse_order, dirs_first, use_index), SUCCESS
+                )
+        except (OSError, BackendError):
+            return DatabaseData(data, DB_READ_ERROR)
+
+    """
+    Stores data after sort_db_data reordered it without changing any item,
+    which lets the backend keep (and extend) its stored sort orders.
+    """
+    def reorder_db_data(
+        self, data: List[Row], sorting_key: str, reverse_order: bool, dirs_first: bool
+    ) -> DatabaseData:
+        return self._write(
+            data, lambda: self._backend.reorder(data, sorting_key, reverse_order, dirs_first)
+        )
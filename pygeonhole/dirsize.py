@@ -0,0 +1,177 @@
+import os
+import stat
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from pygeonhole import SIZE_ERROR, profiling
+from pygeonhole.statcache import StatCache
+
+"""
+Recursive sizes of directories for the Total Size column: the sum of the
+sizes of every file below a directory. Each directory is scanned once into
+a record of the bytes of its own files, its number of entries and the names
+of its subdirectories, cached by its device, inode, size and mtime, and the
+totals are added up from the records. A directory's mtime changes whenever
+an entry is added, removed or renamed in it, so on the next walk only those
+directories are scanned again and every other one costs a single lstat.
+A file rewritten in place does not touch its directory, its new size shows
+once the directory itself changes.
+
+Walks stop once they run out of their time or entry budget, and totals of
+directories that were not walked to the end are marked as partial. Records
+of the directories that were scanned are kept, so the next walk goes on
+from where the budget ran out.
+"""
+
+SIZE_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+# Default budget of one walk: seconds, and entries scanned (0 for no limit)
+DEFAULT_SECONDS = 2.0
+DEFAULT_ENTRIES = 0
+
+# Records of directories, [file bytes, entries, subdirectory names]
+CACHE = StatCache(SIZE_ERROR)
+
+def size_cache_path(db_path: Path) -> Path:
+    return db_path.with_name(db_path.stem + "_sizes.json")
+
+class Budget:
+    def __init__(self, seconds: float = DEFAULT_SECONDS, entries: int = DEFAULT_ENTRIES) -> None:
+        self._lock = threading.Lock()
+        self._deadline = time.monotonic() + seconds if seconds > 0 else None
+        self._entries = entries if entries > 0 else None
+
+    def spend(self, entries: int) -> None:
+        if self._entries is not None:
+            with self._lock:
+                self._entries -= entries
+
+    def exhausted(self) -> bool:
+        if self._entries is not None and self._entries <= 0:
+            return True
+        return self._deadline is not None and time.monotonic() >= self._deadline
+
+class DirSize(NamedTuple):
+    size: int
+    complete: bool
+
+# None for a directory that was not scanned, for lack of budget or access
+def _visit(path: str, cache: StatCache, budget: Budget) -> Optional[List]:
+    try:
+        stats = os.lstat(path)
+    except OSError:
+        return None
+    # Symlinks to directories are not followed
+    if not stat.S_ISDIR(stats.st_mode):
+        return [0, 0, []]
+    record = cache.get(stats)
+    if record is not None:
+        return record
+    if budget.exhausted():
+        return None
+
+    files = 0
+    entries = 0
+    subdirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                entries += 1
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                else:
+                    try:
+                        files += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        pass
+    except OSError:
+        return None
+    budget.spend(entries)
+    profiling.count("size_scandir")
+    profiling.count("size_entries", entries)
+    record = [files, entries, subdirs]
+    cache.put(stats, record)
+    return record
+
+# Stops at the root, whose dirname is itself, so absolute paths end too
+def _parents(path: str) -> Iterator[str]:
+    while os.sep in path:
+        parent = os.path.dirname(path)
+        if parent == path:
+            return
+        path = parent
+        yield path
+
+"""
+Total sizes of the directories at paths and of every directory below them,
+keyed by path. The tree is walked level by level, each level by a thread
+pool since scandir and stat release the GIL, and totals are added up from
+the deepest directories to the top.
+"""
+def dir_sizes(
+    paths: List[str],
+    workers: int = SIZE_WORKERS,
+    cache: StatCache = CACHE,
+    budget: Optional[Budget] = None,
+) -> Dict[str, DirSize]:
+    from concurrent.futures import ThreadPoolExecutor
+
+    budget = budget or Budget()
+    roots = set(paths)
+    # Directories below another path are reached from it
+    level = [path for path in dict.fromkeys(paths) if not any(parent in roots for parent in _parents(path))]
+    records: Dict[str, Optional[List]] = {}
+    order: List[str] = []
+
+    with profiling.phase("size"), ThreadPoolExecutor(max_workers=workers) as pool:
+        while level:
+            next_level = []
+            for path, record in zip(level, pool.map(lambda path: _visit(path, cache, budget), level)):
+                records[path] = record
+                order.append(path)
+                if record is not None:
+                    next_level.extend(os.path.join(path, name) for name in record[2])
+            level = next_level
+
+    totals: Dict[str, DirSize] = {}
+    for path in reversed(order):
+        record = records[path]
+        if record is None:
+            totals[path] = DirSize(0, False)
+            continue
+        size, complete = record[0], True
+        for name in record[2]:
+            child = totals[os.path.join(path, name)]
+            size += child.size
+            complete = complete and child.complete
+        totals[path] = DirSize(size, complete)
+    return totals
+
+# Totals and budget of the current listing, set by prefetch
+_totals: Dict[str, DirSize] = {}
+_budget: Optional[Budget] = None
+
+# Walks the directories of a listing at once, sharing one budget
+def prefetch(
+    items: List[Tuple[str, os.stat_result]], workers: int = SIZE_WORKERS, budget: Optional[Budget] = None
+) -> None:
+    global _budget
+    _totals.clear()
+    _budget = budget or Budget()
+    paths = [path for path, stats in items if stat.S_ISDIR(stats.st_mode)]
+    if paths:
+        _totals.update(dir_sizes(paths, workers, budget=_budget))
+
+# Directories that were not prefetched are walked within the listing's budget
+def total_size(path: str, stats: os.stat_result) -> DirSize:
+    if not stat.S_ISDIR(stats.st_mode):
+        return DirSize(stats.st_size, True)
+    if path not in _totals:
+        _totals.update(dir_sizes([path], budget=_budget))
+    return _totals[path]
+
+# The total in bytes, followed by "+" where the walk ran out of budget
+def format_total_size(path: str, stats: os.stat_result) -> str:
+    size = total_size(path, stats)
+    return str(size.size) if size.complete else f"{size.size}+"
@@ -0,0 +1,178 @@
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Iterator, List, NamedTuple, Optional, Tuple
+
+from pygeonhole import EXPORT_ERROR, PATH_ERROR, SUCCESS
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+EXPORT_MODES = ["copy", "hardlink", "reflink"]
+MANIFEST_NAME = ".ph_export_manifest"
+
+# ioctl request number of FICLONE on Linux
+FICLONE = 0x40049409
+CHUNK_SIZE = 64 * 2**20
+
+class ExportData(NamedTuple):
+    files: int
+    size: int
+    seconds: float
+    error: int
+
+class _Progress:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.size = 0
+
+    def add(self, size: int) -> None:
+        with self._lock:
+            self.size += size
+
+def _copy_range(src_fd: int, dst_fd: int, progress: _Progress) -> bool:
+    copy_file_range = getattr(os, "copy_file_range", None)
+    for copy in (copy_file_range, getattr(os, "sendfile", None)):
+        if copy is None:
+            continue
+        try:
+            while True:
+                if copy is copy_file_range:
+                    copied = copy(src_fd, dst_fd, CHUNK_SIZE)
+                else:
+                    copied = copy(dst_fd, src_fd, None, CHUNK_SIZE)
+                if not copied:
+                    return True
+                progress.add(copied)
+        except OSError:
+            # Only fall through when nothing was written yet
+            if os.lseek(dst_fd, 0, os.SEEK_CUR):
+                raise
+    return False
+
+def _copy_file(src: Path, dst: Path, mode: str, progress: _Progress) -> None:
+    if mode == "hardlink":
+        if os.path.lexists(dst):
+            os.unlink(dst)
+        os.link(src, dst)
+        progress.add(src.stat().st_size)
+        return
+
+    with src.open("rb") as fsrc, dst.open("wb") as fdst:
+        if mode == "reflink" and fcntl is not None:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                progress.add(os.fstat(fsrc.fileno()).st_size)
+                shutil.copystat(src, dst)
+                return
+            except OSError:
+                pass
+        if not _copy_range(fsrc.fileno(), fdst.fileno(), progress):
+            while True:
+                chunk = fsrc.read(2**20)
+                if not chunk:
+                    break
+                fdst.write(chunk)
+                progress.add(len(chunk))
+    shutil.copystat(src, dst)
+
+"""
+Expands the exported names into (source, relative destination) pairs,
+walking directories recursively when copy_dirs is set. Destination
+directories and symlinks are created here, on the calling thread, so
+workers only ever copy files. Names may be paths relative to the current
+directory.
+"""
+def _plan(names: List[str], dest: Path, copy_dirs: bool) -> Iterator[Tuple[Path, str]]:
+    for name in names:
+        src = Path(name)
+        (dest / name).parent.mkdir(parents=True, exist_ok=True)
+        if src.is_symlink():
+            link = dest / name
+            if not os.path.lexists(link):
+                os.symlink(os.readlink(src), link)
+        elif src.is_dir():
+            (dest / name).mkdir(exist_ok=True)
+            if not copy_dirs:
+                continue
+            for dirpath, dirnames, filenames in os.walk(src):
+                rel_dir = os.path.normpath(os.path.join(name, os.path.relpath(dirpath, src)))
+                for dirname in dirnames:
+                    path = Path(dirpath) / dirname
+                    if path.is_symlink():
+                        link = dest / rel_dir / dirname
+                        if not os.path.lexists(link):
+                            os.symlink(os.readlink(path), link)
+                    else:
+                        (dest / rel_dir / dirname).mkdir(exist_ok=True)
+                for filename in filenames:
+                    path = Path(dirpath) / filename
+                    if path.is_symlink():
+                        link = dest / rel_dir / filename
+                        if not os.path.lexists(link):
+                            os.symlink(os.readlink(path), link)
+                    else:
+                        yield path, os.path.join(rel_dir, filename)
+        else:
+            yield src, name
+
+"""
+Copies the items into dest with a pool of workers. Every finished file is
+appended to a manifest in dest; resuming an export skips the files listed
+there, and the manifest is removed once the export completes. progress is
+called on the calling thread with the number of bytes copied so far.
+"""
+def export_items(
+    names: List[str],
+    dest: Path,
+    workers: int = 4,
+    mode: str = "copy",
+    resume: bool = False,
+    progress: Optional[Callable[[int], None]] = None,
+    copy_dirs: bool = True,
+) -> ExportData:
+    start = time.perf_counter()
+    manifest_path = dest / MANIFEST_NAME
+    done = set()
+    try:
+        if resume and manifest_path.exists():
+            with manifest_path.open("r") as manifest:
+                done = set(manifest.read().splitlines())
+        dest.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return ExportData(0, 0, 0.0, PATH_ERROR)
+
+    counter = _Progress()
+    files = 0
+    try:
+        with manifest_path.open("a") as manifest, ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = {}
+            plan = _plan(names, dest, copy_dirs)
+            while True:
+                for src, rel in plan:
+                    if rel in done:
+                        continue
+                    pending[pool.submit(_copy_file, src, dest / rel, mode, counter)] = rel
+                    if len(pending) >= workers * 4:
+                        break
+                if not pending:
+                    break
+                finished, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    rel = pending.pop(future)
+                    future.result()
+                    manifest.write(rel + "\n")
+                    files += 1
+                manifest.flush()
+                if progress is not None:
+                    progress(counter.size)
+        manifest_path.unlink()
+    except OSError:
+        return ExportData(files, counter.size, time.perf_counter() - start, EXPORT_ERROR)
+
+    return ExportData(files, counter.size, time.perf_counter() - start, SUCCESS)
@@ -1,10 +1,13 @@
-import configparser
 import json
 from pathlib import Path
-from typing import Any, Dict, List, NamedTuple
+from typing import Any, Dict, List, NamedTuple, Optional
 
-from pygeonhole import FLAGS_READ_ERROR, FLAGS_WRITE_ERROR, JSON_ERROR, SUCCESS
-from pygeonhole.database import CWD_NAME
+from pygeonhole import (
+    CONFLICT_ERROR, FLAGS_READ_ERROR, FLAGS_WRITE_ERROR, JSON_ERROR, SUCCESS, profiling
+)
+from pygeonhole.config import read_config
+from pygeonhole.database import CWD_NAME, CWD_PATH
+from pygeonhole.locking import FileLock, atomic_write, locked_read, versioned_write
 
 FLAGS = {
     "show_hidden": False,
@@ -12,19 +15,42 @@ FLAGS = {
     "repeat_show": True,
     "maxlen": {},
     "no_show": [],
+    "where": "",
+    "depth": 0,
+    "scan_state": None,
+    # Columns of the table, set by format; None takes those of the stored rows
+    "columns": None,
+    # "size_seconds" and "size_entries", the budget of the Total Size walk, are
+    # only set by format; until then the controller takes those of dirsize
 }
 
+# Where the flags were kept before the catalogue
 DEFAULT_FLAGS_PATH = "." + CWD_NAME + "_ph_flags.json"
 
+# The flags that decide which entries a scan lists, as stored in "scan_state"
+def scan_settings(flags: Dict[str, Any]) -> List[Any]:
+    return [
+        flags["show_hidden"],
+        flags["show_dirs"],
+        flags.get("depth", 0),
+        flags.get("where", ""),
+        flags.get("no_show", []),
+    ]
+
+# See database.get_database_path
 def get_flags_path(config_file: Path) -> Path:
-    config_parser = configparser.ConfigParser()
-    config_parser.read(config_file)
-    return Path(config_parser["General"]["flags"])
+    from pygeonhole.catalogue import open_catalogue
+
+    entry = open_catalogue(config_file).lookup(CWD_PATH)
+    if entry is not None:
+        return entry.flags_path
+    return Path(read_config(config_file).get("General", "flags", fallback=DEFAULT_FLAGS_PATH))
 
 def init_flags(flags_path: Path) -> int:
     try:
-        with flags_path.open("w") as flags:
-            json.dump(FLAGS, flags, indent=4)
+        versioned_write(
+            flags_path, None, lambda: atomic_write(flags_path, lambda flags: json.dump(FLAGS, flags, indent=4))
+        )
         return SUCCESS
     except OSError:
         return FLAGS_WRITE_ERROR
@@ -33,24 +59,46 @@ class FlagsData(NamedTuple):
     flags: Dict[str, Any]
     error: int
 
+# Locked and versioned like the database, see DatabaseHandler
 class FlagsHandler:
     def __init__(self, flags_path: Path) -> None:
         self._flags_path = flags_path
+        self._version: Optional[int] = None
+
+    def _load(self) -> Dict[str, Any]:
+        with self._flags_path.open("r") as flags:
+            return json.load(flags)
     
     def read_flags_data(self) -> FlagsData:
         try: 
-            with self._flags_path.open("r") as flags:
-                try:
-                    return FlagsData(json.load(flags), SUCCESS)
-                except json.JSONDecodeError:
-                    return FlagsData([], JSON_ERROR)
+            with profiling.phase("flags_read"):
+                data, self._version = locked_read(self._flags_path, self._load)
+            profiling.count_size("flags_bytes_read", self._flags_path)
+            return FlagsData(data, SUCCESS)
+        except json.JSONDecodeError:
+            return FlagsData([], JSON_ERROR)
         except OSError:
             return FlagsData([], FLAGS_READ_ERROR)
+
+    def is_current(self) -> bool:
+        try:
+            with FileLock(self._flags_path) as lock:
+                return lock.version == self._version
+        except OSError:
+            return False
         
     def write_flags_data(self, data: Dict[str, Any]) -> FlagsData:
         try:
-            with self._flags_path.open("w") as flags:
-                json.dump(data, flags, indent=4)
-            return FlagsData(data, SUCCESS)
+            with profiling.phase("flags_write"):
+                version = versioned_write(
+                    self._flags_path,
+                    self._version,
+                    lambda: atomic_write(self._flags_path, lambda flags: json.dump(data, flags, indent=4)),
+                )
         except OSError:
-            return FlagsData(data, FLAGS_WRITE_ERROR)
\ No newline at end of file
+            return FlagsData(data, FLAGS_WRITE_ERROR)
+        profiling.count_size("flags_bytes_written", self._flags_path)
+        if version is None:
+            return FlagsData(data, CONFLICT_ERROR)
+        self._version = version
+        return FlagsData(data, SUCCESS)
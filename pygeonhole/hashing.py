@@ -0,0 +1,154 @@
+import os
+import stat
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from pygeonhole import HASH_ERROR, SUCCESS, profiling
+from pygeonhole.statcache import StatCache
+
+"""
+Content digests for the Hash column and the dupes command. Digests are
+cached by device, inode, size and mtime, so a file is only read again once
+it changed, and the cache is kept next to the database between commands.
+"""
+
+HASH_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+# Bytes read for the partial digest that splits files of the same size
+HEAD_SIZE = 64 * 2**10
+READ_SIZE = 2**20
+
+# Digests of whole files, as hex strings
+class HashCache(StatCache):
+    def __init__(self) -> None:
+        super().__init__(HASH_ERROR)
+
+# Shared by every controller of the process, keys do not depend on the path
+CACHE = HashCache()
+
+def hash_cache_path(db_path: Path) -> Path:
+    return db_path.with_name(db_path.stem + "_hashes.json")
+
+def _read_digest(path: str, limit: Optional[int] = None) -> str:
+    import hashlib
+
+    digest = hashlib.blake2b(digest_size=16)
+    remaining = limit
+    with open(path, "rb") as file:
+        while remaining is None or remaining > 0:
+            chunk = file.read(READ_SIZE if remaining is None else min(READ_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            profiling.count("hash_bytes_read", len(chunk))
+            if remaining is not None:
+                remaining -= len(chunk)
+    return digest.hexdigest()
+
+"""
+Digest of a whole regular file, from the cache when its stat signature is
+known. Anything but a regular file, or a file that cannot be read, has
+none, shown as "--" and "" in the Hash column.
+"""
+def file_digest(path: str, stats: os.stat_result, cache: HashCache = CACHE) -> str:
+    if not stat.S_ISREG(stats.st_mode):
+        return "--"
+    digest = cache.get(stats)
+    if digest is None:
+        try:
+            digest = _read_digest(path)
+        except OSError:
+            return ""
+        profiling.count("files_hashed")
+        cache.put(stats, digest)
+    return digest
+
+# Fills the cache for many files at once, hashing the missing ones in parallel
+def prefetch(
+    items: List[Tuple[str, os.stat_result]], workers: int = HASH_WORKERS, cache: HashCache = CACHE
+) -> None:
+    missing = [
+        (path, stats) for path, stats in items if stat.S_ISREG(stats.st_mode) and cache.get(stats) is None
+    ]
+    if len(missing) < 2:
+        return
+    from concurrent.futures import ThreadPoolExecutor
+
+    with profiling.phase("hash"), ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda item: file_digest(*item, cache), missing))
+
+def _head_digest(item: Tuple[str, str, os.stat_result]) -> str:
+    try:
+        return _read_digest(item[1], HEAD_SIZE)
+    except OSError:
+        return ""
+
+class DuplicateGroup(NamedTuple):
+    digest: str
+    size: int
+    names: List[str]
+
+class DuplicatesData(NamedTuple):
+    groups: List[DuplicateGroup]
+    hashed: int
+    error: int
+
+def _split(groups: List[List], keys: List[str]) -> List[Tuple[str, List]]:
+    split = []
+    position = 0
+    for group in groups:
+        by_key: Dict[str, List] = {}
+        for item in group:
+            key = keys[position]
+            position += 1
+            # Files that could not be read have no key
+            if key:
+                by_key.setdefault(key, []).append(item)
+        split.extend((key, members) for key, members in by_key.items() if len(members) > 1)
+    return split
+
+"""
+Groups files with identical contents. items are (name, path, stats) and
+only regular, non-empty files are compared. Files are grouped by size
+first, groups of files larger than HEAD_SIZE that are not all cached are
+split by a digest of their first HEAD_SIZE bytes, and only the files left
+sharing a group are hashed in full. hashed counts the full digests that
+had to be read from disk rather than the cache.
+"""
+def find_duplicates(
+    items: List[Tuple[str, str, os.stat_result]], workers: int = HASH_WORKERS, cache: HashCache = CACHE
+) -> DuplicatesData:
+    from concurrent.futures import ThreadPoolExecutor
+
+    by_size: Dict[int, List[Tuple[str, str, os.stat_result]]] = {}
+    for item in items:
+        stats = item[2]
+        if stat.S_ISREG(stats.st_mode) and stats.st_size > 0:
+            by_size.setdefault(stats.st_size, []).append(item)
+
+    candidates = []
+    partial = []
+    for group in by_size.values():
+        if len(group) < 2:
+            continue
+        if group[0][2].st_size > HEAD_SIZE and any(cache.get(item[2]) is None for item in group):
+            partial.append(group)
+        else:
+            candidates.append(group)
+
+    with profiling.phase("hash"), ThreadPoolExecutor(max_workers=workers) as pool:
+        heads = list(pool.map(_head_digest, [item for group in partial for item in group]))
+        candidates.extend(members for _, members in _split(partial, heads))
+
+        hashed = sum(cache.get(item[2]) is None for group in candidates for item in group)
+        digests = list(pool.map(
+            lambda item: file_digest(item[1], item[2], cache),
+            [item for group in candidates for item in group],
+        ))
+
+    groups = [
+        DuplicateGroup(digest, members[0][2].st_size, [item[0] for item in members])
+        for digest, members in _split(candidates, digests)
+    ]
+    # Most wasted space first
+    groups.sort(key=lambda group: group.size * (len(group.names) - 1), reverse=True)
+    return DuplicatesData(groups, hashed, SUCCESS)
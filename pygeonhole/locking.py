@@ -0,0 +1,112 @@
+import os
+from pathlib import Path
+from typing import IO, Any, Callable, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Read once at import time, os.umask can only be read by setting it
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+"""
+Replaces path with whatever write() puts into a temporary file next to it.
+The temporary file is fsync'ed before it is renamed over path, so readers
+and crashes only ever see the old or the new contents, never a truncated
+file.
+"""
+def atomic_write(path: Path, write: Callable[[IO], None], binary: bool = False) -> None:
+    import tempfile
+
+    try:
+        mode = path.stat().st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+    fd, tmp_path = tempfile.mkstemp(prefix=path.name + ".", suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb" if binary else "w") as tmp_file:
+            write(tmp_file)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_dir(path.parent)
+
+def _fsync_dir(dir_path: Path) -> None:
+    try:
+        dir_fd = os.open(dir_path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+"""
+Advisory lock on a "<file>.lock" companion of a database or flags file,
+shared for readers and exclusive for writers. The companion is locked
+rather than the file itself because writes rename a new file into place.
+It also holds a counter that every write bumps: a handler remembers the
+version it last read or wrote and can tell when another process wrote the
+file in between.
+"""
+class FileLock:
+    def __init__(self, path: Path, exclusive: bool = False) -> None:
+        self._lock_path = path.with_name(path.name + ".lock")
+        self._exclusive = exclusive
+        self._fd: Optional[int] = None
+        self.version = 0
+
+    def __enter__(self) -> "FileLock":
+        self._fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX if self._exclusive else fcntl.LOCK_SH)
+            content = os.pread(self._fd, 32, 0)
+        except OSError:
+            os.close(self._fd)
+            raise
+        self.version = int(content) if content.strip().isdigit() else 0
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        # Closing the descriptor releases the lock
+        os.close(self._fd)
+        self._fd = None
+
+    def bump(self) -> int:
+        self.version += 1
+        content = b"%d\n" % self.version
+        os.pwrite(self._fd, content, 0)
+        os.ftruncate(self._fd, len(content))
+        return self.version
+
+def locked_read(path: Path, read: Callable[[], Any]) -> Tuple[Any, int]:
+    with FileLock(path) as lock:
+        return read(), lock.version
+
+"""
+Runs write() under the exclusive lock unless the file was written since
+expected_version (None skips the check). Returns the new version, or None
+when another writer got there first.
+"""
+def versioned_write(
+    path: Path, expected_version: Optional[int], write: Callable[[], None]
+) -> Optional[int]:
+    with FileLock(path, exclusive=True) as lock:
+        if expected_version is not None and lock.version != expected_version:
+            return None
+        # Bumped first, so a write that dies halfway still reads as a change
+        version = lock.bump()
+        write()
+        return version
@@ -0,0 +1,99 @@
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+"""
+Timings and counters of one command, collected when it runs with
+--profile. Phases are named spans of wall-clock time, inclusive of the
+phases nested in them, and counters add up syscalls, bytes and rows. While
+no profile is active, phase() and count() do nothing but check for one, so
+the instrumentation can stay in place on every path.
+"""
+
+class Profile:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        # Phase name: [seconds, calls], in the order phases first ran
+        self.phases: Dict[str, List[float]] = {}
+        self.counts: Dict[str, int] = {}
+
+    def begin_phase(self, name: str) -> None:
+        with self._lock:
+            self.phases.setdefault(name, [0.0, 0])
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        with self._lock:
+            totals = self.phases[name]
+            totals[0] += seconds
+            totals[1] += 1
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "total_seconds": time.perf_counter() - self._start,
+            "phases": {
+                name: {"seconds": seconds, "calls": calls} for name, (seconds, calls) in self.phases.items()
+            },
+            "counts": dict(self.counts),
+        }
+
+    def format_table(self) -> str:
+        summary = self.summary()
+        width = max([len("total"), *map(len, self.phases), *map(len, self.counts)])
+        lines = [f"{'phase':<{width}} | {'seconds':>9} | {'calls':>7}", "-" * (width + 22)]
+        for name, totals in summary["phases"].items():
+            lines.append(f"{name:<{width}} | {totals['seconds']:>9.4f} | {totals['calls']:>7}")
+        lines.append(f"{'total':<{width}} | {summary['total_seconds']:>9.4f} |")
+        if self.counts:
+            lines += ["", f"{'counter':<{width}} | {'value':>9}", "-" * (width + 12)]
+            lines += [f"{name:<{width}} | {value:>9}" for name, value in summary["counts"].items()]
+        return "\n".join(lines)
+
+_active: Optional[Profile] = None
+
+def start() -> Profile:
+    global _active
+    _active = Profile()
+    return _active
+
+def stop() -> Optional[Profile]:
+    global _active
+    profile, _active = _active, None
+    return profile
+
+def enabled() -> bool:
+    return _active is not None
+
+def count(name: str, amount: int = 1) -> None:
+    if _active is not None:
+        _active.count(name, amount)
+
+class phase:
+    __slots__ = ("_name", "_start")
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self) -> "phase":
+        if _active is not None:
+            _active.begin_phase(self._name)
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if _active is not None and self._start and self._name in _active.phases:
+            _active.add_phase(self._name, time.perf_counter() - self._start)
+
+# Adds the size of the file at path to a counter, stat'ing it only while profiling
+def count_size(name: str, path: Path) -> None:
+    if _active is not None:
+        try:
+            _active.count(name, path.stat().st_size)
+        except OSError:
+            pass
@@ -1,83 +1,531 @@
 # Pigeonhole Model Controller
+import copy
 import os
 import stat
 from pathlib import Path
-from typing import Any, Dict, List, NamedTuple
-from datetime import datetime # import is used in format when ITEM_DATA is retrieved
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, NamedTuple, Optional, Tuple
 
-from pygeonhole import SUCCESS, DIR_READ_ERROR
-from pygeonhole.database import DatabaseHandler, DatabaseData, ITEM_DATA
-from pygeonhole.flags import FlagsHandler, FlagsData
+from pygeonhole import SUCCESS, CONFLICT_ERROR, DIR_READ_ERROR, profiling
+from pygeonhole.backends import SortKeys, sort_items_by, top_items
+from pygeonhole.database import (
+    DatabaseHandler, DatabaseData, ITEM_DATA, NAME_COLUMNS, SORT_KEYS, get_column_widths, get_columns_of
+)
+from pygeonhole.flags import FlagsHandler, FlagsData, scan_settings
+from pygeonhole.rows import Row
+from pygeonhole.scanner import SCAN_WORKERS, ScanEntry, scan_dir, scan_tree
+
+# The hash and size caches and the query parser are only imported by the commands that use them
+if TYPE_CHECKING:
+    from pygeonhole.query import QueryData
+    from pygeonhole.hashing import DuplicatesData
+    from pygeonhole.statcache import StatCache
 
 class ItemData(NamedTuple):
-    item_data: Dict[str, Any]
+    item_data: Row
+    error: int
+
+class ItemsData(NamedTuple):
+    items_data: List[Row]
+    error: int
+
+class ColumnsData(NamedTuple):
+    columns: List[str]
+    error: int
+
+class RefreshData(NamedTuple):
+    items_data: List[Row]
+    changed: bool
     error: int
 
 class DirectoryData(NamedTuple):
     dir_data: List
     error: int
 
+# How often a flush re-reads and merges after another process wrote first
+WRITE_RETRIES = 10
+
+"""
+The controller reads the database and flags files at most once and keeps
+them for the rest of the command. With deferred set, changes are only
+written by flush(), at most once per file; io_counts records every file
+read and write so callers can check how much I/O a command did. When
+another process wrote a file since it was read, the pending changes are
+replayed onto its contents and written again, instead of overwriting them.
+"""
 class PH_Controller:
-    def __init__(self, db_path: Path, flags_path: Path) -> None:
+    def __init__(self, db_path: Path, flags_path: Path, deferred: bool = False) -> None:
         self._db_handler = DatabaseHandler(db_path)
         self._flags_handler = FlagsHandler(flags_path)
+        self._deferred = deferred
+        self._db_data: Optional[List[Row]] = None
+        self._db_pending: List[Tuple[Any, ...]] = []
+        self._flags_data: Optional[Dict[str, Any]] = None
+        self._flags_read: Dict[str, Any] = {}
+        self._flags_dirty = False
+        self._db_path = db_path
+        # The hash and size caches this controller loaded, saved by flush
+        self._caches: Dict[Path, "StatCache"] = {}
+        self.io_counts = {"db_reads": 0, "db_writes": 0, "flags_reads": 0, "flags_writes": 0}
 
-    def format_item(self, item_name: str) -> ItemData:
-        try:
-            stats = os.stat(item_name)
-        except OSError:
-            return ItemData({}, DIR_READ_ERROR)
-
+    # The schema in the flags, or the keys of the stored rows where they give none
+    def get_columns(self) -> ColumnsData:
+        flags_result = self.get_flags_data()
+        if not flags_result.error and flags_result.flags.get("columns"):
+            return ColumnsData(list(flags_result.flags["columns"]), SUCCESS)
         curr_items = self.get_db_data()
         if curr_items.error:
-            return ItemData({}, curr_items.error)
+            return ColumnsData([], curr_items.error)
+        return ColumnsData(get_columns_of(curr_items.data), SUCCESS)
+
+    def format_item(
+        self,
+        item_name: str,
+        stats: Optional[os.stat_result] = None,
+        columns: Optional[List[str]] = None,
+        dir_path: str = ".",
+    ) -> ItemData:
+        item_path = os.path.join(dir_path, item_name)
+        if stats is None:
+            try:
+                stats = os.stat(item_path)
+            except OSError:
+                return ItemData({}, DIR_READ_ERROR)
+
+        if columns is None:
+            columns_result = self.get_columns()
+            if columns_result.error:
+                return ItemData({}, columns_result.error)
+            columns = columns_result.columns
+
+        self._prefetch([(item_path, stats)], columns)
+        return self._format_item(item_name, item_path, stats, columns)
+
+    """
+    Loads the caches the columns need and fills them for the items at once:
+    files missing from the hash cache are hashed in parallel and directories
+    are walked for their total size within the budget set in the flags.
+    Items are given by their path, as the directory listed need not be the
+    current one.
+    """
+    def _prefetch(self, items: List[Tuple[str, os.stat_result]], columns: List[str]) -> None:
+        if "Hash" in columns:
+            from pygeonhole import hashing
 
-        curr_item_format = curr_items.data
+            self._load_cache(hashing.CACHE, hashing.hash_cache_path(self._db_path))
+            hashing.prefetch(items)
+        if "Total Size" in columns:
+            from pygeonhole import dirsize
+
+            flags = self.get_flags_data().flags or {}
+            budget = dirsize.Budget(
+                flags.get("size_seconds", dirsize.DEFAULT_SECONDS),
+                flags.get("size_entries", dirsize.DEFAULT_ENTRIES),
+            )
+            self._load_cache(dirsize.CACHE, dirsize.size_cache_path(self._db_path))
+            dirsize.prefetch(items, budget=budget)
+
+    def _load_cache(self, cache: "StatCache", path: Path) -> None:
+        cache.load(path)
+        self._caches[path] = cache
+
+    def _format_item(
+        self, item_name: str, item_path: str, stats: os.stat_result, columns: List[str]
+    ) -> ItemData:
         curr_item_data = {}
-        for key in curr_item_format[0].keys():
-            curr_item_data[key] = eval(ITEM_DATA[key])
+        sort_keys = {}
+        for key in columns:
+            extractor = ITEM_DATA.get(key)
+            item = item_name if key in NAME_COLUMNS else item_path
+            curr_item_data[key] = extractor(item, stats) if extractor else ""
+            if key in SORT_KEYS:
+                sort_keys["_" + key] = SORT_KEYS[key](item, stats)
 
         if stat.S_ISDIR(stats.st_mode):
             if "Size" in curr_item_data:
                 curr_item_data["Size"] = "--"
             if "Ext." in curr_item_data:
                 curr_item_data["Ext."] = "--"
+        curr_item_data.update(sort_keys)
+        curr_item_data["_stat"] = _stat_signature(stats)
 
-        return ItemData(curr_item_data, SUCCESS)
+        return ItemData(Row.from_dict(curr_item_data), SUCCESS)
 
-    def get_dir_data(self, dir_path: str = ".") -> DirectoryData:
+    """
+    Formats a whole directory listing against columns looked up once, instead
+    of once per item as format_item does, and with the caches of the Hash and
+    Total Size columns filled up front for every item at once.
+    """
+    def format_items(
+        self, items: List[ScanEntry], columns: Optional[List[str]] = None, dir_path: str = "."
+    ) -> ItemsData:
+        if columns is None:
+            columns_result = self.get_columns()
+            if columns_result.error:
+                return ItemsData([], columns_result.error)
+            columns = columns_result.columns
+
+        paths = [os.path.join(dir_path, item.name) for item in items]
+        self._prefetch(
+            [(path, item.stats) for path, item in zip(paths, items) if item.stats is not None], columns
+        )
+
+        formatted_items = []
+        with profiling.phase("format"):
+            for path, item in zip(paths, items):
+                format_result = self._format_item(item.name, path, item.stats, columns)
+                if format_result.error:
+                    return ItemsData([], format_result.error)
+                formatted_items.append(format_result.item_data)
+        profiling.count("rows_formatted", len(formatted_items))
+
+        return ItemsData(formatted_items, SUCCESS)
+
+    """
+    Brings the database up to date with the directory without rebuilding it.
+    Rows whose stored inode/size/mtime/ctime signature still matches the
+    entry on disk are kept as they are, in their stored order; only added and
+    changed entries are formatted and removed ones dropped. When the directory
+    mtime and scan flags match the last refresh, the set of names cannot have
+    changed, so the stored names are re-stat'ed instead of re-scanning. Nothing
+    is written when nothing changed. The column widths of the refreshed table
+    are kept in the flags as "maxlen" for display.
+    """
+    def refresh_db(self, dir_path: str = ".", workers: int = SCAN_WORKERS) -> RefreshData:
+        with profiling.phase("refresh"):
+            return self._refresh_db(dir_path, workers)
+
+    def _refresh_db(self, dir_path: str, workers: int) -> RefreshData:
+        flags_result = self.get_flags_data()
+        if flags_result.error:
+            return RefreshData([], False, flags_result.error)
+        flags = flags_result.flags
+
+        db_result = self.get_db_data()
+        if db_result.error:
+            return RefreshData([], False, db_result.error)
+        curr_db = db_result.data
+
+        try:
+            dir_mtime = os.stat(dir_path).st_mtime_ns
+        except OSError:
+            return RefreshData([], False, DIR_READ_ERROR)
+        query_result = self.get_query()
+        if query_result.error:
+            return RefreshData([], False, query_result.error)
+        depth = flags.get("depth", 0)
+        scan_state = [dir_mtime] + scan_settings(flags)
+        stored = {item["Name"]: item for item in curr_db if "_stat" in item}
+
+        entries = None
+        # Changes below the top level do not touch its mtime, and changes to
+        # a file's size or age do not touch the mtime of its directory
+        stat_query = query_result.query is not None and query_result.query.stat_tests
+        if (
+            depth == 0
+            and not stat_query
+            and flags.get("scan_state") == scan_state
+            and len(stored) == len(curr_db)
+        ):
+            entries = self._stat_names(dir_path, stored)
+        if entries is None:
+            entries_result = self.get_dir_entries(dir_path, workers=workers)
+            if entries_result.error:
+                return RefreshData([], False, entries_result.error)
+            entries = entries_result.dir_data
+
+        # The total size of a directory follows its subtree, not its own stat
+        columns = flags.get("columns") or get_columns_of(curr_db)
+        sized = "Total Size" in columns
+        changed_entries = []
+        rechecked = set()
+        for entry in entries:
+            item = stored.get(entry.name)
+            if item is None or item["_stat"] != _stat_signature(entry.stats):
+                changed_entries.append(entry)
+            elif sized and entry.is_dir:
+                changed_entries.append(entry)
+                rechecked.add(entry.name)
+
+        format_result = self.format_items(changed_entries, columns, dir_path)
+        if format_result.error:
+            return RefreshData([], False, format_result.error)
+        changed_items = [
+            item for item in format_result.items_data
+            if item["Name"] not in rechecked or item["Total Size"] != stored[item["Name"]]["Total Size"]
+        ]
+
+        fresh_items = {item["Name"]: item for item in changed_items}
+        scanned_names = {entry.name for entry in entries}
+        new_db = []
+        removed_names = []
+        for item in curr_db:
+            name = item.get("Name")
+            if name in scanned_names and "_stat" in item:
+                new_db.append(fresh_items.pop(name, item))
+            else:
+                removed_names.append(name)
+        new_db.extend(fresh_items.values())
+
+        changed = bool(changed_items) or bool(removed_names)
+        if changed:
+            write_result = self.update_db_data(new_db, changed_items, removed_names)
+            if write_result.error:
+                return RefreshData(new_db, changed, write_result.error)
+
+        maxlen = flags.get("maxlen")
+        if changed or not maxlen:
+            maxlen = get_column_widths(new_db, columns)
+        if flags.get("scan_state") != scan_state or flags.get("maxlen") != maxlen:
+            flags["scan_state"] = scan_state
+            flags["maxlen"] = maxlen
+            write_result = self.set_flags_data(flags)
+            if write_result.error:
+                return RefreshData(new_db, changed, write_result.error)
+
+        return RefreshData(new_db, changed, SUCCESS)
+
+    def _stat_names(self, dir_path: str, stored: Dict[str, Row]) -> Optional[List[ScanEntry]]:
+        entries = []
+        with profiling.phase("stat"):
+            for name in stored:
+                try:
+                    stats = os.stat(os.path.join(dir_path, name))
+                except OSError:
+                    return None
+                entries.append(ScanEntry(name, stat.S_ISDIR(stats.st_mode), stats))
+        profiling.count("stat", len(entries))
+        return entries
+
+    def get_dir_entries(
+        self, dir_path: str = ".", with_stats: bool = True, workers: int = SCAN_WORKERS
+    ) -> DirectoryData:
         flags_result = self.get_flags_data()
         if flags_result.error:
             return DirectoryData([], flags_result.error)
         flags = flags_result.flags
+        query_result = self.get_query()
+        if query_result.error:
+            return DirectoryData([], query_result.error)
 
-        item_names = []
         try:
-            for (dirpath, dirname, filename) in os.walk(dir_path):
-                if flags["show_dirs"]:
-                    item_names.extend(dirname)
-                item_names.extend(filename)
-                break
+            depth = flags.get("depth", 0)
+            if depth == 0:
+                entries = scan_dir(
+                    dir_path, flags["show_hidden"], flags["show_dirs"], with_stats, query_result.query
+                )
+            else:
+                entries = scan_tree(
+                    dir_path,
+                    depth,
+                    flags["show_hidden"],
+                    flags["show_dirs"],
+                    with_stats,
+                    workers,
+                    query_result.query,
+                )
         except OSError:
             return DirectoryData([], DIR_READ_ERROR)
-        
-        if not flags["show_hidden"]:
-            item_names = [item for item in item_names if not item[0] == "."]
 
-        return DirectoryData(item_names, SUCCESS)
+        return DirectoryData(entries, SUCCESS)
+
+    # The "where" filter and "no_show" globs of the flags, compiled
+    def get_query(self) -> "QueryData":
+        from pygeonhole.query import QueryData, parse_query
+
+        flags_result = self.get_flags_data()
+        if flags_result.error:
+            return QueryData(None, flags_result.error)
+        return parse_query(flags_result.flags.get("where", ""), flags_result.flags.get("no_show"))
+
+    """
+    Groups the files of the listing, as the flags and filter select them,
+    that have identical contents. Digests are kept in the hash cache.
+    """
+    def find_duplicates(self, dir_path: str = ".", workers: Optional[int] = None) -> "DuplicatesData":
+        from pygeonhole import hashing
+
+        entries_result = self.get_dir_entries(dir_path)
+        if entries_result.error:
+            return hashing.DuplicatesData([], 0, entries_result.error)
+        self._load_cache(hashing.CACHE, hashing.hash_cache_path(self._db_path))
+        items = [
+            (entry.name, os.path.join(dir_path, entry.name), entry.stats)
+            for entry in entries_result.dir_data
+            if not entry.is_dir
+        ]
+        return hashing.find_duplicates(items, workers or hashing.HASH_WORKERS)
+
+    def get_dir_data(self, dir_path: str = ".") -> DirectoryData:
+        entries_result = self.get_dir_entries(dir_path, with_stats=False)
+        item_names = [entry.name for entry in entries_result.dir_data]
+        return DirectoryData(item_names, entries_result.error)
     
     def get_db_data(self) -> DatabaseData:
-        read_result = self._db_handler.read_db_data()
-        return read_result
+        if self._db_data is None:
+            read_result = self._db_handler.read_db_data()
+            self.io_counts["db_reads"] += 1
+            if read_result.error:
+                return read_result
+            self._db_data = read_result.data
+        return DatabaseData(self._db_data, SUCCESS)
+    
+    def set_db_data(self, db_data: List[Row]) -> DatabaseData:
+        self._db_data = db_data
+        self._queue_db_write(("write",))
+        return DatabaseData(db_data, self._write_through(self._flush_db))
+
+    def update_db_data(
+        self, db_data: List[Row], changed: List[Row], removed: List[str]
+    ) -> DatabaseData:
+        self._db_data = db_data
+        self._queue_db_write(("update", changed, removed))
+        return DatabaseData(db_data, self._write_through(self._flush_db))
     
-    def set_db_data(self, db_data: List[Dict[str, Any]]) -> DatabaseData:
-        write_result = self._db_handler.write_db_data(db_data)
-        return write_result
+    def sort_db_data(self, sorting_key: str, reverse_order: bool, dirs_first: bool) -> DatabaseData:
+        db_result = self.get_db_data()
+        if db_result.error:
+            return db_result
+        # Stored sort orders only describe the data as it is on disk
+        use_index = all(operation[0] == "reorder" for operation in self._db_pending)
+        sort_result = self._db_handler.sort_db_data(
+            db_result.data, sorting_key, reverse_order, dirs_first, use_index
+        )
+        if sort_result.error:
+            return sort_result
+        self._db_data = sort_result.data
+        self._queue_db_write(("reorder", sorting_key, reverse_order, dirs_first))
+        return DatabaseData(sort_result.data, self._write_through(self._flush_db))
     
+    """
+    Sorts on several columns, each in its own direction. A single column
+    goes through sort_db_data and the stored sort orders of the backend;
+    other orders are sorted in memory and stored as a plain write.
+    """
+    def sort_db_data_by(self, keys: SortKeys, dirs_first: bool) -> DatabaseData:
+        if len(keys) == 1:
+            return self.sort_db_data(keys[0][0], keys[0][1], dirs_first)
+        db_result = self.get_db_data()
+        if db_result.error:
+            return db_result
+        with profiling.phase("sort"):
+            data = sort_items_by(db_result.data, keys, dirs_first)
+        return self.set_db_data(data)
+
+    # The first count items in the order of sort_db_data_by, leaving the stored order as it is
+    def top_db_data(self, keys: SortKeys, dirs_first: bool, count: int) -> DatabaseData:
+        db_result = self.get_db_data()
+        if db_result.error:
+            return db_result
+        with profiling.phase("sort"):
+            return DatabaseData(top_items(db_result.data, keys, dirs_first, count), SUCCESS)
+
     def get_flags_data(self) -> FlagsData:
-        read_result = self._flags_handler.read_flags_data()
-        return read_result
+        if self._flags_data is None:
+            read_result = self._flags_handler.read_flags_data()
+            self.io_counts["flags_reads"] += 1
+            if read_result.error:
+                return read_result
+            self._flags_data = read_result.flags
+            self._flags_read = copy.deepcopy(read_result.flags)
+        return FlagsData(self._flags_data, SUCCESS)
     
     def set_flags_data(self, flags_data: Dict[str, Any]) -> FlagsData:
-        write_result = self._flags_handler.write_flags_data(flags_data)
-        return write_result
+        self._flags_data = flags_data
+        self._flags_dirty = True
+        return FlagsData(flags_data, self._write_through(self._flush_flags))
+
+    """
+    Writes whatever the command changed, each file at most once. A deferred
+    controller only writes here; otherwise every set_* call flushes itself.
+    """
+    def flush(self) -> int:
+        db_error = self._flush_db()
+        flags_error = self._flush_flags()
+        cache_errors = [cache.save(path) for path, cache in self._caches.items()]
+        return db_error or flags_error or next((error for error in cache_errors if error), SUCCESS)
+
+    """
+    For controllers that outlive a command: forgets cached data that another
+    process wrote since it was read, unless there are changes still to flush.
+    """
+    def drop_stale(self) -> None:
+        if not self._db_pending and not self._db_handler.is_current():
+            self._db_data = None
+        if not self._flags_dirty and not self._flags_handler.is_current():
+            self._flags_data = None
+
+    def _write_through(self, flush: Callable[[], int]) -> int:
+        return SUCCESS if self._deferred else flush()
+
+    def _queue_db_write(self, operation: Tuple[Any, ...]) -> None:
+        self._db_pending.append(operation)
+
+    def _store_db(self, operations: List[Tuple[Any, ...]]) -> int:
+        self.io_counts["db_writes"] += 1
+        # Several different changes can only be stored by rewriting everything
+        operation = operations[0] if len(operations) == 1 else ("write",)
+        if operation[0] == "update":
+            write_result = self._db_handler.update_db_data(self._db_data, *operation[1:])
+        elif operation[0] == "reorder":
+            write_result = self._db_handler.reorder_db_data(self._db_data, *operation[1:])
+        else:
+            write_result = self._db_handler.write_db_data(self._db_data)
+        return write_result.error
+
+    def _replay_db(
+        self, data: List[Row], operations: List[Tuple[Any, ...]]
+    ) -> List[Row]:
+        for operation in operations:
+            if operation[0] == "update":
+                changed = {item["Name"]: item for item in operation[1]}
+                removed = set(operation[2])
+                merged = [
+                    changed.pop(item.get("Name"), item) for item in data if item.get("Name") not in removed
+                ]
+                data = merged + list(changed.values())
+            elif operation[0] == "reorder":
+                data = self._db_handler.sort_db_data(data, *operation[1:], use_index=False).data
+            else:
+                data = list(self._db_data)
+        return data
+
+    def _flush_db(self) -> int:
+        if not self._db_pending:
+            return SUCCESS
+        operations, self._db_pending = self._db_pending, []
+        for _ in range(WRITE_RETRIES):
+            error = self._store_db(operations)
+            if error != CONFLICT_ERROR:
+                return error
+            read_result = self._db_handler.read_db_data()
+            self.io_counts["db_reads"] += 1
+            if read_result.error:
+                return read_result.error
+            self._db_data = self._replay_db(read_result.data, operations)
+        return CONFLICT_ERROR
+
+    # Only the flags this command changed are carried over onto newer ones
+    def _flush_flags(self) -> int:
+        if not self._flags_dirty:
+            return SUCCESS
+        self._flags_dirty = False
+        for _ in range(WRITE_RETRIES):
+            self.io_counts["flags_writes"] += 1
+            error = self._flags_handler.write_flags_data(self._flags_data).error
+            if error != CONFLICT_ERROR:
+                self._flags_read = copy.deepcopy(self._flags_data)
+                return error
+            read_result = self._flags_handler.read_flags_data()
+            self.io_counts["flags_reads"] += 1
+            if read_result.error:
+                return read_result.error
+            changed_from, self._flags_read = self._flags_read, copy.deepcopy(read_result.flags)
+            merged = read_result.flags
+            for key, value in self._flags_data.items():
+                if key not in changed_from or changed_from[key] != value:
+                    merged[key] = value
+            self._flags_data = merged
+        return CONFLICT_ERROR
+
+def _stat_signature(stats: os.stat_result) -> List[int]:
+    return [stats.st_ino, stats.st_size, stats.st_mtime_ns, stats.st_ctime_ns]
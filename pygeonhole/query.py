@@ -0,0 +1,174 @@
+import fnmatch
+import os
+import re
+import stat
+import time
+from datetime import datetime
+from typing import Any, Callable, List, Mapping, NamedTuple, Optional
+
+from pygeonhole import QUERY_ERROR, SUCCESS
+
+"""
+Filters for the directory scan. A query is a list of terms that must all
+match, any of them negated with a leading "!":
+
+    ext:.py,.md         extension in the set (case-insensitive, "ext:" for none)
+    name:test_*         glob on the entry name
+    re:^\\d+_           regular expression searched in the entry name
+    type:f,d,l          file, directory or symlink
+    size>10k            file size with <, <=, =, >=, > and b/k/m/g/t units
+    mtime>=2024-01-01   modification time against an ISO date or date and time
+    age<7d              time since modification, in s/m/h/d/w
+
+ext, name, re and type only look at the name and the type the directory
+listing already reports, so the scanner checks them before it stat's an
+entry; size, mtime and age are checked on the stat result.
+"""
+
+EntryTest = Callable[[os.DirEntry], bool]
+StatTest = Callable[[os.stat_result], bool]
+
+SIZE_UNITS = {"": 1, "b": 1, "k": 2**10, "m": 2**20, "g": 2**30, "t": 2**40}
+AGE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+COMPARISONS = {
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    "=": lambda a, b: a == b,
+    ">=": lambda a, b: a >= b,
+    ">": lambda a, b: a > b,
+}
+TYPES = {
+    "f": lambda entry: entry.is_file(),
+    "d": lambda entry: entry.is_dir(),
+    "l": lambda entry: entry.is_symlink(),
+}
+
+_RANGE_TERM = re.compile(r"(size|mtime|age)(<=|>=|<|>|=)(.+)")
+
+# Stands in for the DirEntry of a stored row, whose Mode tells its type
+class _RowEntry:
+    __slots__ = ("name", "_kind")
+
+    def __init__(self, name: str, mode: str) -> None:
+        self.name = name
+        self._kind = mode[:1]
+
+    def is_file(self) -> bool:
+        return self._kind == "-"
+
+    def is_dir(self) -> bool:
+        return self._kind == "d"
+
+    def is_symlink(self) -> bool:
+        return self._kind == "l"
+
+_ROW_MODES = {"d": stat.S_IFDIR, "l": stat.S_IFLNK}
+
+class Query:
+    def __init__(self, entry_tests: List[EntryTest], stat_tests: List[StatTest]) -> None:
+        self.entry_tests = entry_tests
+        self.stat_tests = stat_tests
+
+    def match_entry(self, entry: os.DirEntry) -> bool:
+        return all(test(entry) for test in self.entry_tests)
+
+    def match_stats(self, stats: os.stat_result) -> bool:
+        return all(test(stats) for test in self.stat_tests)
+
+    """
+    Matches a stored database row, using the size and mtime of its "_stat"
+    signature, so rows can be filtered without touching the files.
+    """
+    def match_row(self, row: Mapping[str, Any]) -> bool:
+        mode = row.get("Mode", "")
+        if not self.match_entry(_RowEntry(os.path.basename(row.get("Name", "")), mode)):
+            return False
+        if not self.stat_tests:
+            return True
+        signature = row.get("_stat")
+        if not signature:
+            return False
+        ino, size, mtime_ns = signature[0], signature[1], signature[2]
+        st_mode = _ROW_MODES.get(mode[:1], stat.S_IFREG)
+        stats = os.stat_result((st_mode, ino, 0, 0, 0, 0, size, 0, mtime_ns / 1e9, 0))
+        return self.match_stats(stats)
+
+class QueryData(NamedTuple):
+    query: Optional[Query]
+    error: int
+
+def _extension_test(value: str) -> EntryTest:
+    extensions = {
+        ext.lower() if not ext or ext.startswith(".") else "." + ext.lower() for ext in value.split(",")
+    }
+    return lambda entry: os.path.splitext(entry.name)[1].lower() in extensions
+
+def _range_test(field: str, operator: str, value: str, now: float) -> StatTest:
+    compare = COMPARISONS[operator]
+    if field == "size":
+        match = re.fullmatch(r"(\d+(?:\.\d+)?)([a-z]?)", value.lower())
+        if not match or match.group(2) not in SIZE_UNITS:
+            raise ValueError(value)
+        limit = float(match.group(1)) * SIZE_UNITS[match.group(2)]
+        # Directories have no size column, so they never match a size
+        return lambda stats: not stat.S_ISDIR(stats.st_mode) and compare(stats.st_size, limit)
+    if field == "mtime":
+        limit = datetime.fromisoformat(value).timestamp()
+        return lambda stats: compare(stats.st_mtime, limit)
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([smhdw])", value.lower())
+    if not match:
+        raise ValueError(value)
+    limit = float(match.group(1)) * AGE_UNITS[match.group(2)]
+    return lambda stats: compare(now - stats.st_mtime, limit)
+
+def _negate(test: Callable) -> Callable:
+    return lambda value: not test(value)
+
+def _parse_term(term: str, now: float, entry_tests: List[EntryTest], stat_tests: List[StatTest]) -> None:
+    negated = term.startswith("!")
+    if negated:
+        term = term[1:]
+
+    range_match = _RANGE_TERM.fullmatch(term)
+    if range_match:
+        test = _range_test(*range_match.groups(), now)
+        stat_tests.append(_negate(test) if negated else test)
+        return
+
+    key, separator, value = term.partition(":")
+    if not separator:
+        raise ValueError(term)
+    if key == "ext":
+        test = _extension_test(value)
+    elif key == "name":
+        test = lambda entry, match=re.compile(fnmatch.translate(value)).match: bool(match(entry.name))
+    elif key == "re":
+        test = lambda entry, search=re.compile(value).search: bool(search(entry.name))
+    elif key == "type":
+        checks = [TYPES[kind] for kind in value.split(",")]
+        test = lambda entry: any(check(entry) for check in checks)
+    else:
+        raise ValueError(term)
+    entry_tests.append(_negate(test) if negated else test)
+
+"""
+Compiles a query, plus name globs that are never shown (the "no_show"
+flag). Returns no query when there is nothing to filter on.
+"""
+def parse_query(text: str, no_show: Optional[List[str]] = None) -> QueryData:
+    entry_tests: List[EntryTest] = []
+    stat_tests: List[StatTest] = []
+    now = time.time()
+    try:
+        if text:
+            import shlex
+
+            for term in shlex.split(text):
+                _parse_term(term, now, entry_tests, stat_tests)
+        for pattern in no_show or []:
+            _parse_term("!name:" + pattern, now, entry_tests, stat_tests)
+    except (ValueError, KeyError, re.error):
+        return QueryData(None, QUERY_ERROR)
+    if not entry_tests and not stat_tests:
+        return QueryData(None, SUCCESS)
+    return QueryData(Query(entry_tests, stat_tests), SUCCESS)
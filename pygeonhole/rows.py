@@ -0,0 +1,106 @@
+import sys
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, Tuple
+
+"""
+Compact, read-only row of the database. A Row keeps only a tuple of values
+and a reference to a Schema, the column names and their positions, which
+is shared by every row with the same columns. That is a fraction of the
+memory of a dict per item, whose key table is repeated in every row.
+Repeated short values (Mode, Ext., dates...) are interned so rows share
+them too. Rows behave as read-only mappings, so item["Name"], item.get(),
+"in", iteration and comparison with dicts work as before; they are turned
+into dicts only where a storage format needs them, such as JSON.
+"""
+
+class Schema:
+    __slots__ = ("columns", "positions")
+
+    def __init__(self, columns: Tuple[str, ...]) -> None:
+        self.columns = columns
+        self.positions = {name: i for i, name in enumerate(columns)}
+
+_schemas: Dict[Tuple[str, ...], Schema] = {}
+
+def schema_of(columns: Tuple[str, ...]) -> Schema:
+    schema = _schemas.get(columns)
+    if schema is None:
+        schema = _schemas[columns] = Schema(columns)
+    return schema
+
+# Stands in for columns a row has no value for
+class _Missing:
+    __slots__ = ()
+
+    def __repr__(self) -> str:
+        return "MISSING"
+
+MISSING = _Missing()
+
+# Longer strings are nearly always unique, interning them would only cost
+INTERN_LENGTH = 32
+
+def _share(key: str, value: Any) -> Any:
+    if type(value) is str and key != "Name" and len(value) <= INTERN_LENGTH:
+        return sys.intern(value)
+    return value
+
+class Row(Mapping):
+    __slots__ = ("_schema", "_values")
+
+    def __init__(self, schema: Schema, values: Tuple[Any, ...]) -> None:
+        self._schema = schema
+        self._values = values
+
+    @classmethod
+    def from_dict(cls, item: Mapping) -> "Row":
+        if isinstance(item, Row):
+            return item
+        return cls(
+            schema_of(tuple(item)), tuple(_share(key, value) for key, value in item.items())
+        )
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._values[self._schema.positions[key]]
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        position = self._schema.positions.get(key)
+        if position is None:
+            return default
+        value = self._values[position]
+        return default if value is MISSING else value
+
+    def __contains__(self, key: object) -> bool:
+        position = self._schema.positions.get(key)
+        return position is not None and self._values[position] is not MISSING
+
+    def __iter__(self) -> Iterator[str]:
+        for name, value in zip(self._schema.columns, self._values):
+            if value is not MISSING:
+                yield name
+
+    def __len__(self) -> int:
+        return sum(value is not MISSING for value in self._values)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Row) and other._schema is self._schema:
+            return self._values == other._values
+        return super().__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"Row({self.to_dict()!r})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            name: value for name, value in zip(self._schema.columns, self._values) if value is not MISSING
+        }
+
+def json_default(value: Any) -> Any:
+    if isinstance(value, Row):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
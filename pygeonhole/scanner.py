@@ -0,0 +1,118 @@
+import os
+from typing import TYPE_CHECKING, List, NamedTuple, Optional, Tuple
+
+from pygeonhole import profiling
+
+# Only the controller parses queries, the scan just calls their matchers
+if TYPE_CHECKING:
+    from pygeonhole.query import Query
+
+SCAN_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+class ScanEntry(NamedTuple):
+    name: str
+    is_dir: bool
+    stats: Optional[os.stat_result]
+
+def _scan(
+    dir_path: str, show_hidden: bool, show_dirs: bool, with_stats: bool, query: Optional["Query"]
+) -> Tuple[List[ScanEntry], List[str]]:
+    dirs = []
+    files = []
+    subdirs = []
+    seen = 0
+    stat_calls = 0
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            seen += 1
+            if not show_hidden and entry.name[0] == ".":
+                continue
+            is_dir = entry.is_dir()
+            # Symlinked directories are listed but not descended into
+            if is_dir and not entry.is_symlink():
+                subdirs.append(entry.name)
+            if is_dir and not show_dirs:
+                continue
+            if query is not None and not query.match_entry(entry):
+                continue
+            stats = None
+            if with_stats or query is not None and query.stat_tests:
+                stats = entry.stat()
+                stat_calls += 1
+                if query is not None and not query.match_stats(stats):
+                    continue
+            if is_dir:
+                dirs.append(ScanEntry(entry.name, True, stats))
+            else:
+                files.append(ScanEntry(entry.name, False, stats))
+    dirs.extend(files)
+    if profiling.enabled():
+        profiling.count("scandir")
+        profiling.count("entries_seen", seen)
+        profiling.count("stat", stat_calls)
+    return dirs, subdirs
+
+"""
+Single pass over a directory with os.scandir. The DirEntry type bits decide
+whether an entry is a directory without a stat call, hidden entries and
+entries failing the name and type tests of the query are dropped before
+they are ever stat'ed, and the stat result cached on the DirEntry is handed
+to the formatter so nothing is looked up twice. Directories are listed
+before files to keep the order os.walk produced.
+"""
+def scan_dir(
+    dir_path: str = ".",
+    show_hidden: bool = False,
+    show_dirs: bool = False,
+    with_stats: bool = True,
+    query: Optional["Query"] = None,
+) -> List[ScanEntry]:
+    with profiling.phase("scan"):
+        return _scan(dir_path, show_hidden, show_dirs, with_stats, query)[0]
+
+# Directories the query filters out are still descended into
+def _scan_level(
+    dir_path: str,
+    rel_dir: str,
+    show_hidden: bool,
+    show_dirs: bool,
+    with_stats: bool,
+    query: Optional["Query"],
+) -> Tuple[List[ScanEntry], List[str]]:
+    entries, subdirs = _scan(os.path.join(dir_path, rel_dir), show_hidden, show_dirs, with_stats, query)
+    subdirs = [os.path.join(rel_dir, name) for name in subdirs]
+    if rel_dir:
+        entries = [entry._replace(name=os.path.join(rel_dir, entry.name)) for entry in entries]
+    return entries, subdirs
+
+"""
+Scans dir_path and its subdirectories down to depth levels below it (-1 for
+no limit), naming entries by their path relative to dir_path. Each level
+of the tree is scanned by a thread pool, since scandir and stat release the
+GIL, and entries come back level by level in scan order.
+"""
+def scan_tree(
+    dir_path: str = ".",
+    depth: int = -1,
+    show_hidden: bool = False,
+    show_dirs: bool = False,
+    with_stats: bool = True,
+    workers: int = SCAN_WORKERS,
+    query: Optional["Query"] = None,
+) -> List[ScanEntry]:
+    from concurrent.futures import ThreadPoolExecutor
+
+    with profiling.phase("scan"), ThreadPoolExecutor(max_workers=workers) as pool:
+        entries, level = _scan_level(dir_path, "", show_hidden, show_dirs, with_stats, query)
+        current_depth = 0
+        while level and (depth < 0 or current_depth < depth):
+            results = pool.map(
+                lambda rel_dir: _scan_level(dir_path, rel_dir, show_hidden, show_dirs, with_stats, query),
+                level,
+            )
+            level = []
+            for level_entries, subdirs in results:
+                entries.extend(level_entries)
+                level.extend(subdirs)
+            current_depth += 1
+    return entries
@@ -0,0 +1,173 @@
+import json
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+from pygeonhole.backends import BackendError, sort_items
+from pygeonhole.rows import Row
+
+@contextmanager
+def _backend_errors() -> Iterator[None]:
+    try:
+        yield
+    except sqlite3.Error as error:
+        raise BackendError(str(error)) from error
+
+def _quote(column: str) -> str:
+    return '"' + column.replace('"', '""') + '"'
+
+"""
+One table row per item. Column names are stored in the meta table so the
+display order survives, and list/dict values (such as "_stat") are kept as
+JSON text in columns flagged as such. "pos" holds the stored order, every
+item column is indexed and Name is unique so refreshes can upsert.
+"""
+class SQLiteBackend:
+    def __init__(self, db_path: Path) -> None:
+        self._db_path = db_path
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._db_path.exists():
+            raise FileNotFoundError(self._db_path)
+        return sqlite3.connect(str(self._db_path))
+
+    def _columns(self, conn: sqlite3.Connection) -> List[List[Any]]:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'columns'").fetchone()
+        return json.loads(row[0]) if row else []
+
+    def _select(self, conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+        columns = self._columns(conn)
+        if not columns:
+            return []
+        names = ", ".join(_quote(name) for name, _ in columns)
+        data = []
+        for values in conn.execute(f"SELECT {names} FROM items ORDER BY pos"):
+            item = {}
+            for (name, is_json), value in zip(columns, values):
+                if value is not None:
+                    item[name] = json.loads(value) if is_json else value
+            data.append(Row.from_dict(item))
+        return data
+
+    def _encode(self, columns: List[List[Any]], item: Dict[str, Any]) -> List[Any]:
+        values = []
+        for name, is_json in columns:
+            value = item.get(name)
+            values.append(json.dumps(value) if is_json and value is not None else value)
+        return values
+
+    def read(self) -> List[Dict[str, Any]]:
+        with _backend_errors():
+            conn = self._connect()
+            try:
+                return self._select(conn)
+            finally:
+                conn.close()
+
+    def _write(self, data: List[Dict[str, Any]]) -> None:
+        columns = {}
+        for item in data:
+            for key, value in item.items():
+                columns[key] = columns.get(key, False) or isinstance(value, (list, dict))
+        columns = [[name, is_json] for name, is_json in columns.items()]
+
+        conn = sqlite3.connect(str(self._db_path))
+        try:
+            with conn:
+                conn.execute("DROP TABLE IF EXISTS items")
+                conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('columns', ?)", (json.dumps(columns),)
+                )
+                column_defs = "".join(f", {_quote(name)}" for name, _ in columns)
+                conn.execute(f"CREATE TABLE items (pos INTEGER NOT NULL{column_defs})")
+                for name, is_json in columns:
+                    if name == "Name":
+                        conn.execute('CREATE UNIQUE INDEX items_Name ON items ("Name")')
+                    elif not is_json:
+                        conn.execute(f"CREATE INDEX {_quote('items_' + name)} ON items ({_quote(name)})")
+                if columns:
+                    names = ", ".join(_quote(name) for name, _ in columns)
+                    marks = ", ".join("?" * (len(columns) + 1))
+                    conn.executemany(
+                        f"INSERT INTO items (pos, {names}) VALUES ({marks})",
+                        ([pos] + self._encode(columns, item) for pos, item in enumerate(data)),
+                    )
+        finally:
+            conn.close()
+
+    def _update(
+        self, data: List[Dict[str, Any]], changed: List[Dict[str, Any]], removed: List[str]
+    ) -> None:
+        conn = self._connect()
+        try:
+            columns = self._columns(conn)
+            known = {name for name, _ in columns}
+            if "Name" in known and all(key in known for item in changed for key in item):
+                names = ", ".join(_quote(name) for name, _ in columns)
+                marks = ", ".join("?" * (len(columns) + 1))
+                updates = ", ".join(
+                    f"{_quote(name)} = excluded.{_quote(name)}" for name, _ in columns if name != "Name"
+                )
+                with conn:
+                    conn.executemany('DELETE FROM items WHERE "Name" = ?', ((name,) for name in removed))
+                    next_pos = conn.execute("SELECT COALESCE(MAX(pos) + 1, 0) FROM items").fetchone()[0]
+                    conn.executemany(
+                        f'INSERT INTO items (pos, {names}) VALUES ({marks}) '
+                        f'ON CONFLICT("Name") DO UPDATE SET {updates}',
+                        ([next_pos + i] + self._encode(columns, item) for i, item in enumerate(changed)),
+                    )
+                return
+        finally:
+            conn.close()
+        self._write(data)
+
+    def _reorder(self, sorting_key: str, reverse_order: bool, dirs_first: bool) -> None:
+        conn = self._connect()
+        try:
+            known = {name for name, _ in self._columns(conn)}
+            if "_" + sorting_key in known:
+                sorting_key = "_" + sorting_key
+            direction = "DESC" if reverse_order else "ASC"
+            order = f"{_quote(sorting_key)} {direction}, pos {direction}"
+            if dirs_first:
+                order = "(substr(\"Mode\", 1, 1) = 'd') DESC, " + order
+            with conn:
+                conn.execute(
+                    f"UPDATE items SET pos = ranked.new_pos FROM "
+                    f"(SELECT rowid AS id, ROW_NUMBER() OVER (ORDER BY {order}) AS new_pos FROM items) AS ranked "
+                    f"WHERE items.rowid = ranked.id"
+                )
+        finally:
+            conn.close()
+
+    def write(self, data: List[Dict[str, Any]]) -> None:
+        with _backend_errors():
+            self._write(data)
+
+    def update(
+        self, data: List[Dict[str, Any]], changed: List[Dict[str, Any]], removed: List[str]
+    ) -> None:
+        with _backend_errors():
+            self._update(data, changed, removed)
+
+    def sort(
+        self,
+        data: List[Dict[str, Any]],
+        sorting_key: str,
+        reverse_order: bool,
+        dirs_first: bool,
+        use_index: bool = True,
+    ) -> List[Dict[str, Any]]:
+        return sort_items(data, sorting_key, reverse_order, dirs_first)
+
+    """
+    Persists a sort by ranking the rows with ORDER BY on the indexed (typed)
+    column, which orders them exactly as sort() did in memory.
+    """
+    def reorder(
+        self, data: List[Dict[str, Any]], sorting_key: str, reverse_order: bool, dirs_first: bool
+    ) -> None:
+        with _backend_errors():
+            self._reorder(sorting_key, reverse_order, dirs_first)
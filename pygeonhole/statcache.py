@@ -0,0 +1,65 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from pygeonhole import SUCCESS
+from pygeonhole.locking import atomic_write
+
+"""
+Values derived from a file or directory, cached by its device, inode, size
+and mtime so they are only worked out again once it changed. A cache is
+kept in a JSON file next to the database between commands, and files that
+other processes saved in between are merged on save.
+"""
+
+CacheKey = str
+
+class StatCache:
+    def __init__(self, error: int) -> None:
+        self._error = error
+        self._lock = threading.Lock()
+        self._values: Dict[CacheKey, Any] = {}
+        self._loaded = set()
+        self.dirty = False
+
+    @staticmethod
+    def key(stats: os.stat_result) -> CacheKey:
+        return f"{stats.st_dev}:{stats.st_ino}:{stats.st_size}:{stats.st_mtime_ns}"
+
+    def get(self, stats: os.stat_result) -> Optional[Any]:
+        return self._values.get(self.key(stats))
+
+    def put(self, stats: os.stat_result, value: Any) -> None:
+        with self._lock:
+            self._values[self.key(stats)] = value
+            self.dirty = True
+
+    # Unreadable or malformed cache files are treated as empty
+    def load(self, path: Path) -> None:
+        if path in self._loaded:
+            return
+        self._loaded.add(path)
+        try:
+            with path.open("r") as cache_file:
+                stored = json.load(cache_file)
+        except (OSError, ValueError):
+            return
+        if isinstance(stored, dict):
+            with self._lock:
+                for key, value in stored.items():
+                    self._values.setdefault(key, value)
+
+    def save(self, path: Path) -> int:
+        if not self.dirty:
+            return SUCCESS
+        # Keep what other processes stored since it was loaded
+        self._loaded.discard(path)
+        self.load(path)
+        try:
+            atomic_write(path, lambda cache_file: json.dump(self._values, cache_file))
+        except OSError:
+            return self._error
+        self.dirty = False
+        return SUCCESS
@@ -0,0 +1,51 @@
+import time
+
+from pygeonhole import catalogue
+from pygeonhole.query import parse_query
+
+def test_register_and_lookup(tmp_path):
+    cat = catalogue.Catalogue(tmp_path / "catalogue")
+    assert cat.lookup(str(tmp_path / "a")) is None
+
+    entry = cat.register(str(tmp_path / "a"), ".sqlite")
+    assert entry.db_path.parent == tmp_path / "catalogue"
+    assert entry.db_path.suffix == ".sqlite"
+
+    # A fresh catalogue of the same directory reads the index
+    found = catalogue.Catalogue(tmp_path / "catalogue").lookup(str(tmp_path / "a"))
+    assert (found.db_path, found.flags_path) == (entry.db_path, entry.flags_path)
+
+def test_evicts_least_recently_used(tmp_path, monkeypatch):
+    cat = catalogue.Catalogue(tmp_path / "catalogue", max_directories=2)
+    clock = iter(range(1000, 2000, 100))
+    monkeypatch.setattr(time, "time", lambda: next(clock))
+
+    first = cat.register(str(tmp_path / "a"), ".json")
+    first.db_path.write_text("{}")
+    cat.register(str(tmp_path / "b"), ".json")
+    # Using a makes b the least recently used
+    fresh = catalogue.Catalogue(tmp_path / "catalogue", max_directories=2)
+    assert fresh.lookup(str(tmp_path / "a")) is not None
+    fresh.register(str(tmp_path / "c"), ".json")
+
+    assert [entry.dir_path for entry in fresh.entries()] == [str(tmp_path / "c"), str(tmp_path / "a")]
+    assert first.db_path.exists()
+
+def test_forget(tmp_path):
+    cat = catalogue.Catalogue(tmp_path / "catalogue")
+    entry = cat.register(str(tmp_path / "a"), ".json")
+    entry.db_path.write_text("{}")
+    entry.flags_path.write_text("{}")
+
+    assert cat.forget(str(tmp_path / "a"))
+    assert not entry.db_path.exists() and not entry.flags_path.exists()
+    assert cat.entries() == []
+    assert not cat.forget(str(tmp_path / "a"))
+
+def test_match_row():
+    row = {"Name": "notes.txt", "Mode": "-rw-r--r--", "_stat": [1, 2048, 10**18]}
+    folder = {"Name": "src", "Mode": "drwxr-xr-x", "_stat": [2, 4096, 10**18]}
+    assert parse_query("ext:.txt size>1k").query.match_row(row)
+    assert not parse_query("size<1k").query.match_row(row)
+    assert not parse_query("size>1k").query.match_row(folder)
+    assert parse_query("type:d").query.match_row(folder)
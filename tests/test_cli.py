@@ -3,10 +3,13 @@ import pytest
 from typer.testing import CliRunner
 
 from pygeonhole import (
+    DB_WRITE_ERROR,
     SUCCESS,
     __app_name__,
     __version__,
     cli,
+    config,
+    database,
     pygeonhole,
 )
 
@@ -24,6 +27,26 @@ def test_version():
     (["show", "-d"], SUCCESS),
     (["show", "-a", "-d"], SUCCESS),
     (["show", "-d", "-a"], SUCCESS),
+    (["show", "-n", "1", "--offset", "1", "--no-color"], SUCCESS),
+    (["show", "--where", "ext:.py,.md !name:test_*"], SUCCESS),
+    (["show", "--where", "size>"], 1),
+    (["show", "--format", "tsv", "-n", "2"], SUCCESS),
+    (["show", "--format", "xml"], 1),
+    (["filter", "type:f", "size<1m", "--hide", "*.lock"], SUCCESS),
+    (["filter", "--unhide"], SUCCESS),
+    (["format", "--add", "Hash"], SUCCESS),
+    (["format", "--add", "Colour"], 1),
+    (["format", "--remove", "Name"], 1),
+    (["format", "--remove", "Mode", "--size-seconds", "5"], 1),
+    (["show", "--no-color"], SUCCESS),
+    (["sort", "Name"], SUCCESS),
+    (["dupes"], SUCCESS),
+    (["format", "--remove", "Hash"], SUCCESS),
+    (["format", "--add", "Total Size", "--size-seconds", "1"], SUCCESS),
+    (["sort", "Total Size:desc", "--top", "3"], SUCCESS),
+    (["format", "--remove", "Total Size"], SUCCESS),
+    (["--profile", "show"], SUCCESS),
+    (["--profile-json", "sort", "Name"], SUCCESS),
     (["sort", "Name"], SUCCESS),
     (["sort", "Name", "-r"], SUCCESS),
     (["sort", "Mode"], SUCCESS),
@@ -34,7 +57,80 @@ def test_version():
     (["sort", "Size", "-r"], SUCCESS),
     (["sort", "Ext."], SUCCESS),
     (["sort", "Ext.", "-r"], SUCCESS),
+    (["sort", "Size:desc", "Name"], SUCCESS),
+    (["sort", "Size", "Name:desc", "--top", "3"], SUCCESS),
+    (["sort", "Size:up"], 1),
+    (["export", "--archive", "rar"], 1),
+    (["export", "--archive", "zip", "--resume"], 1),
+    (["export", "--archive", "zip", "--level", "99"], 2),
+    (["export", "--archive", "tar.gz", "--level", "-1"], 2),
+    (["catalogue", "list"], SUCCESS),
+    (["catalogue", "search", "ext:.py", "--sort", "Size", "-r"], SUCCESS),
+    (["catalogue", "search", "--sort", "Colour"], 1),
 ])
 def test_commands(command, expected):
     result = runner.invoke(cli.app, command) 
-    assert result.exit_code == expected
\ No newline at end of file
+    assert result.exit_code == expected
+
+
+def test_batch(tmp_path):
+    script = tmp_path / "steps.txt"
+    script.write_text("# sort twice, then list\nsort Size -r\nsort Name\n\nshow -n 2 --no-color\n")
+    result = runner.invoke(cli.app, ["batch", str(script)])
+    assert result.exit_code == SUCCESS
+    assert "show -n 2 --no-color" in result.output
+
+    result = runner.invoke(cli.app, ["batch", "-"], input="sort Colour\nsort Name\n")
+    assert result.exit_code == 1
+    assert "sort Name" not in result.output
+
+    result = runner.invoke(cli.app, ["batch", "-"], input="serve\n")
+    assert result.exit_code == 1
+
+def test_migrate_drops_previous_database():
+    old_db_path = database.get_database_path(config.CONFIG_FILE_PATH)
+    other = "sqlite" if old_db_path.suffix != ".sqlite" else "json"
+    result = runner.invoke(cli.app, ["migrate", other])
+    assert result.exit_code == SUCCESS
+    db_path = database.get_database_path(config.CONFIG_FILE_PATH)
+    assert db_path.suffix == database.BACKENDS[other]
+    assert db_path.exists() and not old_db_path.exists()
+
+    backend = {suffix: name for name, suffix in database.BACKENDS.items()}[old_db_path.suffix]
+    assert runner.invoke(cli.app, ["migrate", backend]).exit_code == SUCCESS
+    assert old_db_path.exists() and not db_path.exists()
+
+def test_migrate_keeps_database_when_saving_fails(monkeypatch):
+    old_db_path = database.get_database_path(config.CONFIG_FILE_PATH)
+    other = "sqlite" if old_db_path.suffix != ".sqlite" else "json"
+    monkeypatch.setattr(pygeonhole.PH_Controller, "flush", lambda self: DB_WRITE_ERROR)
+    result = runner.invoke(cli.app, ["migrate", other])
+    assert result.exit_code == 1
+    assert "The pigeonhole database is" not in result.output
+    assert old_db_path.exists()
+
+    monkeypatch.undo()
+    backend = {suffix: name for name, suffix in database.BACKENDS.items()}[old_db_path.suffix]
+    assert runner.invoke(cli.app, ["migrate", backend]).exit_code == SUCCESS
+    assert database.get_database_path(config.CONFIG_FILE_PATH) == old_db_path
+
+def test_show_formats():
+    result = runner.invoke(cli.app, ["show", "--format", "ndjson"])
+    assert result.exit_code == SUCCESS
+    rows = [json.loads(line) for line in result.output.splitlines()]
+    assert rows and all("Name" in row and "Size" in row for row in rows)
+
+    result = runner.invoke(cli.app, ["show", "--format", "csv", "-n", "1"])
+    assert result.exit_code == SUCCESS
+    lines = result.output.splitlines()
+    assert lines[0].startswith("Name,Mode,")
+    assert len(lines) == 2
+
+def test_profile_includes_flush():
+    result = runner.invoke(cli.app, ["--profile-json", "show", "-d", "-n", "1", "--no-color"])
+    assert result.exit_code == SUCCESS
+    # The profile is reported after the changes were written
+    profile = json.loads(result.output[result.output.rindex("\n{"):])
+    assert "db_write" in profile["phases"]
+    assert "flags_write" in profile["phases"]
+    runner.invoke(cli.app, ["show", "-d", "-n", "1"])
@@ -0,0 +1,79 @@
+import json
+import multiprocessing
+
+import pytest
+
+from pygeonhole import SUCCESS, database, flags, pygeonhole
+
+WORKERS = 4
+ROUNDS = 25
+
+def _item(name):
+    return {"Name": name, "Mode": "-rw-r--r--", "Size": "1", "Ext.": ""}
+
+def _worker(db_path, flags_path, worker, errors):
+    for i in range(ROUNDS):
+        phc = pygeonhole.PH_Controller(db_path, flags_path, deferred=True)
+        db_result = phc.get_db_data()
+        flags_result = phc.get_flags_data()
+        if db_result.error or flags_result.error:
+            errors.put((db_result.error, flags_result.error))
+            return
+        item = _item(f"w{worker}-{i}")
+        phc.update_db_data(db_result.data + [item], [item], [])
+        flags_result.flags[f"worker_{worker}"] = i
+        phc.set_flags_data(flags_result.flags)
+        flush_error = phc.flush()
+        if flush_error:
+            errors.put(flush_error)
+            return
+
+@pytest.mark.parametrize("db_name", [".ph.json", ".ph.sqlite", ".ph.phc"])
+def test_concurrent_writers_lose_nothing(tmp_path, db_name):
+    db_path = tmp_path / db_name
+    flags_path = tmp_path / ".ph_flags.json"
+    assert database.init_database(db_path) == SUCCESS
+    assert flags.init_flags(flags_path) == SUCCESS
+
+    context = multiprocessing.get_context("fork")
+    errors = context.Queue()
+    processes = [
+        context.Process(target=_worker, args=(db_path, flags_path, worker, errors))
+        for worker in range(WORKERS)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert errors.empty()
+
+    phc = pygeonhole.PH_Controller(db_path, flags_path)
+    names = {item["Name"] for item in phc.get_db_data().data}
+    assert names >= {f"w{worker}-{i}" for worker in range(WORKERS) for i in range(ROUNDS)}
+    final_flags = phc.get_flags_data().flags
+    assert all(final_flags[f"worker_{worker}"] == ROUNDS - 1 for worker in range(WORKERS))
+    assert not list(tmp_path.glob("*.tmp"))
+
+def test_conflicting_update_is_merged(tmp_path):
+    db_path = tmp_path / ".ph.json"
+    flags_path = tmp_path / ".ph_flags.json"
+    database.init_database(db_path)
+    flags.init_flags(flags_path)
+
+    first = pygeonhole.PH_Controller(db_path, flags_path, deferred=True)
+    second = pygeonhole.PH_Controller(db_path, flags_path, deferred=True)
+    for phc, name in ((first, "a"), (second, "b")):
+        data = phc.get_db_data().data
+        phc.update_db_data(data + [_item(name)], [_item(name)], [])
+        phc.get_flags_data().flags["show_" + name] = True
+        phc.set_flags_data(phc.get_flags_data().flags)
+
+    assert first.flush() == SUCCESS
+    assert second.flush() == SUCCESS
+    assert second.io_counts["db_reads"] == 2
+
+    with db_path.open() as db:
+        assert [item["Name"] for item in json.load(db)][1:] == ["a", "b"]
+    with flags_path.open() as flags_file:
+        stored_flags = json.load(flags_file)
+    assert stored_flags["show_a"] and stored_flags["show_b"]
@@ -0,0 +1,84 @@
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from pygeonhole import SUCCESS, daemon, pygeonhole
+
+# The package is not installed in CI, the subprocesses import it from the checkout
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+def _env(tmp_path):
+    return dict(os.environ, XDG_CONFIG_HOME=str(tmp_path / "config"), PYTHONPATH=str(REPO_ROOT))
+
+def _cli(tmp_path, *args, code=None):
+    env = _env(tmp_path)
+    command = [sys.executable, "-m", "pygeonhole", *args] if code is None else [sys.executable, "-c", code]
+    return subprocess.run(command, cwd=tmp_path / "dir", env=env, capture_output=True, text=True)
+
+def _wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError
+        time.sleep(0.05)
+
+class _Controller:
+    def refresh_db(self):
+        return pygeonhole.RefreshData([], False, SUCCESS)
+
+def test_needs_refresh():
+    live = daemon.LiveIndex()
+    flags = {"show_hidden": False, "show_dirs": False, "depth": 0, "where": "", "no_show": [], "scan_state": None}
+    assert live.needs_refresh(flags)
+
+    flags["scan_state"] = [1, False, False, 0, "", []]
+    live.refresh(_Controller())
+    assert not live.needs_refresh(flags)
+    flags["show_hidden"] = True
+    assert live.needs_refresh(flags)
+    flags["show_hidden"] = False
+    flags["where"] = "ext:.py"
+    assert live.needs_refresh(flags)
+    flags["where"] = ""
+    live.changed()
+    assert live.needs_refresh(flags)
+
+@pytest.mark.parametrize("watch_args", [[], ["--poll", "--interval", "0.05"]])
+def test_serve(tmp_path, watch_args):
+    (tmp_path / "dir").mkdir()
+    (tmp_path / "config").mkdir()
+    (tmp_path / "dir" / "first.txt").write_text("first")
+    assert _cli(tmp_path, "init").returncode == 0
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "pygeonhole", "serve", *watch_args],
+        cwd=tmp_path / "dir", env=_env(tmp_path), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    socket_file = tmp_path / "dir" / ".dir_ph.sock"
+    try:
+        _wait_for(socket_file.exists)
+
+        # Answered by the server, without the client importing typer
+        code = "import sys; sys.argv = ['pygeonhole-cli', 'show', '--no-color']\n"
+        code += "from pygeonhole.__main__ import main\n"
+        code += "try:\n    main()\nexcept SystemExit:\n    print('typer' in sys.modules)"
+        result = _cli(tmp_path, code=code)
+        assert "first.txt" in result.stdout
+        assert result.stdout.splitlines()[-1] == "False"
+
+        (tmp_path / "dir" / "second.txt").write_text("second")
+        _wait_for(lambda: "second.txt" in _cli(tmp_path, "sort", "Name").stdout)
+        assert _cli(tmp_path, "sort", "Missing").returncode == 1
+    finally:
+        server.terminate()
+        server.wait(10)
+    assert not socket_file.exists()
+
+    # Without a server the command runs directly
+    result = _cli(tmp_path, "show", "--no-color")
+    assert result.returncode == 0
+    assert "second.txt" in result.stdout
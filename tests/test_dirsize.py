@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+from pygeonhole import SIZE_ERROR, SUCCESS, dirsize, pygeonhole, statcache
+
+@pytest.fixture
+def mock_tree(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    (src / "a" / "b").mkdir(parents=True)
+    (src / "c").mkdir()
+    (src / "top.txt").write_bytes(b"x" * 5)
+    (src / "a" / "one.txt").write_bytes(b"x" * 10)
+    (src / "a" / "b" / "two.txt").write_bytes(b"x" * 100)
+    (src / "c" / "three.txt").write_bytes(b"x" * 1000)
+    monkeypatch.chdir(src)
+    return src
+
+def test_dir_sizes(mock_tree):
+    cache = statcache.StatCache(SIZE_ERROR)
+    totals = dirsize.dir_sizes(["a", "c", os.path.join("a", "b")], workers=2, cache=cache)
+    assert totals["a"] == dirsize.DirSize(110, True)
+    assert totals[os.path.join("a", "b")] == dirsize.DirSize(100, True)
+    assert totals["c"] == dirsize.DirSize(1000, True)
+
+    # Only the directory that changed is scanned again
+    (mock_tree / "a" / "b" / "new.txt").write_bytes(b"x" * 7)
+    budget = dirsize.Budget(0, 3)
+    totals = dirsize.dir_sizes(["a", "c"], workers=2, cache=cache, budget=budget)
+    assert totals["a"] == dirsize.DirSize(117, True)
+    assert not budget.exhausted()
+
+def test_dir_sizes_budget(mock_tree):
+    cache = statcache.StatCache(SIZE_ERROR)
+    totals = dirsize.dir_sizes(["a"], workers=1, cache=cache, budget=dirsize.Budget(0, 1))
+    assert totals["a"] == dirsize.DirSize(10, False)
+
+    # The next walk goes on from the cached records
+    totals = dirsize.dir_sizes(["a"], workers=1, cache=cache, budget=dirsize.Budget(0, 1))
+    assert totals["a"] == dirsize.DirSize(110, True)
+
+def test_total_size_keeps_listing_budget(mock_tree):
+    # The budget runs out on c, a is not walked afterwards
+    dirsize.prefetch([("c", os.lstat("c"))], workers=1, budget=dirsize.Budget(0, 1))
+    assert dirsize.total_size("c", os.lstat("c")) == dirsize.DirSize(1000, True)
+    assert dirsize.total_size("a", os.lstat("a")) == dirsize.DirSize(0, False)
+
+def test_total_size_column(mock_tree, tmp_path):
+    db_path = tmp_path / ".ph.json"
+    flags_path = tmp_path / ".ph_flags.json"
+    db_path.write_text('[{"Name": "", "Total Size": ""}]')
+    flags_path.write_text('{"show_hidden": false, "show_dirs": true, "repeat_show": false}')
+    phc = pygeonhole.PH_Controller(db_path, flags_path)
+
+    refresh_result = phc.refresh_db()
+    assert refresh_result.error == SUCCESS
+    sizes = {item["Name"]: item["Total Size"] for item in refresh_result.items_data}
+    assert sizes == {"a": "110", "c": "1000", "top.txt": "5"}
+
+    assert not phc.refresh_db().changed
+    (mock_tree / "a" / "b" / "new.txt").write_bytes(b"x" * 7)
+    refresh_result = phc.refresh_db()
+    assert refresh_result.changed
+    assert {item["Name"]: item["Total Size"] for item in refresh_result.items_data}["a"] == "117"
+
+def test_total_size_column_other_directory(mock_tree, tmp_path, monkeypatch):
+    db_path = tmp_path / ".ph.json"
+    flags_path = tmp_path / ".ph_flags.json"
+    db_path.write_text('[{"Name": "", "Total Size": ""}]')
+    flags_path.write_text('{"show_hidden": false, "show_dirs": true, "repeat_show": false}')
+    monkeypatch.chdir(tmp_path)
+    phc = pygeonhole.PH_Controller(db_path, flags_path)
+
+    refresh_result = phc.refresh_db(str(mock_tree))
+    assert refresh_result.error == SUCCESS
+    sizes = {item["Name"]: item["Total Size"] for item in refresh_result.items_data}
+    assert sizes == {"a": "110", "c": "1000", "top.txt": "5"}
+    assert phc.flush() == SUCCESS
+
+    (mock_tree / "a" / "b" / "new.txt").write_bytes(b"x" * 7)
+    phc = pygeonhole.PH_Controller(db_path, flags_path)
+    refresh_result = phc.refresh_db(str(mock_tree))
+    assert refresh_result.changed
+    assert {item["Name"]: item["Total Size"] for item in refresh_result.items_data}["a"] == "117"
@@ -0,0 +1,104 @@
+import gzip
+import io
+import os
+import socket
+import tarfile
+import zipfile
+
+import pytest
+
+from pygeonhole import SUCCESS, archive, export
+
+@pytest.fixture
+def mock_items(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    (src / "sub" / "deeper").mkdir(parents=True)
+    (src / "test.txt").write_text("Hello World")
+    (src / "sub" / "inner.txt").write_text("inner")
+    (src / "sub" / "deeper" / "deep.txt").write_text("deep")
+    monkeypatch.chdir(src)
+    return tmp_path
+
+@pytest.mark.parametrize("mode", export.EXPORT_MODES)
+def test_export_items(mock_items, mode):
+    dest = mock_items / "out"
+    export_result = export.export_items(["test.txt", "sub"], dest, workers=2, mode=mode)
+    assert export_result.error == SUCCESS
+    assert export_result.files == 3
+    assert export_result.size == 20
+    assert (dest / "test.txt").read_text() == "Hello World"
+    assert (dest / "sub" / "deeper" / "deep.txt").read_text() == "deep"
+    assert not (dest / export.MANIFEST_NAME).exists()
+
+def test_export_resume(mock_items):
+    dest = mock_items / "out"
+    dest.mkdir()
+    (dest / export.MANIFEST_NAME).write_text("test.txt\n")
+    progress = []
+    export_result = export.export_items(
+        ["test.txt", "sub"], dest, resume=True, progress=progress.append
+    )
+    assert export_result.error == SUCCESS
+    assert export_result.files == 2
+    assert not (dest / "test.txt").exists()
+    assert progress[-1] == 9
+
+@pytest.mark.parametrize("archive_format", list(archive.ARCHIVE_FORMATS))
+def test_export_archive(mock_items, monkeypatch, archive_format):
+    if archive_format == "tar.zst":
+        zstandard = pytest.importorskip("zstandard")
+    # Small chunks, so files span several of them
+    monkeypatch.setattr(archive, "CHUNK_SIZE", 64)
+    big = bytes(range(256)) * 40 + b"tail"
+    (mock_items / "src" / "big.bin").write_bytes(big)
+    dest = mock_items / f"out.{archive_format}"
+
+    export_result = archive.export_archive(["test.txt", "sub", "big.bin"], dest, archive_format, workers=2)
+    assert export_result.error == SUCCESS
+    assert export_result.files == 4
+    assert export_result.size == 20 + len(big)
+
+    if archive_format == "zip":
+        with zipfile.ZipFile(dest) as zip_file:
+            assert zip_file.testzip() is None
+            contents = {name: zip_file.read(name) for name in zip_file.namelist()}
+    else:
+        if archive_format == "tar.zst":
+            with dest.open("rb") as file:
+                data = zstandard.ZstdDecompressor().stream_reader(file, read_across_frames=True).read()
+        else:
+            data = gzip.decompress(dest.read_bytes())
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            contents = {
+                member.name + ("/" if member.isdir() else ""):
+                tar.extractfile(member).read() if member.isfile() else b""
+                for member in tar.getmembers()
+            }
+    assert contents == {
+        "test.txt": b"Hello World",
+        "sub/": b"",
+        "sub/deeper/": b"",
+        "sub/inner.txt": b"inner",
+        "sub/deeper/deep.txt": b"deep",
+        "big.bin": big,
+    }
+
+@pytest.mark.parametrize("archive_format", ["tar.gz", "zip"])
+def test_export_archive_skips_special_files(mock_items, archive_format):
+    os.mkfifo(mock_items / "src" / "sub" / "fifo")
+    server = socket.socket(socket.AF_UNIX)
+    server.bind("sub/listening.sock")
+    try:
+        dest = mock_items / f"out.{archive_format}"
+        export_result = archive.export_archive(["sub", "sub/listening.sock"], dest, archive_format)
+    finally:
+        server.close()
+    assert export_result.error == SUCCESS
+    assert export_result.files == 2
+    if archive_format == "zip":
+        with zipfile.ZipFile(dest) as zip_file:
+            names = zip_file.namelist()
+    else:
+        with tarfile.open(dest) as tar:
+            names = tar.getnames()
+    assert not any(name.endswith(("fifo", ".sock")) for name in names)
@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+from pygeonhole import SUCCESS, database, hashing, pygeonhole
+
+@pytest.fixture
+def mock_tree(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    src.mkdir()
+    big = b"x" * (hashing.HEAD_SIZE + 10)
+    (src / "a.txt").write_text("same")
+    (src / "b.txt").write_text("same")
+    (src / "c.txt").write_text("diff")
+    (src / "big1.bin").write_bytes(big)
+    (src / "big2.bin").write_bytes(big)
+    (src / "big3.bin").write_bytes(b"y" + big[1:])
+    (src / "empty1").write_bytes(b"")
+    (src / "empty2").write_bytes(b"")
+    monkeypatch.chdir(src)
+    return src
+
+def _items(src):
+    return [(path.name, str(path), path.stat()) for path in sorted(src.iterdir())]
+
+def test_find_duplicates(mock_tree):
+    cache = hashing.HashCache()
+    dupes_result = hashing.find_duplicates(_items(mock_tree), workers=2, cache=cache)
+    assert dupes_result.error == SUCCESS
+    assert [group.names for group in dupes_result.groups] == [["big1.bin", "big2.bin"], ["a.txt", "b.txt"]]
+    # big3.bin differs in its first bytes, so it is never hashed in full
+    assert dupes_result.hashed == 5
+
+    dupes_result = hashing.find_duplicates(_items(mock_tree), workers=2, cache=cache)
+    assert dupes_result.hashed == 0
+    assert len(dupes_result.groups) == 2
+
+def test_hash_cache(mock_tree, tmp_path):
+    cache_path = tmp_path / ".ph_hashes.json"
+    cache = hashing.HashCache()
+    stats = (mock_tree / "a.txt").stat()
+    digest = hashing.file_digest("a.txt", stats, cache)
+    assert digest == hashing.file_digest("b.txt", (mock_tree / "b.txt").stat(), cache)
+    assert hashing.file_digest(".", mock_tree.stat(), cache) == "--"
+    assert cache.save(cache_path) == SUCCESS
+    assert list(json.loads(cache_path.read_text()).values()) == [digest, digest]
+
+    reloaded = hashing.HashCache()
+    reloaded.load(cache_path)
+    assert reloaded.get(stats) == digest
+
+    (mock_tree / "a.txt").write_text("changed")
+    assert reloaded.get((mock_tree / "a.txt").stat()) is None
+
+def test_hash_column(mock_tree, tmp_path):
+    mock_db = tmp_path / ".ph.json"
+    mock_flags = tmp_path / ".ph_flags.json"
+    with mock_db.open("w") as db:
+        json.dump([dict.fromkeys(["Name", "Hash"], "")], db, indent=4)
+    with mock_flags.open("w") as db:
+        json.dump({"show_hidden": False, "show_dirs": False}, db, indent=4)
+
+    phc = pygeonhole.PH_Controller(mock_db, mock_flags)
+    assert phc.refresh_db().error == SUCCESS
+    digests = {item["Name"]: item["Hash"] for item in phc.get_db_data().data}
+    assert digests["a.txt"] == digests["b.txt"] != digests["c.txt"]
+    assert phc.flush() == SUCCESS
+    assert hashing.hash_cache_path(mock_db).exists()
+
+    dupes_result = phc.find_duplicates(workers=2)
+    assert dupes_result.error == SUCCESS
+    # The Hash column already cached every digest
+    assert dupes_result.hashed == 0
+    assert len(dupes_result.groups) == 2
+    assert "Hash" in database.ITEM_DATA
@@ -0,0 +1,38 @@
+import json
+
+from pygeonhole import SUCCESS, database, profiling, pygeonhole
+
+def test_profile_refresh(tmp_path):
+    (tmp_path / "a.txt").write_text("a")
+    (tmp_path / "b.txt").write_text("bb")
+    mock_db = tmp_path / ".ph.json"
+    mock_flags = tmp_path / ".ph_flags.json"
+    with mock_db.open("w") as db:
+        json.dump([dict.fromkeys(database.DEFAULT_COLUMNS, "")], db, indent=4)
+    with mock_flags.open("w") as db:
+        json.dump({"show_hidden": False, "show_dirs": False}, db, indent=4)
+
+    profiling.start()
+    try:
+        phc = pygeonhole.PH_Controller(mock_db, mock_flags, deferred=True)
+        assert phc.refresh_db(tmp_path).error == SUCCESS
+        assert phc.flush() == SUCCESS
+    finally:
+        profile = profiling.stop()
+
+    summary = profile.summary()
+    assert ["refresh", "flags_read", "db_read", "scan", "format", "db_write", "flags_write"] == list(
+        summary["phases"]
+    )
+    assert summary["phases"]["db_write"]["calls"] == 1
+    assert summary["counts"]["scandir"] == 1
+    assert summary["counts"]["stat"] == 2
+    assert summary["counts"]["rows_formatted"] == 2
+    assert summary["counts"]["db_bytes_written"] == mock_db.stat().st_size
+    assert "refresh" in profile.format_table()
+
+def test_disabled_profile_records_nothing():
+    assert not profiling.enabled()
+    with profiling.phase("scan"):
+        profiling.count("stat")
+    assert profiling.stop() is None
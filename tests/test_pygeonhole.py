@@ -1,11 +1,15 @@
 import json
+import os
 import pytest
 from typer.testing import CliRunner
 
 from pygeonhole import (
+    QUERY_ERROR,
     SUCCESS,
     __app_name__,
     __version__,
+    database,
+    hashing,
     pygeonhole,
 )
 
@@ -140,3 +144,300 @@ def test_set_flags(mock_db, mock_flags, flags):
     assert write_result.error == SUCCESS
     read_result = phc.get_flags_data()
     assert read_result.flags == flags
+
+def test_get_dir_entries(mock_db, mock_flags, mock_dir):
+    with mock_flags.open("w") as db:
+        json.dump({"show_hidden": False, "show_dirs": True}, db, indent=4)
+
+    phc = pygeonhole.PH_Controller(mock_db, mock_flags)
+    entries_result = phc.get_dir_entries(mock_dir)
+    assert entries_result.error == SUCCESS
+    assert [entry.name for entry in entries_result.dir_data] == ["testing", "test.txt"]
+    assert [entry.is_dir for entry in entries_result.dir_data] == [True, False]
+    assert entries_result.dir_data[1].stats.st_size == 11
+
+def test_format_item_custom_column(mock_db, mock_flags, mock_dir):
+    database.register_column("Double Size", lambda item_name, stats: str(stats.st_size * 2))
+    with mock_db.open("w") as db:
+        json.dump([dict.fromkeys(["Name", "Size", "Ext.", "Double Size"], "")], db, indent=4)
+
+    phc = pygeonhole.PH_Controller(mock_db, mock_flags)
+    stats = (mock_dir / "test.txt").stat()
+    format_result = phc.format_item("test.txt", stats)
+    assert format_result.error == SUCCESS
+    assert format_result.item_data["_stat"][1] == 11
+    assert format_result.item_data["_Size"] == 11
+    assert {
+        key: value for key, value in format_result.item_data.items() if not key.startswith("_")
+    } == {
+        "Name": "test.txt", "Size": "11", "Ext.": ".txt", "Double Size": "22"
+    }
+
+def test_format_items_reads_schema_once(mock_db, mock_flags, mock_dir, monkeypatch):
+    with mock_db.open("w") as db:
+        json.dump([dict.fromkeys(database.DEFAULT_COLUMNS, "")], db, indent=4)
+    with mock_flags.open("w") as db:
+        json.dump({"show_hidden": True, "show_dirs": True}, db, indent=4)
+
+    phc = pygeonhole.PH_Controller(mock_db, mock_flags)
+    entries = phc.get_dir_entries(mock_dir).dir_data
+    reads = []
+    read_db_data = phc._db_handler.read_db_data
+    monkeypatch.setattr(phc._db_handler, "read_db_data", lambda: reads.append(1) or read_db_data())
+
+    format_result = phc.format_items(entries)
+    assert format_result.error == SUCCESS
+    assert len(format_result.items_data) == len(entries)
+    assert len(reads) == 1
+
+def test_refresh_db(mock_db, mock_flags, mock_dir):
+    with mock_db.open("w") as db:
+        json.dump([dict.fromkeys(database.DEFAULT_COLUMNS, "")], db, indent=4)
+    with mock_flags.open("w") as db:
+        json.dump({"show_hidden": True, "show_dirs": False}, db, indent=4)
+
+    phc = pygeonhole.PH_Controller(mock_db, mock_flags)
+    refresh_result = phc.refresh_db(mock_dir)
+    assert refresh_result.error == SUCCESS
+    assert refresh_result.changed
+    assert sorted(item["Name"] for item in phc.get_db_data().data) == [".hidden_test", "test.txt"]
+
+    db_mtime = mock_db.stat().st_mtime_ns
+    refresh_result = phc.refresh_db(mock_dir)
+    assert refresh_result.error == SUCCESS
+    assert not refresh_result.changed
+    assert mock_db.stat().st_mtime_ns == db_mtime
+
+    (mock_dir / ".hidden_test").unlink()
+    (mock_dir / "test.txt").write_text("Hello World, again")
+    (mock_dir / "new.txt").write_text("new")
+    refresh_result = phc.refresh_db(mock_dir)
+    assert refresh_result.changed
+    names_sizes = [(item["Name"], item["Size"]) for item in phc.get_db_data().data]
+    assert names_sizes == [("test.txt", "18"), ("new.txt", "3")]
+
+def test_refresh_db_other_directory(mock_db, mock_flags, mock_dir, monkeypatch):
+    (mock_dir / "sub").mkdir()
+    (mock_dir / "sub" / "inner.txt").write_text("inner")
+    with mock_db.open("w") as db:
+        json.dump([dict.fromkeys(["Name", "Mode", "Hash", "Total Size"], "")], db, indent=4)
+    with mock_flags.open("w") as db:
+        json.dump({"show_hidden": False, "show_dirs": True}, db, indent=4)
+    # Hash and Total Size follow the directory listed, not the current one
+    monkeypatch.chdir(mock_db.parent)
+
+    phc = pygeonhole.PH_Controller(mock_db, mock_flags)
+    refresh_result = phc.refresh_db(str(mock_dir))
+    assert refresh_result.error == SUCCESS
+    items = {item["Name"]: item for item in refresh_result.items_data}
+    assert items["test.txt"]["Hash"] == hashing.file_digest(
+        str(mock_dir / "test.txt"), (mock_dir / "test.txt").stat()
+    ) != ""
+    assert items["test.txt"]["Total Size"] == "11"
+    assert items["sub"]["Total Size"] == "5"
+    assert items["sub"]["_Total Size"] == 5
+
+@pytest.mark.parametrize("db_name", [".ph.json", ".ph.sqlite", ".ph.phc"])
+def test_backends(tmp_path, mock_flags, db_name):
+    mock_db = tmp_path / db_name
+    databases = [dir_result, file_result, dict(hidden_result, _stat=[1, 19, 2, 3])]
+    phc = pygeonhole.PH_Controller(mock_db, mock_flags)
+    assert phc.set_db_data(databases).error == SUCCESS
+    assert phc.get_db_data().data == databases
+
+    sort_result = phc.sort_db_data("Name", True, True)
+    assert sort_result.error == SUCCESS
+    assert [item["Name"] for item in sort_result.data] == ["testing", "test.txt", ".hidden_test"]
+    reread = pygeonhole.PH_Controller(mock_db, mock_flags)
+    assert reread.get_db_data().data == sort_result.data
+
+    changed = [dict(file_result, Size="12")]
+    new_db = [dir_result, dict(file_result, Size="12")]
+    update_result = phc.update_db_data(new_db, changed, [".hidden_test"])
+    assert update_result.error == SUCCESS
+    reread = pygeonhole.PH_Controller(mock_db, mock_flags)
+    assert reread.get_db_data().data == new_db
+
+@pytest.mark.parametrize("db_name", [".ph.json", ".ph.sqlite", ".ph.phc"])
+def test_sort_typed_keys(tmp_path, mock_flags, db_name):
+    mock_db = tmp_path / db_name
+    databases = [
+        dict(file_result, Name="b.txt", Size="9", _Size=9),
+        dict(dir_result, _Size=-1),
+        dict(file_result, Name="a.txt", Size="10", _Size=10),
+    ]
+    phc = pygeonhole.PH_Controller(mock_db, mock_flags)
+    phc.set_db_data(databases)
+
+    for _ in range(2):
+        sort_result = phc.sort_db_data("Size", True, False)
+        assert sort_result.error == SUCCESS
+        assert [item["Size"] for item in sort_result.data] == ["10", "9", "--"]
+    sort_result = phc.sort_db_data("Size", False, False)
+    assert [item["Size"] for item in sort_result.data] == ["--", "9", "10"]
+    sort_result = phc.sort_db_data("Name", True, True)
+    assert [item["Name"] for item in sort_result.data] == ["testing", "b.txt", "a.txt"]
+    reread = pygeonhole.PH_Controller(mock_db, mock_flags)
+    assert reread.get_db_data().data == sort_result.data
+
+@pytest.mark.parametrize("db_name", [".ph.json", ".ph.sqlite", ".ph.phc"])
+def test_sort_multiple_keys(tmp_path, mock_flags, db_name):
+    mock_db = tmp_path / db_name
+    databases = [
+        dict(file_result, Name="b.txt", Size="10", _Size=10),
+        dict(dir_result, Name="src", Mode="drwxrwxr-x", _Size=-1),
+        dict(file_result, Name="a.md", Size="10", _Size=10, **{"Ext.": ".md"}),
+        dict(dir_result, _Size=-1),
+        dict(file_result, Name="c.txt", Size="9", _Size=9),
+    ]
+    phc = pygeonhole.PH_Controller(mock_db, mock_flags)
+    phc.set_db_data(databases)
+
+    keys = [("Size", True), ("Name", False)]
+    top_result = phc.top_db_data(keys, False, 3)
+    assert [item["Name"] for item in top_result.data] == ["a.md", "b.txt", "c.txt"]
+    assert phc.get_db_data().data == databases
+
+    sort_result = phc.sort_db_data_by(keys, False)
+    assert sort_result.error == SUCCESS
+    assert [item["Name"] for item in sort_result.data] == ["a.md", "b.txt", "c.txt", "src", "testing"]
+    reread = pygeonhole.PH_Controller(mock_db, mock_flags)
+    assert reread.get_db_data().data == sort_result.data
+
+    # Every directory leads, whatever its permissions
+    keys = [("Ext.", False), ("Name", True)]
+    sort_result = phc.sort_db_data_by(keys, True)
+    assert [item["Name"] for item in sort_result.data] == ["testing", "src", "a.md", "c.txt", "b.txt"]
+    assert phc.top_db_data(keys, True, 4).data == sort_result.data[:4]
+
+def test_columnar_backend(tmp_path):
+    rows = [
+        dict(file_result, Name=f"{i}.txt", Size=str(i * 37 % 11), _Size=i * 37 % 11, _stat=[i, i, i, i])
+        for i in range(50)
+    ] + [dict(dir_result, _Size=-1, _stat=[50, 0, 0, 0])]
+    json_handler = database.DatabaseHandler(tmp_path / ".ph.json")
+    columnar_handler = database.DatabaseHandler(tmp_path / ".ph.phc")
+    json_handler.write_db_data(rows)
+    columnar_handler.write_db_data(rows)
+    assert (tmp_path / ".ph.phc").stat().st_size < (tmp_path / ".ph.json").stat().st_size / 3
+
+    stored = columnar_handler.read_db_data().data
+    assert stored == rows
+    sort_result = columnar_handler.sort_db_data(stored, "Size", True, True)
+    assert sort_result.data[:] == json_handler.sort_db_data(rows, "Size", True, True).data
+    assert columnar_handler.reorder_db_data(sort_result.data, "Size", True, True).error == SUCCESS
+    assert columnar_handler.read_db_data().data == sort_result.data
+
+def test_columns_outlive_empty_directory(mock_db, mock_flags, tmp_path):
+    columns = database.DEFAULT_COLUMNS + ["Inode"]
+    with mock_db.open("w") as db:
+        json.dump([dict.fromkeys(columns, "")], db, indent=4)
+    with mock_flags.open("w") as db:
+        json.dump({"show_hidden": False, "show_dirs": False, "columns": columns}, db, indent=4)
+    empty = tmp_path / "empty"
+    empty.mkdir()
+
+    phc = pygeonhole.PH_Controller(mock_db, mock_flags)
+    assert phc.refresh_db(empty).error == SUCCESS
+    assert phc.get_db_data().data == []
+    (empty / "later.txt").write_text("later")
+    refresh_result = phc.refresh_db(empty)
+    assert refresh_result.error == SUCCESS
+    assert "Inode" in refresh_result.items_data[0].keys()
+    assert phc.get_columns().columns == columns
+
+def test_deferred_controller_io(mock_db, mock_flags, mock_dir):
+    with mock_db.open("w") as db:
+        json.dump([dict.fromkeys(database.DEFAULT_COLUMNS, "")], db, indent=4)
+    with mock_flags.open("w") as db:
+        json.dump({"show_hidden": True, "show_dirs": False}, db, indent=4)
+
+    phc = pygeonhole.PH_Controller(mock_db, mock_flags, deferred=True)
+    assert phc.refresh_db(mock_dir).changed
+    assert phc.sort_db_data("Name", False, True).error == SUCCESS
+    phc.get_columns()
+    phc.get_flags_data()
+    assert not mock_db.read_text().count("test.txt")
+    assert phc.flush() == SUCCESS
+    assert phc.io_counts == {"db_reads": 1, "db_writes": 1, "flags_reads": 1, "flags_writes": 1}
+
+    reread = pygeonhole.PH_Controller(mock_db, mock_flags)
+    assert [item["Name"] for item in reread.get_db_data().data] == [".hidden_test", "test.txt"]
+    assert reread.get_flags_data().flags["maxlen"]
+
+@pytest.mark.parametrize("depth, expected", [
+    (0, ["test.txt"]),
+    (1, ["test.txt", "testing/inner.txt"]),
+    (-1, ["test.txt", "testing/inner.txt", "testing/deeper/deep.txt"]),
+])
+def test_get_dir_entries_depth(mock_db, mock_flags, mock_dir, depth, expected):
+    (mock_dir / "testing" / "deeper").mkdir(parents=True)
+    (mock_dir / "testing" / "inner.txt").write_text("inner")
+    (mock_dir / "testing" / "deeper" / "deep.txt").write_text("deep")
+    with mock_flags.open("w") as db:
+        json.dump({"show_hidden": False, "show_dirs": False, "depth": depth}, db, indent=4)
+
+    phc = pygeonhole.PH_Controller(mock_db, mock_flags)
+    entries_result = phc.get_dir_entries(mock_dir, workers=2)
+    assert entries_result.error == SUCCESS
+    assert [entry.name for entry in entries_result.dir_data] == expected
+
+@pytest.mark.parametrize("where, no_show, expected", [
+    ("", [], [".hidden_test", "test.txt", "testing"]),
+    ("ext:.txt", [], ["test.txt"]),
+    ("ext:", [], [".hidden_test", "testing"]),
+    ("!type:d name:*test*", [], [".hidden_test", "test.txt"]),
+    ("re:^t size>=1", [], ["test.txt"]),
+    ("size>11", [], [".hidden_test"]),
+    ("age<1d", ["test*"], [".hidden_test"]),
+    ("mtime<2000-01-01", [], []),
+])
+def test_get_dir_entries_where(mock_db, mock_flags, mock_dir, where, no_show, expected):
+    with mock_flags.open("w") as db:
+        json.dump({"show_hidden": True, "show_dirs": True, "where": where, "no_show": no_show}, db, indent=4)
+
+    phc = pygeonhole.PH_Controller(mock_db, mock_flags)
+    entries_result = phc.get_dir_entries(mock_dir)
+    assert entries_result.error == SUCCESS
+    assert sorted(entry.name for entry in entries_result.dir_data) == expected
+
+def test_where_skips_stat(mock_db, mock_flags, mock_dir, monkeypatch):
+    with mock_flags.open("w") as db:
+        json.dump({"show_hidden": True, "show_dirs": False, "where": "ext:.txt size>1"}, db, indent=4)
+    stat_calls = []
+
+    class Entry:
+        def __init__(self, entry):
+            self._entry = entry
+            self.name = entry.name
+            self.is_dir = entry.is_dir
+            self.is_file = entry.is_file
+            self.is_symlink = entry.is_symlink
+
+        def stat(self):
+            stat_calls.append(self.name)
+            return self._entry.stat()
+
+    scandir = os.scandir
+
+    class Scandir:
+        def __init__(self, path):
+            self._it = scandir(path)
+
+        def __enter__(self):
+            return (Entry(entry) for entry in self._it)
+
+        def __exit__(self, *args):
+            self._it.close()
+
+    monkeypatch.setattr(os, "scandir", Scandir)
+    phc = pygeonhole.PH_Controller(mock_db, mock_flags)
+    assert [entry.name for entry in phc.get_dir_entries(mock_dir).dir_data] == ["test.txt"]
+    assert stat_calls == ["test.txt"]
+
+def test_invalid_where(mock_db, mock_flags, mock_dir):
+    with mock_flags.open("w") as db:
+        json.dump({"show_hidden": False, "show_dirs": False, "where": "size>lots"}, db, indent=4)
+
+    phc = pygeonhole.PH_Controller(mock_db, mock_flags)
+    assert phc.get_dir_entries(mock_dir).error == QUERY_ERROR
@@ -0,0 +1,36 @@
+import json
+
+import pytest
+
+from pygeonhole.backends import JsonBackend
+from pygeonhole.rows import MISSING, Row, json_default, schema_of
+
+item = {"Name": "test.txt", "Mode": "-rw-r--r--", "Size": "11", "_stat": [1, 11, 2, 3]}
+
+def test_row_behaves_like_its_dict():
+    row = Row.from_dict(item)
+    assert row == item and item == row
+    assert list(row) == list(item) and len(row) == len(item)
+    assert row["Size"] == "11" and row.get("Ext.") is None and "Mode" in row
+    assert dict(row, Size="12") == dict(item, Size="12")
+    assert Row.from_dict(dict(item, Size="12")) != row
+    with pytest.raises(KeyError):
+        row["Ext."]
+
+def test_rows_share_schema_and_values():
+    first = Row.from_dict(item)
+    second = Row.from_dict(json.loads(json.dumps(item)))
+    assert first._schema is second._schema
+    assert first["Mode"] is second["Mode"]
+
+def test_missing_values():
+    row = Row(schema_of(("Name", "Size")), ("a", MISSING))
+    assert "Size" not in row and list(row) == ["Name"] and row == {"Name": "a"}
+    assert json.dumps(row, default=json_default) == '{"Name": "a"}'
+
+def test_json_backend_round_trip(tmp_path):
+    backend = JsonBackend(tmp_path / ".ph.json")
+    backend.write([Row.from_dict(item), item])
+    data = backend.read()
+    assert all(isinstance(row, Row) for row in data)
+    assert data == [item, item]
@@ -0,0 +1,24 @@
+import subprocess
+import sys
+
+import pytest
+
+# The import time itself is measured by benchmarks/bench_import.py
+
+def _run(code: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+
+@pytest.mark.parametrize("module", [
+    "sqlite3", "concurrent.futures", "hashlib", "tempfile", "shlex", "pygeonhole.export",
+    "pygeonhole.sqlite_backend", "pygeonhole.daemon", "pygeonhole.hashing", "pygeonhole.dirsize",
+    "pygeonhole.query", "pygeonhole.catalogue", "pygeonhole.statcache",
+])
+def test_deferred_imports(module):
+    result = _run(f"import sys, pygeonhole.cli; print({module!r} in sys.modules)")
+    assert result.stdout.strip() == "False"
+
+def test_version_fast_path():
+    code = "import sys; sys.argv = ['pygeonhole-cli', '--version']; "
+    code += "from pygeonhole.__main__ import main; main(); print('typer' in sys.modules)"
+    result = _run(code)
+    assert result.stdout.splitlines()[-1] == "False"